@@ -7,36 +7,26 @@ Created on Mon Nov  3 16:23:21 2025
 
 from __future__ import annotations
 import os
-import re
-import json
 import time
+import threading
 import streamlit as st
-import pandas as pd
-from typing import List, Dict, Any
-
-from config import APP_TITLE_ES, APP_TITLE_EN, DEFAULT_ENV_XLS_PATH, DEFAULT_ENV_TXT_PATH, TOPK_CANDIDATES, TOPK_FINAL
-from rag_build import load_catalog, RAGIndex
-from ranker import rerank
-from chat_orchestrator import ProfileState, ChatOpenAI, update_state_from_text, build_query_from_state, llm_intro_coach, llm_explain_track
-from pdf_utils import build_path_pdf
-
+from concurrent.futures import Future
 
-# ---------------------------
-# Helpers
-# ---------------------------
-def tokenize_kw(s: str) -> List[str]:
-    toks = [t.strip().lower()
-            for t in re.split(r"[,\;/]| y | and ", s or "") if t.strip()]
-    out = []
-    for t in toks:
-        out.extend([w for w in re.split(r"\s+", t) if w])
-    return list(dict.fromkeys(out))
+from config import APP_TITLE_ES, APP_TITLE_EN, DEFAULT_ENV_XLS_PATH, DEFAULT_ENV_TXT_PATH, TOPK_CANDIDATES, TOPK_FINAL, INDEX_CACHE_DIR, RANK_WEIGHTS, RECO_CACHE_SIZE, RECO_CACHE_TTL_S, LLM_CACHE_PATH, LLM_CACHE_SIZE, LLM_CACHE_TTL_S, LLM_CACHE_SEMANTIC, PDF_CACHE_SIZE
+from caching import LRUTTLCache
+from tracing import TRACER, RerunProfile, record, span, stage_rows
+# rag_build, reco_service, chat_orchestrator (pandas/scipy/httpx) y pdf_utils
+# (reportlab) se importan recién cuando hacen falta: el primer render sin
+# catálogo no los paga
 
 
 # ---------------------------
 # UI Config
 # ---------------------------
 st.set_page_config(page_title="Coach Vocacional · Rutas", layout="wide")
+# Trazas: duración total del rerun y, si se pidió desde el panel admin, cProfile
+rerun_t0 = time.perf_counter()
+rerun_profile = RerunProfile() if st.session_state.pop("profile_next_rerun", False) else None
 LANG = st.session_state.get("lang", "es")
 
 title = APP_TITLE_ES if LANG == "es" else APP_TITLE_EN
@@ -53,17 +43,102 @@ with st.sidebar:
     st.markdown("**Opcional:** Subir TXT de ejemplo")
     txt_file = st.file_uploader("TXT (.txt)", type=["txt"], key="txt")
 
-# Cargar catálogo
-catalog = pd.DataFrame()
+# Cargar catálogo + índice RAG (snapshot en disco por hash del Excel)
+source = None
 if xls_file is not None:
-    catalog = load_catalog(xls_file)
+    source = xls_file
 elif use_env and os.path.exists(DEFAULT_ENV_XLS_PATH):
-    catalog = load_catalog(DEFAULT_ENV_XLS_PATH)
+    source = DEFAULT_ENV_XLS_PATH
 
-if catalog.empty:
+
+@st.cache_resource(show_spinner=False)
+def _prewarm() -> Future | None:
+    # Una vez por proceso, en el primer script run (Streamlit no expone un hook
+    # de arranque del servidor): el índice del catálogo del entorno se carga o
+    # construye en un hilo mientras se dibuja la primera página
+    if not os.path.exists(DEFAULT_ENV_XLS_PATH):
+        return None
+    fut: Future = Future()
+
+    def run():
+        try:
+            from rag_build import load_or_build_index
+            fut.set_result(load_or_build_index(DEFAULT_ENV_XLS_PATH, INDEX_CACHE_DIR))
+        except BaseException as e:
+            fut.set_exception(e)
+
+    threading.Thread(target=run, name="prewarm-index", daemon=True).start()
+    return fut
+
+
+warm_index = _prewarm()
+
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _build_index(fingerprint: str, _source):
+    # `_source` no se hashea: la clave de caché es solo el fingerprint. Al
+    # cambiar el catálogo se conserva la versión anterior para sesiones en curso
+    from rag_build import load_or_build_index
+    if warm_index is not None and isinstance(_source, str) and _source == DEFAULT_ENV_XLS_PATH:
+        index = warm_index.result()   # espera al prewarm en vez de construir dos veces
+        if index is not None and index.fingerprint == fingerprint:
+            return index
+    return load_or_build_index(_source, INDEX_CACHE_DIR, fingerprint=fingerprint)
+
+
+with span("app.index"):
+    rag_index = None
+    if source is not None:
+        # Hash del Excel memoizado por ruta+mtime o file_id: el rerun no relee el archivo
+        from rag_build import source_fingerprint
+        rag_index = _build_index(source_fingerprint(source), source)
+if rag_index is None:
     st.info("Sube el Excel para comenzar.")
     st.stop()
 
+import pandas as pd
+from rag_build import SessionScorer
+from chat_orchestrator import ProfileState, ChatOpenAI, update_state_from_text, intro_coach_messages
+from llm_cache import LLMResponseCache
+from reco_service import RecommendationService
+
+catalog = rag_index.df
+
+
+@st.cache_resource(show_spinner=False)
+def _reco_cache():
+    # Una instancia por proceso: la comparten todas las sesiones
+    return LRUTTLCache(maxsize=RECO_CACHE_SIZE, ttl=RECO_CACHE_TTL_S)
+
+
+reco_cache = _reco_cache()
+
+
+@st.cache_resource(show_spinner=False)
+def _service(fingerprint: str, _index):
+    # Pipeline sin UI (el mismo que usan los jobs batch); features una vez por catálogo
+    return RecommendationService(_index, reco_cache=reco_cache)
+
+
+service = _service(rag_index.fingerprint, rag_index)
+
+
+@st.cache_resource(show_spinner=False)
+def _llm_cache():
+    # Persistente en disco: sobrevive reinicios del servidor
+    return LLMResponseCache(LLM_CACHE_PATH, maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL_S)
+
+
+llm_cache = _llm_cache()
+
+
+@st.cache_resource(show_spinner=False)
+def _pdf_cache():
+    return LRUTTLCache(maxsize=PDF_CACHE_SIZE)
+
+
+pdf_cache = _pdf_cache()
+
 # Campos dependientes: valores únicos dinámicos
 sheets = sorted(catalog["_sheet"].dropna().unique().tolist())
 areas = sorted(list(dict.fromkeys(
@@ -72,16 +147,6 @@ levels = [x for x in ["Básico", "Intermedio", "Avanzado"]
           if x in catalog["Nivel de complejidad"].astype(str).unique()]
 access_opts = ["REA", "Redireccionamiento", "Moodle"]
 
-# Construir índice RAG
-
-
-@st.cache_resource(show_spinner=False)
-def _build_index(df: pd.DataFrame):
-    return RAGIndex(df)
-
-
-rag_index = _build_index(catalog)
-
 # Estado de perfil/conversación
 if "profile" not in st.session_state:
     st.session_state.profile = ProfileState(language=LANG)
@@ -114,6 +179,35 @@ with st.sidebar:
     st.markdown("---")
     st.caption("Consejo: si no sabes qué elegir, ¡usa el chat evocador! 😊")
 
+    # Admin: pesos de ranking en caliente (solo re-puntúa, no re-recupera)
+    with st.expander("Admin · Pesos de ranking"):
+        weights = {k: st.number_input(k, min_value=0.0, max_value=10.0, value=float(v),
+                                      step=0.5, key=f"w_{k}")
+                   for k, v in RANK_WEIGHTS.items()}
+        st.caption("Caché de recomendaciones: " + " · ".join(
+            f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}"
+            for k, v in reco_cache.stats().items()))
+        st.caption("Caché LLM: " + " · ".join(
+            f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}"
+            for k, v in llm_cache.stats().items()))
+
+    # Admin: tiempos por etapa (spans) + cProfile de un rerun
+    with st.expander("Admin · Tiempos por etapa"):
+        TRACER.enabled = st.checkbox("Medir etapas", value=TRACER.enabled, key="trace_on")
+        st.button("Perfilar este rerun (cProfile)",
+                  on_click=lambda: st.session_state.update(profile_next_rerun=True))
+        stages = TRACER.snapshot()
+        if stages:
+            st.dataframe(pd.DataFrame(stage_rows(stages)), hide_index=True)
+        else:
+            st.caption("Sin muestras: activa la medición y usa la app.")
+        c_json, c_prom, c_reset = st.columns(3)
+        c_json.download_button("JSON", data=TRACER.to_json, file_name="etapas.json",
+                               mime="application/json")
+        c_prom.download_button("Prometheus", data=TRACER.to_prometheus, file_name="etapas.prom",
+                               mime="text/plain")
+        c_reset.button("Reiniciar", on_click=TRACER.reset)
+
 
 # Columna principal: Chat evocador + resultados
 col_chat, col_results = st.columns([1.1, 1.4])
@@ -147,24 +241,28 @@ with col_chat:
             {"role": "user", "content": user_input})
         # Actualiza slots
         state = update_state_from_text(state, user_input)
-        # Decide siguiente pregunta / respuesta con LLM (o fallback)
-        llm = ChatOpenAI()
-        reply = llm_intro_coach(llm, state, user_input)
+        with st.chat_message("user"):
+            st.markdown(user_input)
+        # Decide siguiente pregunta / respuesta con LLM (o fallback), en stream
+        llm = ChatOpenAI(cache=llm_cache)
 
         # Avanza pasos de entrevista
         state.step += 1
         # Siguiente pregunta guiada (simple)
         from chat_orchestrator import EVOCATIVE_QUESTIONS_ES, FOLLOWUP_ES
         if state.step < len(EVOCATIVE_QUESTIONS_ES):
-            reply = reply + "\n\n" + EVOCATIVE_QUESTIONS_ES[state.step]
+            next_q = EVOCATIVE_QUESTIONS_ES[state.step]
         elif state.step == len(EVOCATIVE_QUESTIONS_ES):
-            reply = reply + "\n\n" + FOLLOWUP_ES[0]
+            next_q = FOLLOWUP_ES[0]
         else:
             # Cuando ya hay suficiente contexto, ofrecer generar ruta
-            reply = reply + "\n\n¿Te propongo una ruta inicial y la ajustamos juntos?"
+            next_q = "¿Te propongo una ruta inicial y la ajustamos juntos?"
 
+        with st.chat_message("assistant"):
+            reply = st.write_stream(llm.stream(intro_coach_messages(state, user_input)))
+            st.markdown(next_q)
         st.session_state.chat_history.append(
-            {"role": "assistant", "content": reply})
+            {"role": "assistant", "content": reply + "\n\n" + next_q})
 
     # Botón para proponer ruta desde el chat
     propose = st.button("Proponer ruta desde la conversación")
@@ -175,65 +273,59 @@ with col_chat:
 
 with col_results:
     st.subheader("Ruta sugerida (RAG + Ranking)")
-    # Construye query híbrida desde el perfil
-    query_text = build_query_from_state(state)
-    user_tokens = tokenize_kw(
-        (state.keywords_text or "") + " " + " ".join(state.interests or []))
-
-    # Recuperar candidatos
-    fused = rag_index.hybrid_search(query_text, topk=TOPK_CANDIDATES)
-
-    # Filtrar por metadatos (post-retrieval) según selección explícita del usuario
-    def pass_filters(row: pd.Series) -> bool:
-        if state.area and (row.get("Grupo de Competencias") != state.area) and (row.get("_sheet") != state.area):
-            return False
-        if state.level and str(row.get("Nivel de complejidad", "")).strip() != state.level:
-            return False
-        if state.access and state.access.lower() not in str(row.get("Tipo de Acceso (REA o Redireccionamiento)", "")).lower():
-            return False
-        if state.population and state.population.lower() not in str(row.get("Población objetivo", "")).lower():
-            return False
-        if state.max_hours is not None:
-            try:
-                h = float(row.get("_horas", 1e9))
-                if h > float(state.max_hours):
-                    return False
-            except Exception:
-                pass
-        return True
-
-    filtered = [c for c in fused if pass_filters(c["row"])]
-
-    # Ranking final
-    ranked = rerank(filtered, profile=state.model_dump(),
-                    user_tokens=user_tokens)
-    ranked = ranked[:TOPK_FINAL]
+    # Consulta desde el perfil, recuperación filtrada dentro del índice y
+    # rerank. Candidatos + features por sesión: si solo cambian los pesos,
+    # el ranking es un producto matriz-vector; el scorer de la sesión re-puntúa
+    # solo los términos de la consulta que cambiaron desde el turno anterior
+    if "feature_cache" not in st.session_state:
+        st.session_state.feature_cache = LRUTTLCache(maxsize=16)
+    if "scorer" not in st.session_state:
+        st.session_state.scorer = SessionScorer()
+    with span("app.retrieve"):
+        ranked = service.recommend(state, weights, feature_cache=st.session_state.feature_cache,
+                                   scorer=st.session_state.scorer)
 
     # Explicación por LLM y controles
-    llm = ChatOpenAI()
+    llm = ChatOpenAI(cache=llm_cache)
     if ranked:
-        with st.expander("Explicación del plan (coach)"):
-            st.write(llm_explain_track(llm, state, ranked))
+        # La llamada arranca ya en segundo plano; las tarjetas se dibujan
+        # mientras tanto y el texto se vuelca al final en el expander.
+        # Misma ruta + mismo perfil relevante -> texto desde la caché
+        explanation = service.explain(state, ranked, llm, semantic=LLM_CACHE_SEMANTIC)
+        explain_box = st.expander("Explicación del plan (coach)")
+        # Ruta ya secuenciada por el servicio (presupuesto de horas + nivel)
+        total_h = pd.Series([c["row"].get("_horas") for c in ranked], dtype=float).sum()
+        # Niveles presentes, en el orden de la ruta (sin nivel -> se omite)
+        path_levels = list(dict.fromkeys(
+            str(v).strip() for v in (c["row"].get("Nivel de complejidad") for c in ranked)
+            if not pd.isna(v) and str(v).strip()))
+        st.caption(" · ".join([f"{len(ranked)} cursos",
+                               f"{total_h:g} h de {state.max_hours:g} h disponibles"]
+                              + ([" → ".join(path_levels)] if path_levels else [])))
 
         # Render cards
-        for c in ranked:
-            r = c["row"]
-            with st.container(border=True):
-                st.markdown(f"### {r.get('Curso', '(sin nombre)')}")
-                st.write(f"**Nivel:** {r.get('Nivel de complejidad', '')
-                                       }  |  **Duración:** {r.get('Duración del Curso', '')}")
-                st.write(
-                    f"**Portal/Aliado:** {r.get('Portal o Aliado', '')}  |  **Categoría:** {r.get('_sheet', '')}")
-                url = str(r.get("URL del Curso", "") or "")
-                if url.strip():
-                    st.markdown(f"[🔗 Ir al curso]({url})")
-                st.caption(
-                    f"**Por qué aparece:** tfidf/bm25 + filtros + perfil.")
-                st.write(str(r.get("Descripción del Curso", "") or ""))
-                st.caption(
-                    f"**Competencias:** {str(r.get('Competencia que se fomenta con el curso', '') or '')}")
-                st.caption(
-                    f"**Habilidades:** {str(r.get('Habilidad', '') or '')}")
+        with span("app.cards"):
+            for c in ranked:
+                r = c["row"]
+                with st.container(border=True):
+                    st.markdown(f"### {r.get('Curso', '(sin nombre)')}")
+                    st.write(f"**Nivel:** {r.get('Nivel de complejidad', '')
+                                           }  |  **Duración:** {r.get('Duración del Curso', '')}")
+                    st.write(
+                        f"**Portal/Aliado:** {r.get('Portal o Aliado', '')}  |  **Categoría:** {r.get('_sheet', '')}")
+                    url = str(r.get("URL del Curso", "") or "")
+                    if url.strip():
+                        st.markdown(f"[🔗 Ir al curso]({url})")
+                    st.caption(
+                        f"**Por qué aparece:** tfidf/bm25 + filtros + perfil.")
+                    st.write(str(r.get("Descripción del Curso", "") or ""))
+                    st.caption(
+                        f"**Competencias:** {str(r.get('Competencia que se fomenta con el curso', '') or '')}")
+                    st.caption(
+                        f"**Habilidades:** {str(r.get('Habilidad', '') or '')}")
+
+        with span("app.explain_wait"):
+            explain_box.write_stream(explanation)
 
         # Descargar PDF
         profile_text = (
@@ -246,9 +338,26 @@ with col_results:
             f"Área: {
                 state.area or 'N/D'} | Nivel: {state.level or 'N/D'} | Acceso: {state.access or 'N/D'}"
         )
-        pdf_bytes = build_path_pdf("Ruta recomendada", profile_text, ranked)
-        st.download_button("⬇️ Descargar ruta en PDF", data=pdf_bytes,
+        # Se genera solo al hacer clic (data diferida) y se reutiliza para el
+        # mismo perfil + cursos + índice
+        pdf_key = (rag_index.fingerprint, profile_text,
+                   tuple(str(c["row"].get("_id", c["idx"])) for c in ranked))
+
+        def _pdf_bytes(key=pdf_key, courses=ranked, profile_text=profile_text) -> bytes:
+            pdf = pdf_cache.get(key)
+            if pdf is None:
+                from pdf_utils import build_path_pdf
+                pdf = pdf_cache.put(key, build_path_pdf("Ruta recomendada", profile_text, courses))
+            return pdf
+
+        st.download_button("⬇️ Descargar ruta en PDF", data=_pdf_bytes,
                            file_name="ruta_recomendada.pdf", mime="application/pdf")
     else:
         st.warning(
             "No encontré coincidencias suficientes. Ajusta filtros o cuéntame más en el chat (intereses, metas, estilo).")
+
+if TRACER.enabled:
+    record("app.rerun", time.perf_counter() - rerun_t0)
+if rerun_profile is not None:
+    with st.sidebar.expander("cProfile de este rerun", expanded=True):
+        st.code(rerun_profile.stop(), language="text")
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Nov 25 09:12:40 2025
+
+@author: geam9
+"""
+
+# Benchmarks del pipeline de recomendación: catálogo sintético + etapas.
+# Uso: python -m bench --sizes 1000 10000 --out bench.json
+# Carga con sesiones simultáneas: python -m bench.load --sessions 1 4 16 64
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Nov 25 10:40:51 2025
+
+@author: geam9
+"""
+
+import sys
+from bench.pipeline import main
+
+sys.exit(main())
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Dec  2 10:14:37 2025
+
+@author: geam9
+"""
+
+from __future__ import annotations
+import gc
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import argparse
+import resource
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+from config import TOPK_CANDIDATES, TOPK_FINAL, RANK_WEIGHTS
+from rag_build import RAGIndex, SessionScorer, load_or_build_index, source_fingerprint
+from ranker import FeatureTable, featurize_candidates
+from path_builder import plan_path, group_cap
+from reco_service import RecommendationService, FILTER_FIELDS
+from chat_orchestrator import (ChatOpenAI, ProfileState, build_query_from_state, intro_coach_messages,
+                               profile_tokens, update_state_from_text)
+from llm_client import shared_client
+from llm_stub_server import StubConfig, serve_in_thread
+from pdf_utils import build_path_pdf
+from bench.pipeline import summarize
+from bench.synthetic import make_catalog, write_catalog_xlsx, make_profiles
+
+# Prueba de carga: N sesiones simultáneas recorren el flujo completo de la app
+# (subida, cambios de filtro, turnos de chat, búsqueda, rerank, explicación y
+# PDF) llamando al pipeline directamente, un hilo por sesión como Streamlit.
+# Uso: python -m bench.load --sessions 1 4 16 64 --docs 5000 --ttft 0.3
+
+# Etapas medidas por sesión, en el orden del flujo
+SESSION_STAGES = ["upload", "hybrid_search", "rerank", "chat_state", "chat_llm", "explain", "pdf"]
+
+# Mensajes del usuario en los turnos de chat (se reparten en ciclo)
+CHAT_TURNS = [
+    "Hola, bien. Tengo 27 años",
+    "Me gustan los datos, marketing y python",
+    "Prefiero proyectos prácticos y cortos",
+    "Quiero emprendimiento y finanzas para mi negocio",
+    "Me interesa la ciberseguridad y cloud",
+]
+
+
+class StubChatOpenAI(ChatOpenAI):
+    """ChatOpenAI contra llm_stub_server (sin st.secrets): mismo cliente, pool y semáforo."""
+
+    def __init__(self, base_url: str, model: str = "gpt-4o-mini", temperature: float = 0.4):
+        self.model = model
+        self.temperature = temperature
+        self.enabled = True
+        self.client = shared_client("stub", model, temperature, base_url)
+        self.cache = None
+
+
+class AppProcess:
+    """
+    Lo que en app_streamlit es st.cache_resource: un índice por fingerprint
+    del Excel y un servicio por índice, compartidos por todas las sesiones.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._services: Dict[str, RecommendationService] = {}
+
+    def service_for(self, fingerprint: str, path: str) -> RecommendationService:
+        with self._lock:
+            service = self._services.get(fingerprint)
+            if service is None:
+                index = load_or_build_index(path, self.cache_dir, fingerprint=fingerprint)
+                service = RecommendationService(index, FeatureTable(index.df))
+                self._services[fingerprint] = service
+            return service
+
+
+# -----------------------------
+# Una sesión
+# -----------------------------
+def _retrieve(index: RAGIndex, table: FeatureTable, scorer: SessionScorer, state: ProfileState,
+              times: Dict[str, List[float]]) -> List[Dict[str, Any]]:
+    filters = {k: getattr(state, k) for k in FILTER_FIELDS}
+    t = time.perf_counter()
+    cands = index.hybrid_search_session(scorer, build_query_from_state(state),
+                                        topk=TOPK_CANDIDATES, filters=filters)
+    t1 = time.perf_counter()
+    cm = featurize_candidates(cands, state.model_dump(), profile_tokens(state), table)
+    ranked = plan_path(cm, table, RANK_WEIGHTS, state.max_hours, max_courses=TOPK_FINAL,
+                       max_per_group=group_cap(state.area))
+    times["hybrid_search"].append(t1 - t)
+    times["rerank"].append(time.perf_counter() - t1)
+    return ranked
+
+
+def run_session(app: AppProcess, data: bytes, path: str, target: ProfileState, llm_url: str,
+                turns: int = 3, think: float = 0.0) -> Dict[str, Any]:
+    """
+    Flujo de una sesión: subir el Excel, fijar filtros uno a uno, `turns`
+    turnos de chat (estado + respuesta del LLM + nueva ruta), explicación y
+    PDF. `think` es la pausa del usuario entre pasos (no cuenta en las etapas).
+    """
+    times: Dict[str, List[float]] = {s: [] for s in SESSION_STAGES}
+    t0 = time.perf_counter()
+
+    t = time.perf_counter()
+    service = app.service_for(source_fingerprint(data), path)
+    index, table = service._current
+    times["upload"].append(time.perf_counter() - t)
+
+    state, scorer, llm = ProfileState(language="es"), SessionScorer(), StubChatOpenAI(llm_url)
+    ranked = _retrieve(index, table, scorer, state, times)
+    for field in ("area", "level", "max_hours", "access"):
+        time.sleep(think)
+        setattr(state, field, getattr(target, field))
+        ranked = _retrieve(index, table, scorer, state, times)
+
+    history = []
+    for i in range(turns):
+        time.sleep(think)
+        msg = CHAT_TURNS[i % len(CHAT_TURNS)]
+        t = time.perf_counter()
+        state = update_state_from_text(state, msg)
+        state.step += 1
+        times["chat_state"].append(time.perf_counter() - t)
+        t = time.perf_counter()
+        history.append(llm.stream(intro_coach_messages(state, msg)).result())
+        times["chat_llm"].append(time.perf_counter() - t)
+        ranked = _retrieve(index, table, scorer, state, times)
+
+    t = time.perf_counter()
+    history.append(service.explain(state, ranked, llm, semantic=False).result())
+    times["explain"].append(time.perf_counter() - t)
+    t = time.perf_counter()
+    pdf = build_path_pdf("Ruta recomendada", build_query_from_state(state), ranked)
+    times["pdf"].append(time.perf_counter() - t)
+    # Lo que la sesión retiene entre reruns (cuenta en la memoria por sesión)
+    return {"times": times, "session_s": time.perf_counter() - t0,
+            "keep": (state, scorer, history, ranked, pdf)}
+
+
+# -----------------------------
+# Niveles de concurrencia
+# -----------------------------
+def rss_mb() -> float:
+    """Memoria residente actual (Linux: /proc); si no, el pico del proceso."""
+    try:
+        with open("/proc/self/statm", "r") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def run_level(app: AppProcess, data: bytes, path: str, profiles: List[ProfileState],
+              llm_url: str, turns: int = 3, think: float = 0.0,
+              ramp: float = 0.0) -> Dict[str, Any]:
+    """
+    Lanza len(profiles) sesiones simultáneas y resume. Las llegadas se reparten
+    en `ramp` segundos (0 = todas a la vez tras una barrera).
+    """
+    n = len(profiles)
+    barrier = threading.Barrier(n)
+
+    def one(i: int, p: ProfileState) -> Dict[str, Any]:
+        barrier.wait()
+        time.sleep(ramp * i / n)
+        return run_session(app, data, path, p, llm_url, turns, think)
+
+    t = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n, thread_name_prefix="session") as pool:
+        results = list(pool.map(one, range(n), profiles))
+    wall = time.perf_counter() - t
+    # Con las sesiones aún vivas (lo que retienen entre reruns)
+    rss = rss_mb()
+
+    stages = {}
+    for s in SESSION_STAGES:
+        samples = [x for r in results for x in r["times"][s]]
+        if samples:
+            stages[s] = summarize(samples)
+            stages[s]["ops_per_s"] = len(samples) / wall
+    return {
+        "sessions": n,
+        "wall_s": wall,
+        "sessions_per_s": n / wall,
+        "session": summarize([r["session_s"] for r in results]),
+        "stages": stages,
+        "rss_mb": rss,
+    }
+
+
+def find_saturation(levels: List[Dict[str, Any]], factor: float = 2.0,
+                    min_delta_ms: float = 5.0) -> Dict[str, Any] | None:
+    """
+    Primera etapa que satura: en el primer nivel donde el p95 de alguna etapa
+    supera `factor` veces su p95 con la menor concurrencia (y al menos
+    `min_delta_ms`, piso de ruido de las etapas sub-milisegundo), la más
+    degradada. Anota en cada nivel la degradación por etapa (`slowdown`).
+    """
+    if not levels:
+        return None
+    base = levels[0]["stages"]
+    found = None
+    for lvl in levels:
+        lvl["slowdown"] = {s: st["p95_ms"] / base[s]["p95_ms"]
+                           for s, st in lvl["stages"].items()
+                           if s in base and base[s]["p95_ms"] > 0}
+        over = {s: v for s, v in lvl["slowdown"].items()
+                if v >= factor and lvl["stages"][s]["p95_ms"] - base[s]["p95_ms"] >= min_delta_ms}
+        if found is None and over:
+            worst = max(over, key=over.get)
+            found = {"sessions": lvl["sessions"], "stage": worst, "slowdown": over[worst]}
+    return found
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Carga con sesiones simultáneas y LLM simulado")
+    ap.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 16, 64],
+                    help="sesiones simultáneas por nivel (de menor a mayor)")
+    ap.add_argument("--docs", type=int, default=5_000, help="cursos del catálogo sintético")
+    ap.add_argument("--xlsx", help="Excel real en vez del catálogo sintético")
+    ap.add_argument("--turns", type=int, default=3, help="turnos de chat por sesión")
+    ap.add_argument("--think", type=float, default=0.0, help="pausa del usuario entre pasos (s)")
+    ap.add_argument("--ramp", type=float, default=0.5,
+                    help="las sesiones de un nivel llegan repartidas en estos segundos")
+    ap.add_argument("--ttft", type=float, default=0.3, help="LLM: latencia al primer token (s)")
+    ap.add_argument("--token-delay", type=float, default=0.02, help="LLM: pausa entre tokens (s)")
+    ap.add_argument("--tokens", type=int, default=60, help="LLM: tokens por respuesta")
+    ap.add_argument("--saturation", type=float, default=2.0,
+                    help="una etapa satura cuando su p95 crece estas veces")
+    ap.add_argument("--min-delta-ms", type=float, default=5.0,
+                    help="y además crece al menos estos ms (piso de ruido)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="JSON con los resultados")
+    args = ap.parse_args(argv)
+
+    server, llm_url = serve_in_thread(StubConfig(args.ttft, args.token_delay, n_tokens=args.tokens,
+                                                 seed=args.seed))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.xlsx
+        if path is None:
+            path = os.path.join(tmp, "catalogo.xlsx")
+            write_catalog_xlsx(make_catalog(args.docs, args.seed), path)
+        with open(path, "rb") as fh:
+            data = fh.read()
+        app = AppProcess(os.path.join(tmp, "index"))
+        # La primera subida construye el índice; los niveles miden el estado estable
+        t = time.perf_counter()
+        n_docs = len(app.service_for(source_fingerprint(data), path).index.df)
+        build_s = time.perf_counter() - t
+        gc.collect()
+        rss_base = rss_mb()
+
+        result = {
+            "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "seed": args.seed,
+                     "n_docs": n_docs, "index_build_s": build_s, "rss_base_mb": rss_base, "turns": args.turns,
+                     "think_s": args.think, "ramp_s": args.ramp, "llm": {"ttft_s": args.ttft,
+                                                    "token_delay_s": args.token_delay,
+                                                    "tokens": args.tokens},
+                     "python": sys.version.split()[0], "platform": platform.platform(),
+                     "cpus": os.cpu_count()},
+            "levels": [],
+        }
+        print(f"catálogo {n_docs} cursos, índice {build_s:.2f} s; LLM ttft {args.ttft}s "
+              f"+ {args.tokens}x{args.token_delay}s")
+        for n in sorted(args.sessions):
+            profiles = make_profiles(n, args.seed + n)
+            lvl = run_level(app, data, path, profiles, llm_url, args.turns, args.think, args.ramp)
+            # El allocator no devuelve lo liberado: crecimiento contra la base tras el índice
+            lvl["rss_growth_mb"] = lvl["rss_mb"] - rss_base
+            lvl["rss_per_session_mb"] = lvl["rss_growth_mb"] / n
+            result["levels"].append(lvl)
+            ses = lvl["session"]
+            print(f"\n{n:>4} sesiones  {lvl['sessions_per_s']:.2f} sesiones/s  "
+                  f"sesión p50 {ses['p50_ms']:.0f}  p95 {ses['p95_ms']:.0f}  "
+                  f"p99 {ses['p99_ms']:.0f} ms  RSS {lvl['rss_mb']:.0f} MB (+{lvl['rss_growth_mb']:.1f}, "
+                  f"{lvl['rss_per_session_mb']:.2f} MB/sesión)")
+            for name, st in lvl["stages"].items():
+                print(f"       {name:<14} p50 {st['p50_ms']:8.2f}  p95 {st['p95_ms']:8.2f}  "
+                      f"p99 {st['p99_ms']:8.2f} ms  {st['ops_per_s']:8.1f} op/s")
+    server.shutdown()
+
+    sat = find_saturation(result["levels"], args.saturation, args.min_delta_ms)
+    result["saturation"] = sat
+    for lvl in result["levels"][1:]:
+        print(f"{lvl['sessions']:>4} sesiones  p95 vs {result['levels'][0]['sessions']}: " + "  ".join(
+            f"{s} x{v:.1f}" for s, v in sorted(lvl["slowdown"].items(), key=lambda kv: -kv[1])))
+    if sat:
+        print(f"Satura primero: {sat['stage']} con {sat['sessions']} sesiones "
+              f"(p95 x{sat['slowdown']:.1f})")
+    else:
+        print(f"Ninguna etapa superó x{args.saturation} de su p95 base")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(result, fh, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
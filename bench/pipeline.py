@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Nov 25 10:02:18 2025
+
+@author: geam9
+"""
+
+from __future__ import annotations
+import os
+import gc
+import sys
+import json
+import time
+import platform
+import tempfile
+import argparse
+import tracemalloc
+import numpy as np
+from typing import Any, Callable, Dict, List
+from config import TOPK_CANDIDATES, TOPK_FINAL, RANK_WEIGHTS
+from rag_build import RAGIndex, load_catalog
+from ranker import FeatureTable, featurize_candidates
+from chat_orchestrator import build_query_from_state, profile_tokens
+from pdf_utils import build_path_pdf
+from bench.synthetic import make_catalog, normalize_catalog, write_catalog_xlsx, make_profiles
+
+# Etapas medidas por consulta (las de construcción se miden una vez por tamaño)
+QUERY_STAGES = ["hybrid_search", "rerank", "build_path_pdf"]
+
+
+# -----------------------------
+# Medición
+# -----------------------------
+def summarize(samples_s: List[float]) -> Dict[str, float]:
+    ms = np.asarray(samples_s) * 1000.0
+    return {
+        "n": int(ms.size),
+        "total_s": float(ms.sum() / 1000.0),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def timed(fn: Callable[[], Any]) -> tuple:
+    t = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - t
+
+
+def peak_mb(fn: Callable[[], Any]) -> float:
+    """Pico de memoria asignada durante fn() (tracemalloc: ve NumPy, no los buffers de Arrow)."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def run_size(n: int, n_queries: int = 200, pdf_queries: int = 20, xlsx_max: int = 50_000,
+             memory: bool = True, seed: int = 0) -> Dict[str, Any]:
+    """
+    Mide todas las etapas para un catálogo sintético de n cursos. Los tiempos
+    se toman sin tracemalloc (lo hace más lento); con `memory` cada etapa de
+    construcción se repite una vez bajo tracemalloc para el pico.
+    """
+    stages: Dict[str, Dict[str, Any]] = {}
+    raw, t_gen = timed(lambda: make_catalog(n, seed))
+    stages["generate"] = summarize([t_gen])
+
+    if n <= xlsx_max:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "catalogo.xlsx")
+            write_catalog_xlsx(raw, path)
+            _, t = timed(lambda: load_catalog(path))
+            stages["load_catalog"] = summarize([t])
+            if memory:
+                stages["load_catalog"]["peak_mb"] = peak_mb(lambda: load_catalog(path))
+    df = normalize_catalog(raw)
+    del raw
+
+    index, t = timed(lambda: RAGIndex(df))
+    stages["index_build"] = summarize([t])
+    table, t = timed(lambda: FeatureTable(index.df))
+    stages["feature_table"] = summarize([t])
+    if memory:
+        stages["index_build"]["peak_mb"] = peak_mb(lambda: RAGIndex(df))
+        stages["feature_table"]["peak_mb"] = peak_mb(lambda: FeatureTable(index.df))
+
+    profiles = make_profiles(n_queries, seed)
+    samples = {s: [] for s in QUERY_STAGES}
+    for i, p in enumerate(profiles):
+        prof = p.model_dump()
+        filters = {k: prof[k] for k in ("area", "level", "access", "population", "max_hours")}
+        cands, t = timed(lambda: index.hybrid_search(
+            build_query_from_state(p), topk=TOPK_CANDIDATES, filters=filters))
+        samples["hybrid_search"].append(t)
+        ranked, t = timed(lambda: featurize_candidates(
+            cands, prof, profile_tokens(p), table).rank(RANK_WEIGHTS, topk=TOPK_FINAL))
+        samples["rerank"].append(t)
+        if i < pdf_queries and ranked:
+            _, t = timed(lambda: build_path_pdf("Ruta recomendada", str(prof), ranked))
+            samples["build_path_pdf"].append(t)
+    for s, v in samples.items():
+        if v:
+            stages[s] = summarize(v)
+
+    queries = [build_query_from_state(p) for p in profiles]
+    _, t = timed(lambda: index.hybrid_search_many(queries, topk=TOPK_CANDIDATES))
+    stages["hybrid_search_many"] = summarize([t])
+    stages["hybrid_search_many"]["qps"] = len(queries) / t if t else 0.0
+    return {"n_docs": n, "stages": stages}
+
+
+# -----------------------------
+# Regresiones contra una corrida base
+# -----------------------------
+def _metric(stage: Dict[str, Any]) -> float:
+    # Latencia por consulta: p95; etapas de una sola corrida: tiempo total
+    return stage["p95_ms"] if stage["n"] > 1 else stage["total_s"] * 1000.0
+
+
+def check_regressions(current: Dict[str, Any], baseline: Dict[str, Any],
+                      max_slowdown: float = 1.25, min_delta_ms: float = 2.0,
+                      max_mem_growth: float = 1.25) -> List[str]:
+    """
+    Compara por (tamaño, etapa). Falla si el tiempo crece más de `max_slowdown`
+    veces y al menos `min_delta_ms` (piso de ruido), o si el pico de memoria
+    crece más de `max_mem_growth` veces.
+    """
+    base = {r["n_docs"]: r["stages"] for r in baseline.get("runs", [])}
+    problems = []
+    for run in current.get("runs", []):
+        for name, st in run["stages"].items():
+            b = base.get(run["n_docs"], {}).get(name)
+            if b is None or name == "generate":
+                continue
+            cur, ref = _metric(st), _metric(b)
+            if cur > ref * max_slowdown and cur - ref >= min_delta_ms:
+                problems.append(f"n={run['n_docs']} {name}: {cur:.1f} ms vs {ref:.1f} ms "
+                                f"(x{cur / ref:.2f})")
+            if "peak_mb" in st and "peak_mb" in b and st["peak_mb"] > b["peak_mb"] * max_mem_growth:
+                problems.append(f"n={run['n_docs']} {name}: pico {st['peak_mb']:.1f} MB vs "
+                                f"{b['peak_mb']:.1f} MB")
+    return problems
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmark del pipeline de recomendación")
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--pdf-queries", type=int, default=20)
+    ap.add_argument("--xlsx-max", type=int, default=50_000,
+                    help="tamaño máximo para medir load_catalog (escribir el Excel es lento)")
+    ap.add_argument("--no-memory", action="store_true", help="omite el pico de memoria")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", help="JSON con los resultados")
+    ap.add_argument("--baseline", help="JSON de una corrida anterior para detectar regresiones")
+    ap.add_argument("--max-slowdown", type=float, default=1.25)
+    args = ap.parse_args(argv)
+
+    result = {
+        "meta": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "seed": args.seed,
+                 "queries": args.queries, "python": sys.version.split()[0],
+                 "platform": platform.platform(), "cpus": os.cpu_count()},
+        "runs": [],
+    }
+    for n in args.sizes:
+        run = run_size(n, args.queries, args.pdf_queries, args.xlsx_max,
+                       memory=not args.no_memory, seed=args.seed)
+        result["runs"].append(run)
+        for name, st in run["stages"].items():
+            mem = f"  pico {st['peak_mb']:.1f} MB" if "peak_mb" in st else ""
+            lat = (f"p50 {st['p50_ms']:.2f}  p95 {st['p95_ms']:.2f}  p99 {st['p99_ms']:.2f} ms"
+                   if st["n"] > 1 else f"{st['total_s']:.3f} s")
+            print(f"n={n:>8}  {name:<20} {lat}{mem}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            json.dump(result, fh, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as fh:
+            problems = check_regressions(result, json.load(fh), args.max_slowdown)
+        for p in problems:
+            print("REGRESIÓN:", p)
+        return 1 if problems else 0
+    return 0
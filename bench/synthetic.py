@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Nov 25 09:14:05 2025
+
+@author: geam9
+"""
+
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+from typing import List
+from rag_build import KEY_COLS, prepare_rows
+from chat_orchestrator import ProfileState
+
+# -----------------------------
+# Vocabulario (español, dominio de formación)
+# -----------------------------
+TEMAS = [
+    "inteligencia artificial", "análisis de datos", "marketing digital", "diseño gráfico",
+    "programación en python", "hojas de cálculo", "finanzas personales", "gestión de proyectos",
+    "emprendimiento", "servicio al cliente", "salud ocupacional", "docencia virtual",
+    "ciberseguridad", "computación en la nube", "liderazgo", "comunicación asertiva",
+    "estadística básica", "redes de computadores", "ventas", "creatividad",
+    "innovación social", "sostenibilidad ambiental", "agricultura de precisión", "turismo",
+    "logística", "educación inclusiva", "contabilidad", "inglés técnico",
+    "desarrollo web", "bases de datos", "robótica educativa", "primeros auxilios",
+]
+PREFIJOS = ["Fundamentos de", "Introducción a", "Taller de", "Curso práctico de",
+            "Diplomado en", "Herramientas de", "Aplicaciones de", "Gestión de"]
+VERBOS = ["aprende", "desarrolla", "fortalece", "aplica", "comprende", "analiza", "diseña"]
+OBJETOS = ["proyectos reales", "casos prácticos", "ejercicios guiados", "retos semanales",
+           "estudios de caso", "simulaciones", "herramientas gratuitas", "buenas prácticas"]
+HABILIDADES = ["pensamiento crítico", "trabajo en equipo", "resolución de problemas",
+               "comunicación", "adaptabilidad", "alfabetización digital", "autogestión",
+               "pensamiento analítico", "creatividad", "ética profesional"]
+GRUPOS = ["Tecnología", "Negocios", "Habilidades blandas", "Salud", "Educación",
+          "Medio ambiente", "Idiomas"]
+HOJAS = ["TIC", "Empresarial", "Transversal", "Bienestar", "Pedagogía"]
+NIVELES = ["Básico", "Intermedio", "Avanzado"]
+ACCESOS = ["REA", "Redireccionamiento", "Moodle REA", "Moodle"]
+POBLACIONES = ["Jóvenes", "Adultos", "Docentes", "Público general", "Emprendedores",
+               "Servidores públicos", "Mujeres rurales"]
+PORTALES = ["SENA", "Colombia Aprende", "MinTIC", "Coursera", "edX", "Aliado regional"]
+DURACIONES = ["10 horas", "20 horas", "40 h", "60 horas", "90 min", "45 minutos",
+              "8 horas", "120 horas", "", None]
+VALORES = ["impacto social", "creatividad", "seguridad", "autonomía", "aprendizaje continuo"]
+ESTILOS = ["proyectos", "práctico", "teórico", "micro-lecciones", "videos"]
+METAS = ["quiero emprender", "busco empleo rápido", "mejorar en mi trabajo actual",
+         "cambiar de carrera", "enseñar mejor"]
+
+
+def _pick(rng: np.random.Generator, options: List, n: int) -> np.ndarray:
+    return np.asarray(options, dtype=object)[rng.integers(0, len(options), n)]
+
+
+def _join(*cols: np.ndarray, sep: str = " ") -> List[str]:
+    return [sep.join(p) for p in zip(*cols)]
+
+
+def make_catalog(n: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Catálogo crudo con las columnas de KEY_COLS y una columna `_sheet`
+    (equivalente a la hoja del Excel). Se arma por columnas con arreglos de
+    NumPy, así 1M de cursos tarda segundos.
+    """
+    rng = np.random.default_rng(seed)
+    tema, tema2 = _pick(rng, TEMAS, n), _pick(rng, TEMAS, n)
+    nivel = _pick(rng, NIVELES, n)
+    pobl = _pick(rng, POBLACIONES, n)
+    num = np.char.mod("%d", np.arange(n)).astype(object)
+    curso = _join(_pick(rng, PREFIJOS, n), tema, np.full(n, "·", dtype=object), num)
+    desc = _join(np.full(n, "En este curso", dtype=object), _pick(rng, VERBOS, n), tema,
+                 np.full(n, "con", dtype=object), _pick(rng, OBJETOS, n),
+                 np.full(n, "y conectas con", dtype=object), tema2,
+                 np.full(n, "para", dtype=object), pobl.astype(str))
+    habil = _join(_pick(rng, HABILIDADES, n), _pick(rng, HABILIDADES, n), sep=", ")
+    df = pd.DataFrame({
+        "Portal o Aliado": _pick(rng, PORTALES, n),
+        "Tipo de Acceso (REA o Redireccionamiento)": _pick(rng, ACCESOS, n),
+        "Grupo de Competencias": _pick(rng, GRUPOS, n),
+        "Curso": curso,
+        "Descripción del Curso": desc,
+        "URL del Curso": _join(np.full(n, "https://cursos.example.org/c/", dtype=object), num, sep=""),
+        "URL del curso Moodle": None,
+        "Cualificación asociada (Marco Nacional de Cualificaciones de Colombia)": None,
+        "Nivel de complejidad": nivel,
+        "Competencia que se fomenta con el curso": _join(_pick(rng, VERBOS, n), tema),
+        "Habilidad": habil,
+        "Palabras Clave": _join(tema, tema2, _pick(rng, HABILIDADES, n), sep=", "),
+        "Población objetivo": pobl,
+        "Duración del Curso": _pick(rng, DURACIONES, n),
+        "_sheet": _pick(rng, HOJAS, n),
+    })
+    return df[KEY_COLS + ["_sheet"]]
+
+
+def normalize_catalog(raw: pd.DataFrame) -> pd.DataFrame:
+    """Mismo esquema que load_catalog (`_horas`, `_id`) sin pasar por Excel."""
+    return prepare_rows(raw)
+
+
+def write_catalog_xlsx(raw: pd.DataFrame, path: str) -> None:
+    # Una hoja por valor de `_sheet`, como el Excel real
+    with pd.ExcelWriter(path) as xw:
+        for sheet, part in raw.groupby("_sheet", sort=True):
+            part.drop(columns="_sheet").to_excel(xw, sheet_name=str(sheet)[:31], index=False)
+
+
+def make_profiles(n: int, seed: int = 0, areas: List[str] | None = None) -> List[ProfileState]:
+    """Perfiles variados: algunos con filtros explícitos, otros solo con intereses."""
+    rng = np.random.default_rng(seed + 1)
+    areas = areas or GRUPOS + HOJAS
+    out = []
+    for _ in range(n):
+        filt = rng.random()
+        out.append(ProfileState(
+            area=str(rng.choice(areas)) if filt < 0.4 else "",
+            level=str(rng.choice(NIVELES)) if filt < 0.6 else "",
+            max_hours=float(rng.choice([10, 20, 40, 80, 200])),
+            access=str(rng.choice(["", "REA", "Moodle"])),
+            population=str(rng.choice(POBLACIONES)) if filt < 0.3 else "",
+            keywords_text=", ".join(rng.choice(TEMAS, size=rng.integers(1, 4), replace=False)),
+            interests=list(rng.choice(TEMAS, size=rng.integers(0, 4), replace=False)),
+            values=list(rng.choice(VALORES, size=rng.integers(0, 3), replace=False)),
+            learning_style=str(rng.choice(ESTILOS)),
+            goals=str(rng.choice(METAS)),
+            age=int(rng.integers(16, 65)),
+        ))
+    return out
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Nov 13 10:12:05 2025
+
+@author: geam9
+"""
+
+from __future__ import annotations
+import numpy as np
+from scipy import sparse
+from typing import List, Dict, Tuple, Any
+
+
+def rows_to_csr(rows: List[Tuple[np.ndarray, np.ndarray]], n_cols: int, dtype) -> sparse.csr_matrix:
+    """Filas (ids de columna, valores) -> CSR."""
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(ids) for ids, _ in rows], out=indptr[1:])
+    if not rows:
+        return sparse.csr_matrix((0, n_cols), dtype=dtype)
+    return sparse.csr_matrix((np.concatenate([v for _, v in rows]).astype(dtype),
+                              np.concatenate([i for i, _ in rows]), indptr),
+                             shape=(len(rows), n_cols))
+
+
+def count_matrix(docs: List[np.ndarray], n_cols: int) -> sparse.csr_matrix:
+    """Ids de término por documento (sin -1) -> conteos (doc x término) int32."""
+    lens = np.fromiter((len(d) for d in docs), dtype=np.int64, count=len(docs))
+    cols = np.concatenate(docs) if docs else np.zeros(0, dtype=np.int64)
+    rows = np.repeat(np.arange(len(docs)), lens)
+    # COO -> CSR suma duplicados: data = frecuencia del término en el doc
+    tf = sparse.csr_matrix((np.ones(len(cols), dtype=np.int32), (rows, cols)),
+                           shape=(len(docs), n_cols))
+    tf.sum_duplicates()
+    return tf
+
+
+class SparseBM25:
+    """
+    BM25 Okapi (misma fórmula e idf con piso epsilon que rank_bm25) sobre una
+    matriz dispersa CSC documento x término con la parte de saturación ya
+    calculada: tf*(k1+1) / (tf + k1*(1 - b + b*dl/avgdl)).
+    Una consulta es un gather de columnas + una suma ponderada por idf.
+
+    Actualizaciones incrementales: `add_docs` agrega filas a un segmento delta
+    (saturadas con el avgdl vigente) y `remove_docs` descuenta frecuencias de
+    documento; idf se recalcula al vuelo (O(vocabulario)). Las filas base
+    conservan el avgdl del último ajuste hasta `compact`, que re-pondera desde
+    los conteos guardados sin volver a tokenizar.
+
+    Documentos y consultas llegan como ids de término del Analyzer
+    compartido (text_analyzer): la columna de un término es su id, así que el
+    motor no guarda vocabulario. `dtype` es el de los pesos (float32 en modo
+    compacto).
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25,
+                 dtype=np.float64):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.dtype = np.dtype(dtype)
+        self.idf = np.zeros(0)
+        self.average_idf = 0.0
+        self.doc_freq = np.zeros(0, dtype=np.int64)
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.n_docs = 0          # documentos vivos (para idf/avgdl)
+        self.total_len = 0
+        self.avgdl = 0.0
+        self.tfw = sparse.csc_matrix((0, 0))
+        self.tf_counts = np.zeros(0, dtype=np.int32)   # alineado con tfw.data
+        # Segmento delta: por documento (ids de término, conteos, pesos)
+        self._delta: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._delta_mat: sparse.csr_matrix | None = None
+
+    @property
+    def corpus_size(self) -> int:
+        return self.tfw.shape[0] + len(self._delta)
+
+    @property
+    def n_terms(self) -> int:
+        return len(self.doc_freq)
+
+    def fit(self, docs: List[np.ndarray], n_terms: int) -> "SparseBM25":
+        return self.fit_counts(count_matrix(docs, n_terms))
+
+    def fit_counts(self, tf: sparse.csr_matrix) -> "SparseBM25":
+        """Ajuste desde una matriz de conteos (doc x término), p. ej. fusionada de varios bloques."""
+        self._set_base(tf)
+        return self
+
+    def _set_base(self, tf: sparse.csr_matrix) -> None:
+        # Estadísticas + pesos desde una matriz de conteos (doc x término)
+        self.doc_len = np.asarray(tf.sum(axis=1)).ravel().astype(np.int32)
+        self.doc_freq = np.bincount(tf.indices, minlength=tf.shape[1]).astype(np.int64)
+        self.n_docs = tf.shape[0]
+        self.total_len = int(self.doc_len.sum())
+        self.avgdl = self.total_len / max(self.n_docs, 1)
+        self._refresh_idf()
+        counts = sparse.csr_matrix((tf.data.astype(np.int32), tf.indices, tf.indptr),
+                                   shape=tf.shape).tocsc()
+        self.tfw = sparse.csc_matrix((self._saturate(counts.data, counts.indices, self.doc_len)
+                                      .astype(self.dtype), counts.indices, counts.indptr),
+                                     shape=tf.shape)
+        self.tf_counts = counts.data
+        self._delta, self._delta_mat = [], None
+
+    def _refresh_idf(self) -> None:
+        # Igual que BM25Okapi: idf negativo -> epsilon * idf promedio. El promedio
+        # es sobre términos con documentos (los que tendría un ajuste desde cero)
+        df = self.doc_freq
+        idf = np.log(self.n_docs - df + 0.5) - np.log(df + 0.5)
+        used = df > 0
+        self.average_idf = float(idf[used].sum()) / max(int(used.sum()), 1)
+        idf[idf < 0] = self.epsilon * self.average_idf
+        idf[~used] = 0.0
+        self.idf = idf
+
+    def _saturate(self, tf: np.ndarray, rows: np.ndarray, doc_len: np.ndarray) -> np.ndarray:
+        # tf por celda + fila de cada celda -> tf*(k1+1) / (tf + k1*(1-b+b*dl/avgdl))
+        tf = tf.astype(np.float64)
+        norm = self.k1 * (1 - self.b + self.b * doc_len / self.avgdl)
+        return tf * (self.k1 + 1) / (tf + norm[rows])
+
+    # -----------------------------
+    # Actualizaciones incrementales
+    # -----------------------------
+    def _grow(self, n_terms: int) -> None:
+        # Términos nuevos del analizador: columnas vacías al final
+        if n_terms > len(self.doc_freq):
+            self.doc_freq = np.concatenate(
+                [self.doc_freq, np.zeros(n_terms - len(self.doc_freq), dtype=np.int64)])
+            self._refresh_idf()
+
+    def add_docs(self, docs: List[np.ndarray], n_terms: int) -> None:
+        self._grow(n_terms)
+        terms = [np.unique(d, return_counts=True) for d in docs]
+        lens = np.array([len(d) for d in docs], dtype=np.int32)
+        for ids, _ in terms:
+            self.doc_freq[ids] += 1
+        self.n_docs += len(docs)
+        self.total_len += int(lens.sum())
+        self.avgdl = self.total_len / max(self.n_docs, 1)
+        self._refresh_idf()
+        for (ids, cnt), dl in zip(terms, lens):
+            w = self._saturate(cnt, np.zeros(len(cnt), dtype=np.int64), np.array([dl]))
+            self._delta.append((ids, cnt.astype(np.int32), w.astype(self.dtype)))
+        self.doc_len = np.concatenate([self.doc_len, lens])
+        self._delta_mat = None
+
+    def remove_docs(self, docs: List[np.ndarray]) -> None:
+        """Descuenta documentos (por sus ids de término); las filas quedan hasta `compact`."""
+        for d in docs:
+            self.doc_freq[np.unique(d)] -= 1
+            self.total_len -= len(d)
+        self.n_docs -= len(docs)
+        self.avgdl = self.total_len / max(self.n_docs, 1)
+        self._refresh_idf()
+
+    def _delta_matrix(self) -> sparse.csr_matrix:
+        if self._delta_mat is None:
+            self._delta_mat = rows_to_csr([(i, w) for i, _, w in self._delta],
+                                          self.n_terms, self.dtype)
+        return self._delta_mat
+
+    def compact(self, keep: np.ndarray) -> None:
+        """Re-pondera base + delta con las estadísticas vigentes y deja solo `keep`."""
+        # Las columnas son ids del analizador compartido: no se renumeran
+        n_terms = self.n_terms
+        base = sparse.csc_matrix((self.tf_counts, self.tfw.indices, self.tfw.indptr),
+                                 shape=self.tfw.shape).tocsr()
+        base = sparse.csr_matrix((base.data, base.indices, base.indptr),
+                                 shape=(base.shape[0], n_terms))
+        delta = rows_to_csr([(i, c) for i, c, _ in self._delta], n_terms, np.int32)
+        self._set_base(sparse.vstack([base, delta], format="csr")[keep])
+
+    # -----------------------------
+    # Consultas
+    # -----------------------------
+    def term_counts(self, query: np.ndarray) -> Dict[int, int]:
+        """Conteo por id de término de una consulta (ids del analizador, -1 = desconocido)."""
+        ids, cnt = np.unique(query[query >= 0], return_counts=True)
+        return dict(zip(ids.tolist(), cnt.tolist()))
+
+    def query_weights(self, query: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Ids de término presentes en el vocabulario y su peso idf * conteo."""
+        ids, cnt = np.unique(query[query >= 0], return_counts=True)
+        return ids, self.idf[ids] * cnt
+
+    def get_scores(self, query: np.ndarray) -> np.ndarray:
+        return self.get_scores_many([query])[0]
+
+    def get_scores_many(self, queries: List[np.ndarray], docs: np.ndarray | None = None) -> np.ndarray:
+        """
+        Puntajes (n_consultas x n_docs) con un solo producto disperso. Con `docs`
+        solo se densifican esas columnas (n_consultas x len(docs)).
+        """
+        # Mismo dtype que tfw: con tipos mezclados scipy convertiría la matriz entera
+        qmat = rows_to_csr([self.query_weights(q) for q in queries], self.n_terms, self.dtype)
+        # tfw.T es CSR (término x doc) sin copia: CSR @ CSR -> filas por consulta
+        res = qmat[:, :self.tfw.shape[1]] @ self.tfw.T
+        if self._delta:
+            res = sparse.hstack([res, qmat @ self._delta_matrix().T], format="csr")
+        return (res if docs is None else res[:, docs]).toarray()
+
+    def columns_dot(self, ids: np.ndarray, w: np.ndarray) -> np.ndarray:
+        """
+        tfw[:, ids] @ w para todos los documentos (base + delta): el aporte de
+        esos términos con pesos `w` (idf * conteo). Solo recorre sus postings.
+        """
+        base = ids < self.tfw.shape[1]
+        out = np.asarray(self.tfw[:, ids[base]] @ w[base], dtype=np.float64).ravel()
+        if self._delta:
+            out = np.concatenate([out, np.asarray(self._delta_matrix()[:, ids] @ w,
+                                                  dtype=np.float64).ravel()])
+        return out
+
+    # -----------------------------
+    # Persistencia
+    # -----------------------------
+    def memory_bytes(self) -> Dict[str, int]:
+        arrays = (self.tfw.data.nbytes + self.tfw.indices.nbytes + self.tfw.indptr.nbytes
+                  + self.tf_counts.nbytes + self.idf.nbytes + self.doc_freq.nbytes
+                  + self.doc_len.nbytes + sum(i.nbytes + c.nbytes + w.nbytes
+                                              for i, c, w in self._delta))
+        return {"arrays": int(arrays)}
+
+    def to_arrays(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray], List[str]]:
+        """(meta, arreglos, términos: vacío, los guarda el analizador) sin segmento delta."""
+        assert not self._delta, "compactar antes de persistir"
+        meta = {"k1": self.k1, "b": self.b, "epsilon": self.epsilon,
+                "dtype": self.dtype.name,
+                "avgdl": self.avgdl, "average_idf": self.average_idf,
+                "n_docs": self.n_docs, "total_len": self.total_len,
+                "shape": list(self.tfw.shape)}
+        arrays = {"tfw_data": self.tfw.data, "tfw_indices": self.tfw.indices,
+                  "tfw_indptr": self.tfw.indptr, "tf_counts": self.tf_counts,
+                  "idf": self.idf, "doc_freq": self.doc_freq, "doc_len": self.doc_len}
+        return meta, arrays, []
+
+    @classmethod
+    def from_arrays(cls, meta: Dict[str, Any], arrays: Dict[str, np.ndarray],
+                    terms: List[str]) -> "SparseBM25":
+        self = cls(k1=meta["k1"], b=meta["b"], epsilon=meta["epsilon"],
+                   dtype=meta.get("dtype", "float64"))
+        self.tfw = sparse.csc_matrix(
+            (arrays["tfw_data"], arrays["tfw_indices"], arrays["tfw_indptr"]),
+            shape=tuple(meta["shape"]), copy=False)
+        self.tf_counts = arrays["tf_counts"]
+        # Estadísticas pequeñas en memoria propia: cambian con add/remove_docs
+        self.idf = np.array(arrays["idf"])
+        self.doc_freq = np.array(arrays["doc_freq"])
+        self.doc_len = np.array(arrays["doc_len"])
+        self.avgdl, self.average_idf = meta["avgdl"], meta["average_idf"]
+        self.n_docs, self.total_len = meta["n_docs"], meta["total_len"]
+        return self
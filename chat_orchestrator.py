@@ -9,10 +9,15 @@ from __future__ import annotations
 import os
 import re
 import json
+import time
 from typing import Dict, Any, List
 from pydantic import BaseModel, Field
 import streamlit as st
 from dotenv import dotenv_values
+from config import LLM_BASE_URL
+from llm_client import StreamHandle, background_loop, shared_client
+from llm_cache import LLMResponseCache, content_key, message_key
+from tracing import TRACER, record, span
 
 
 config = dotenv_values()
@@ -24,28 +29,73 @@ config = dotenv_values()
 class ChatOpenAI:
     """
     Wrapper minimalista. Si no hay OPENAI_API_KEY, responde con heurística local.
-    Reemplaza por tu cliente real (langchain/openai) si lo deseas.
+    Con clave usa AsyncLLMClient (stream + pool de conexiones) sobre el loop de
+    fondo; OPENAI_BASE_URL en secrets apunta a otro servidor compatible (p. ej.
+    llm_stub_server para pruebas offline).
     """
 
-    def __init__(self, model: str = "gpt-4o-mini", temperature: float = 0.4):
+    def __init__(self, model: str = "gpt-4o-mini", temperature: float = 0.4,
+                 cache: LLMResponseCache | None = None):
         self.model = model
         self.temperature = temperature
         # self.enabled = bool(os.environ.get("OPENAI_API_KEY"))
         self.enabled = bool(st.secrets["OPENAI_API_KEY"])
         # self.enabled = bool(config["OPENAI_API_KEY"])
+        self.client = shared_client(
+            st.secrets["OPENAI_API_KEY"], model, temperature,
+            st.secrets.get("OPENAI_BASE_URL", LLM_BASE_URL)) if self.enabled else None
+        # Respuestas ya generadas (solo las del LLM real, el fallback es gratis)
+        self.cache = cache
 
-    def chat(self, messages: List[Dict[str, str]]) -> str:
+    def _fallback(self, messages: List[Dict[str, str]]) -> str:
+        # Fallback simple: eco con tips
+        last = messages[-1]["content"] if messages else ""
+        return ("(demo sin LLM) Entiendo. A partir de lo que me cuentas, "
+                "priorizaré cursos intro y prácticos; si te gusta la creatividad "
+                "y análisis, mezclaré IA básica + marketing digital + proyectos cortos. "
+                f"Mensaje recibido: {last[:200]}...")
+
+    def stream(self, messages: List[Dict[str, str]], cache_key: str | None = None) -> StreamHandle:
+        """
+        Arranca la llamada de inmediato y retorna un iterador de fragmentos
+        (apto para st.write_stream). Si falla antes del primer token, entrega
+        el fallback local. Con caché, la clave por defecto es el hash de los
+        mensajes + modelo + temperatura; `cache_key` permite una clave propia
+        (p. ej. la semántica de explain_track_key).
+        """
         if not self.enabled:
-            # Fallback simple: eco con tips
-            last = messages[-1]["content"] if messages else ""
-            return ("(demo sin LLM) Entiendo. A partir de lo que me cuentas, "
-                    "priorizaré cursos intro y prácticos; si te gusta la creatividad "
-                    "y análisis, mezclaré IA básica + marketing digital + proyectos cortos. "
-                    f"Mensaje recibido: {last[:200]}...")
-        # ↓ Si integras el cliente real, haz la llamada aquí y retorna el texto
-        # Ej. con openai: client.chat.completions.create(model=..., messages=messages)
-        # Devuelve `response_text`
-        return "(demo) LLM activo — agrega tu cliente aquí."
+            return StreamHandle.from_text(self._fallback(messages))
+        on_complete = None
+        if self.cache is not None:
+            key = cache_key or message_key(messages, self.model, self.temperature)
+            with span("llm.cache_lookup"):
+                hit = self.cache.get(key)
+            if hit is not None:
+                return StreamHandle.from_text(hit)
+
+            def on_complete(text: str) -> None:
+                if text:
+                    self.cache.put(key, text)
+        agen = self.client.stream(messages)
+        if TRACER.enabled:
+            agen = _timed_stream(agen)
+        return background_loop().start_stream(agen, fallback=self._fallback(messages),
+                                              on_complete=on_complete)
+
+    def chat(self, messages: List[Dict[str, str]], cache_key: str | None = None) -> str:
+        return self.stream(messages, cache_key).result()
+
+
+async def _timed_stream(agen):
+    # Tiempo al primer token y total del stream (se registran en el loop de fondo)
+    t0 = time.perf_counter()
+    first = True
+    async for piece in agen:
+        if first:
+            record("llm.first_token", time.perf_counter() - t0)
+            first = False
+        yield piece
+    record("llm.stream", time.perf_counter() - t0)
 
 
 # --------------------------
@@ -120,6 +170,20 @@ def update_state_from_text(state: ProfileState, user_msg: str) -> ProfileState:
     return state
 
 
+def tokenize_kw(s: str) -> List[str]:
+    # Tokens de intereses / palabras clave del usuario (para kw_overlap)
+    toks = [t.strip().lower()
+            for t in re.split(r"[,\;/]| y | and ", s or "") if t.strip()]
+    out = []
+    for t in toks:
+        out.extend([w for w in re.split(r"\s+", t) if w])
+    return list(dict.fromkeys(out))
+
+
+def profile_tokens(state: ProfileState) -> List[str]:
+    return tokenize_kw((state.keywords_text or "") + " " + " ".join(state.interests or []))
+
+
 def build_query_from_state(state: ProfileState) -> str:
     # Query semántica híbrida
     parts = []
@@ -147,26 +211,56 @@ def build_query_from_state(state: ProfileState) -> str:
     return " | ".join(parts) or "fundamentos para principiantes"
 
 
-def llm_intro_coach(llm: ChatOpenAI, state: ProfileState, user_msg: str) -> str:
-    messages = [
+def intro_coach_messages(state: ProfileState, user_msg: str) -> List[Dict[str, str]]:
+    return [
         {"role": "system", "content": "Eres un coach vocacional amable y práctico. Haces preguntas cortas, conectas intereses con cursos y justificas sugerencias con claridad. No inventes datos del catálogo."},
         {"role": "user", "content": f"Idioma: {
             state.language}. Usuario dice: {user_msg}."}
     ]
-    return llm.chat(messages)
 
 
-def llm_explain_track(llm: ChatOpenAI, state: ProfileState, courses: List[dict]) -> str:
-    # Genera explicación amigable de por qué ese orden y cómo encaja con la persona
+def llm_intro_coach(llm: ChatOpenAI, state: ProfileState, user_msg: str) -> str:
+    return llm.chat(intro_coach_messages(state, user_msg))
+
+
+# Campos del perfil que cambian la explicación (prompt y modo semántico de la caché)
+EXPLAIN_PROFILE_FIELDS = [
+    "language", "area", "level", "max_hours", "access", "population",
+    "self_style", "interests", "values", "learning_style", "goals",
+]
+
+
+def explain_track_messages(state: ProfileState, courses: List[dict]) -> List[Dict[str, str]]:
+    # La ruta ya viene decidida y ordenada (path_builder): el LLM solo la narra.
+    # Perfil reducido a los campos con valor que cambian la explicación
     bullets = []
-    for c in courses[:6]:
+    for i, c in enumerate(courses, 1):
         r = c["row"]
-        bullets.append(f"- {r.get('Curso', '(sin nombre)')} · {r.get(
-            'Nivel de complejidad', '')} · {r.get('Duración del Curso', '')}")
+        # Sin nivel / duración (NaN) no se listan
+        parts = [r.get("Curso", "(sin nombre)"), r.get("Nivel de complejidad", ""),
+                 r.get("Duración del Curso", "")]
+        bullets.append(f"{i}. " + " · ".join(str(v) for v in parts if v == v and str(v).strip()))
     plan = "\n".join(bullets)
-    messages = [
-        {"role": "system", "content": "Eres un asesor que explica rutas de aprendizaje en lenguaje claro, de básico a avanzado, conectando intereses/valores del usuario con los cursos."},
-        {"role": "user", "content": f"Perfil: {state.model_dump()}. Propón un orden (starter→aplicado→proyecto), 4–8 cursos. Lista breve:\n{
-            plan}\nExplica cómo encaja con sus intereses/estilo. Cierra preguntando si desea cambios."}
+    prof = {k: v for k, v in state.model_dump(include=set(EXPLAIN_PROFILE_FIELDS)).items() if v}
+    return [
+        {"role": "system", "content": "Eres un asesor que narra rutas de aprendizaje en lenguaje claro. La ruta ya está decidida: no cambies el orden ni agregues cursos."},
+        {"role": "user", "content": f"Perfil: {prof}. Ruta:\n{
+            plan}\nExplica cómo avanza y cómo encaja con sus intereses/estilo. Cierra preguntando si desea cambios."}
     ]
-    return llm.chat(messages)
+
+
+def explain_track_key(llm: ChatOpenAI, state: ProfileState, courses: List[dict]) -> str:
+    """
+    Clave semántica: ids de los cursos en orden + campos relevantes del perfil.
+    Ignora lo que no cambia la explicación (paso de la charla, edad, bio...),
+    así los reruns con la misma ruta reutilizan el texto.
+    """
+    ids = [str(c["row"].get("_id", c.get("idx"))) for c in courses]
+    prof = state.model_dump(include=set(EXPLAIN_PROFILE_FIELDS))
+    return content_key("explain", llm.model, llm.temperature, ids, prof)
+
+
+def llm_explain_track(llm: ChatOpenAI, state: ProfileState, courses: List[dict],
+                      semantic: bool = False) -> str:
+    key = explain_track_key(llm, state, courses) if semantic else None
+    return llm.chat(explain_track_messages(state, courses), cache_key=key)
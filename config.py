@@ -13,6 +13,12 @@ APP_TITLE_EN = "Training Paths Recommender · Vocational Coach"
 DEFAULT_ENV_XLS_PATH = "/mnt/data/CONTENIDOS ATENEA PARA RAG.xlsx"
 DEFAULT_ENV_TXT_PATH = "/mnt/data/record_0.txt"
 
+# Snapshots del índice RAG (uno por hash de contenido del Excel)
+INDEX_CACHE_DIR = ".rag_cache"
+
+# Procesos para parsear las hojas del Excel en paralelo (1 = secuencial)
+INGEST_WORKERS = 4
+
 LANGS = ["es", "en"]
 
 # Pesos de ranking (puedes ajustar en caliente desde la UI admin más adelante)
@@ -25,8 +31,68 @@ RANK_WEIGHTS = {
     "population": 1.0,
     "kw_overlap": 1.0,   # por hit (acotado por MAX_KW)
     "sim_tfidf": 2.0,    # similitud coseno tf-idf
-    "sim_bm25": 1.5
+    "sim_bm25": 1.5,
+    "sim_dense": 0.0     # similitud LSA (leg denso; subir junto con DENSE_DIM)
 }
 MAX_KW = 4
 TOPK_CANDIDATES = 80
 TOPK_FINAL = 12
+
+# Cliente LLM (cualquier servidor compatible con /chat/completions de OpenAI)
+LLM_BASE_URL = "https://api.openai.com/v1"
+LLM_TIMEOUT_S = 30.0
+LLM_MAX_RETRIES = 2
+LLM_MAX_CONCURRENCY = 8
+
+# Caché persistente de respuestas del LLM (SQLite)
+LLM_CACHE_PATH = INDEX_CACHE_DIR + "/llm_cache.sqlite"
+LLM_CACHE_SIZE = 5000
+LLM_CACHE_TTL_S = 7 * 24 * 3600
+# Explicaciones por (ids de cursos + campos del perfil) en vez de por texto exacto
+LLM_CACHE_SEMANTIC = True
+
+# Caché de recomendaciones compartida entre sesiones (mismo proceso)
+RECO_CACHE_SIZE = 512
+RECO_CACHE_TTL_S = 15 * 60
+
+# PDFs ya generados (por perfil + cursos), en memoria del proceso
+PDF_CACHE_SIZE = 64
+
+# Tiempos por etapa (spans); se puede activar en caliente desde el panel admin
+TRACING_ENABLED = False
+TRACE_WINDOW = 1024     # muestras por etapa para p50/p95/p99
+
+# Servicio de recomendación (reco_service.py): hilos y micro-lotes del endpoint HTTP
+SERVICE_WORKERS = 4
+SERVICE_MAX_BATCH = 32
+SERVICE_MAX_WAIT_MS = 5.0
+
+# Procesos para analizar y contar el corpus al construir el índice (1 = secuencial)
+INDEX_BUILD_WORKERS = 4
+
+# Consultas ya analizadas (ids de término) que guarda el analizador compartido
+ANALYZER_CACHE_SIZE = 1024
+
+# Índice en modo compacto (float32, metadatos categóricos, sin corpus en memoria)
+INDEX_COMPACT = False
+# Vocabulario por hashing de 2**bits columnas (0 = vocabulario exacto)
+INDEX_HASH_BITS = 0
+
+# Leg semántico denso: LSA (dimensiones; 0 = desactivado) + IVF (listas a revisar por consulta).
+# Opcional: con 128 dimensiones un build de 100k cursos pasa de ~6 s a ~38 s.
+# Activarlo junto con RANK_WEIGHTS["sim_dense"] (p. ej. 1.5)
+DENSE_DIM = 0
+DENSE_NPROBE = 8
+# Términos (mayor df) que entran al SVD; acota la proyección a DENSE_DIM x DENSE_MAX_TERMS
+DENSE_MAX_TERMS = 20000
+
+# Fusión de legs en hybrid_search: "weighted_rank" (score/max * 1/rank), "rrf" o "combsum"
+FUSION_STRATEGY = "weighted_rank"
+RRF_K = 60
+
+# Ruta final (path_builder.py): knapsack sobre los candidatos con presupuesto = max_hours
+PATH_MAX_PER_GROUP = 2       # cursos por Grupo de Competencias con score completo (0 = sin tope)
+PATH_GROUP_PENALTY = 0.5     # factor del score para los siguientes del mismo grupo
+PATH_HOURS_STEP = 0.5        # resolución de horas del DP
+PATH_MAX_BUCKETS = 256       # celdas de presupuesto como máximo (presupuestos grandes -> paso mayor)
+PATH_UNKNOWN_HOURS = 10.0    # horas de un curso sin duración si ningún candidato la tiene
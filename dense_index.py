@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Nov 28 10:14:52 2025
+
+@author: geam9
+"""
+
+from __future__ import annotations
+import numpy as np
+from scipy import sparse
+from typing import List, Dict, Tuple, Any
+from config import DENSE_NPROBE, DENSE_MAX_TERMS
+
+
+def _l2(x: np.ndarray) -> np.ndarray:
+    n = np.linalg.norm(x, axis=1, keepdims=True)
+    return (x / np.maximum(n, 1e-12)).astype(np.float32)
+
+
+def spherical_kmeans(x: np.ndarray, k: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    """Centroides l2 (k x dim) que maximizan el coseno con sus puntos."""
+    rng = np.random.default_rng(seed)
+    c = x[rng.choice(len(x), size=k, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(x @ c.T, axis=1)
+        onehot = sparse.csr_matrix((np.ones(len(x), dtype=np.float32),
+                                    (assign, np.arange(len(x)))), shape=(k, len(x)))
+        sums = np.asarray(onehot @ x)
+        empty = np.asarray(onehot.sum(axis=1)).ravel() == 0
+        # Listas vacías: se re-siembran con puntos al azar
+        sums[empty] = x[rng.choice(len(x), size=int(empty.sum()))]
+        c = _l2(sums)
+    return c
+
+
+class DenseIndex:
+    """
+    Leg semántico: LSA (TruncatedSVD sobre la matriz tf-idf) a vectores l2 de
+    `dim` dimensiones + índice IVF. Cada documento cae en la lista de su
+    centroide más cercano; una consulta solo puntúa las `nprobe` listas con
+    centroide más parecido (nprobe = nlist equivale a fuerza bruta). Subir
+    `nprobe` mejora el recall a cambio de latencia.
+
+    La proyección solo usa los `max_terms` términos con mayor df: la matriz
+    `components` (dim x términos, densa) es el costo de memoria del leg y el
+    SVD escala con su ancho. Con `dtype=float16` ocupa la mitad.
+
+    Los vectores pueden venir de otro embedder local: `from_vectors` arma el
+    IVF sobre cualquier matriz (n x dim) y `search` recibe vectores de consulta.
+    """
+
+    def __init__(self, components: np.ndarray | None, vectors: np.ndarray,
+                 centroids: np.ndarray, assign: np.ndarray, nprobe: int = DENSE_NPROBE,
+                 cols: np.ndarray | None = None):
+        self.components = components          # (dim x términos usados) o None si no es LSA
+        self.vectors = vectors                # (docs x dim) float32, l2
+        self.centroids = centroids            # (nlist x dim) float32, l2
+        self.assign = assign                  # lista de cada documento
+        self.nprobe = nprobe
+        # Columna tf-idf de cada columna de `components` (None = todas, en orden)
+        self.cols = cols
+        self._colpos: np.ndarray | None = None
+        self._order: np.ndarray | None = None
+        self._offsets: np.ndarray | None = None
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def fit(cls, tfidf_mat: sparse.spmatrix, dim: int = 128, nlist: int | None = None,
+            nprobe: int = DENSE_NPROBE, seed: int = 0, max_terms: int = DENSE_MAX_TERMS,
+            dtype=np.float32) -> "DenseIndex | None":
+        """LSA + IVF sobre la matriz tf-idf del catálogo; None si es muy chica para proyectar."""
+        df = np.diff(tfidf_mat.tocsc().indptr)
+        cols = np.flatnonzero(df)
+        if max_terms and len(cols) > max_terms:
+            # Los de mayor df (empates: menor columna), en orden de columna
+            cols = np.sort(cols[np.lexsort((cols, -df[cols]))[:max_terms]])
+        dim = min(dim, len(cols) - 1, tfidf_mat.shape[0] - 1)
+        if dim < 2:
+            return None
+        # sklearn solo al construir: cargar un snapshot o consultar no lo importa
+        from sklearn.decomposition import TruncatedSVD
+        svd = TruncatedSVD(n_components=dim, algorithm="randomized", n_iter=5, random_state=seed)
+        vectors = _l2(svd.fit_transform(tfidf_mat.tocsc()[:, cols]))
+        return cls.from_vectors(vectors, svd.components_.astype(dtype), nlist, nprobe, seed,
+                                cols=cols.astype(np.int64))
+
+    @classmethod
+    def from_vectors(cls, vectors: np.ndarray, components: np.ndarray | None = None,
+                     nlist: int | None = None, nprobe: int = DENSE_NPROBE,
+                     seed: int = 0, cols: np.ndarray | None = None) -> "DenseIndex":
+        vectors = _l2(vectors)
+        n = len(vectors)
+        # ~sqrt(n) listas; k-means sobre una muestra acotada y asignación de todos
+        nlist = max(1, min(nlist or int(np.sqrt(n)), n))
+        rng = np.random.default_rng(seed)
+        sample = vectors if n <= 64 * nlist else vectors[rng.choice(n, 64 * nlist, replace=False)]
+        centroids = spherical_kmeans(sample, nlist, seed=seed)
+        return cls(components, vectors, centroids, cls._nearest(vectors, centroids), nprobe, cols)
+
+    @staticmethod
+    def _nearest(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+        return np.concatenate([np.argmax(vectors[i:i + chunk] @ centroids.T, axis=1)
+                               for i in range(0, max(len(vectors), 1), chunk)]).astype(np.int32)
+
+    def _lists(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._order is None:
+            self._order = np.argsort(self.assign, kind="stable").astype(np.int32)
+            self._offsets = np.concatenate(
+                [[0], np.cumsum(np.bincount(self.assign, minlength=self.nlist))]).astype(np.int64)
+        return self._order, self._offsets
+
+    # -----------------------------
+    # Actualizaciones
+    # -----------------------------
+    def project(self, tfidf_rows: sparse.csr_matrix) -> np.ndarray:
+        """Filas tf-idf -> vectores l2 (términos fuera de la proyección se ignoran)."""
+        X = sparse.csr_matrix(tfidf_rows)
+        pos = self._column_positions(X.shape[1])
+        # Solo las columnas de `components` que usan estas filas, en float32
+        p = pos[X.indices]
+        ok = p >= 0
+        used, inv = np.unique(p[ok], return_inverse=True)
+        rows = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))[ok]
+        Xs = sparse.csr_matrix((X.data[ok], (rows, inv)), shape=(X.shape[0], len(used)))
+        return _l2(np.asarray(Xs @ self.components[:, used].T.astype(np.float32)))
+
+    def _column_positions(self, n_cols: int) -> np.ndarray:
+        # Columna tf-idf -> columna de `components` (-1 = fuera de la proyección)
+        if self._colpos is None or len(self._colpos) < n_cols:
+            cols = np.arange(self.components.shape[1]) if self.cols is None else self.cols
+            pos = np.full(max(n_cols, int(cols.max(initial=-1)) + 1), -1, dtype=np.int64)
+            pos[cols] = np.arange(len(cols))
+            self._colpos = pos
+        return self._colpos
+
+    def remap_columns(self, new_col: np.ndarray) -> None:
+        """
+        El vocabulario tf-idf se renumeró (compactación): `new_col[c]` es la
+        columna nueva de la columna c (-1 si se quitó). La proyección se conserva.
+        """
+        cols = np.arange(self.components.shape[1]) if self.cols is None else self.cols
+        cols = np.where(cols < len(new_col), new_col[np.minimum(cols, len(new_col) - 1)], -1)
+        keep = cols >= 0
+        self.components = self.components[:, keep]
+        self.cols = cols[keep].astype(np.int64)
+        self._colpos = None
+
+    def keep(self, rows: np.ndarray) -> None:
+        """Deja solo los documentos `rows`, en ese orden (centroides intactos)."""
+        self.vectors = self.vectors[rows]
+        self.assign = self.assign[rows]
+        self._order = self._offsets = None
+
+    def add(self, vectors: np.ndarray) -> None:
+        """Agrega documentos al final (a la lista de su centroide más cercano)."""
+        self.vectors = np.vstack([self.vectors, vectors.astype(np.float32)])
+        self.assign = np.concatenate([self.assign, self._nearest(vectors, self.centroids)])
+        self._order = self._offsets = None
+
+    # -----------------------------
+    # Consultas
+    # -----------------------------
+    def search(self, queries: np.ndarray, topk: int,
+               docs: np.ndarray | None = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k por consulta: (índices, cosenos), ordenados de mayor a menor. Con
+        `docs` solo compiten esos documentos y los índices son posiciones en
+        `docs` (como los otros legs). Consultas con menos de k resultados se
+        rellenan con índice -1.
+        """
+        nq = len(queries)
+        idx = np.full((nq, topk), -1, dtype=np.int64)
+        val = np.zeros((nq, topk), dtype=np.float64)
+        if nq == 0 or topk == 0:
+            return idx, val
+        order, offsets = self._lists()
+        pos = None
+        if docs is not None:
+            pos = np.full(len(self.vectors), -1, dtype=np.int64)
+            pos[docs] = np.arange(len(docs))
+        # Si los elegibles son menos que lo que recorrerían las listas, fuerza bruta exacta
+        scan = len(self.vectors) * min(self.nprobe, self.nlist) / self.nlist
+        if self.nprobe >= self.nlist or (docs is not None and len(docs) <= scan):
+            S = queries @ (self.vectors if docs is None else self.vectors[docs]).T
+            k = min(topk, S.shape[1])
+            if k == 0:
+                return idx, val
+            part = np.argpartition(-S, k - 1, axis=1)[:, :k] if k < S.shape[1] else \
+                np.tile(np.arange(k), (nq, 1))
+            vals = np.take_along_axis(S, part, axis=1)
+            o = np.lexsort((part, -vals), axis=-1)
+            idx[:, :k] = np.take_along_axis(part, o, axis=1)
+            val[:, :k] = np.take_along_axis(vals, o, axis=1)
+            return idx, val
+
+        probes = np.argpartition(-(queries @ self.centroids.T), self.nprobe - 1,
+                                 axis=1)[:, :self.nprobe]
+        for qi in range(nq):
+            cand = np.concatenate([order[offsets[p]:offsets[p + 1]] for p in probes[qi]])
+            if pos is not None:
+                cand = cand[pos[cand] >= 0]
+            if not len(cand):
+                continue
+            s = self.vectors[cand] @ queries[qi]
+            k = min(topk, len(cand))
+            top = np.argpartition(-s, k - 1)[:k] if k < len(cand) else np.arange(len(cand))
+            top = top[np.lexsort((cand[top], -s[top]))]
+            idx[qi, :k] = cand[top] if pos is None else pos[cand[top]]
+            val[qi, :k] = s[top]
+        return idx, val
+
+    # -----------------------------
+    # Persistencia
+    # -----------------------------
+    def memory_bytes(self) -> int:
+        arrays = [self.components, self.cols, self.vectors, self.centroids, self.assign,
+                  self._order, self._offsets]
+        return int(sum(a.nbytes for a in arrays if a is not None))
+
+    def to_arrays(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray], List[str]]:
+        order, offsets = self._lists()
+        arrays = {"vectors": self.vectors, "centroids": self.centroids, "assign": self.assign,
+                  "order": order, "offsets": offsets}
+        if self.components is not None:
+            arrays["components"] = self.components
+        if self.cols is not None:
+            arrays["cols"] = self.cols
+        return {"nprobe": self.nprobe, "dim": int(self.vectors.shape[1])}, arrays, []
+
+    @classmethod
+    def from_arrays(cls, meta: Dict[str, Any], arrays: Dict[str, np.ndarray],
+                    terms: List[str]) -> "DenseIndex":
+        self = cls(arrays.get("components"), arrays["vectors"], arrays["centroids"],
+                   arrays["assign"], meta["nprobe"], arrays.get("cols"))
+        self._order, self._offsets = arrays["order"], arrays["offsets"]
+        return self
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Nov 14 09:31:47 2025
+
+@author: geam9
+"""
+
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, Callable, List, Tuple
+
+COL_AREA = "Grupo de Competencias"
+COL_SHEET = "_sheet"
+COL_LEVEL = "Nivel de complejidad"
+COL_ACCESS = "Tipo de Acceso (REA o Redireccionamiento)"
+COL_POPULATION = "Población objetivo"
+COL_HOURS = "_horas"
+
+# Máximo de máscaras por valor que se guardan (población es texto libre)
+_MAX_CACHED_MASKS = 256
+# Clave única para NaN/None al codificar filas nuevas (NaN != NaN)
+_NA = object()
+
+
+def _key(v: Any) -> Any:
+    return _NA if v is None or (isinstance(v, float) and v != v) else v
+
+
+class _CodedColumn:
+    """Columna categórica: códigos por fila + valores únicos (crudos y como str)."""
+
+    def __init__(self, s: pd.Series):
+        codes, uniques = pd.factorize(s, use_na_sentinel=False)
+        self.codes = codes
+        self.raw = list(uniques)
+        # str(x) igual que el filtro por fila original (NaN -> "nan")
+        self.text = [str(u) for u in self.raw]
+        self._lookup: Dict[Any, int] | None = None
+
+    def ok(self, pred: Callable[[Any, str], bool], start: int = 0) -> np.ndarray:
+        """Predicado sobre los valores únicos desde `start`."""
+        return np.fromiter((pred(r, t) for r, t in zip(self.raw[start:], self.text[start:])),
+                           dtype=bool, count=len(self.raw) - start)
+
+    def append(self, s: pd.Series) -> None:
+        """Codifica filas nuevas; los valores no vistos se agregan al final."""
+        if self._lookup is None:
+            self._lookup = {_key(r): i for i, r in enumerate(self.raw)}
+        new = np.empty(len(s), dtype=self.codes.dtype)
+        for j, v in enumerate(s.tolist()):
+            code = self._lookup.get(_key(v))
+            if code is None:
+                code = self._lookup[_key(v)] = len(self.raw)
+                self.raw.append(v)
+                self.text.append(str(v))
+            new[j] = code
+        self.codes = np.concatenate([self.codes, new])
+
+
+def _hours(df: pd.DataFrame) -> np.ndarray:
+    return pd.to_numeric(df[COL_HOURS], errors="coerce").to_numpy(dtype=np.float64)
+
+
+class FilterIndex:
+    """
+    Índice de metadatos construido una vez por catálogo: columnas codificadas
+    (área, hoja, nivel, acceso, población) y `_horas` ordenado. Cada filtro se
+    resuelve sobre los valores únicos y se expande a una máscara booleana por
+    documento, sin acceso por fila a pandas.
+
+    `append` suma filas (segmento delta del índice) sin reconstruir: codifica
+    solo las nuevas, extiende las máscaras en caché y guarda sus horas aparte.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.n_docs = len(df)
+        self._cols = {c: _CodedColumn(df[c]) for c in
+                      (COL_AREA, COL_SHEET, COL_LEVEL, COL_ACCESS, COL_POPULATION)}
+        hours = _hours(df)
+        # argsort deja los NaN al final: solo los primeros n_valid tienen horas
+        self._hours_order = np.argsort(hours, kind="stable")
+        self._hours_sorted = hours[self._hours_order]
+        self._n_valid_hours = int((~np.isnan(hours)).sum())
+        # Horas de las filas agregadas con `append` (posiciones n_base..n_docs-1)
+        self._n_base = self.n_docs
+        self._delta_hours = np.zeros(0)
+        # clave -> (partes (columna, predicado), ok por valor único de cada parte, máscara)
+        self._cache: Dict[Tuple[str, Any], Tuple[list, List[np.ndarray], np.ndarray]] = {}
+
+    def append(self, df: pd.DataFrame) -> None:
+        """Agrega filas al final (posiciones n_docs..): costo proporcional a las nuevas."""
+        if df.empty:
+            return
+        start, seen = self.n_docs, {c: len(col.raw) for c, col in self._cols.items()}
+        for c, col in self._cols.items():
+            col.append(df[c])
+        self.n_docs += len(df)
+        self._delta_hours = np.concatenate([self._delta_hours, _hours(df)])
+        for key, (parts, oks, mask) in self._cache.items():
+            oks = [np.concatenate([ok, self._cols[c].ok(pred, seen[c])])
+                   for (c, pred), ok in zip(parts, oks)]
+            new = np.logical_or.reduce([ok[self._cols[c].codes[start:]]
+                                        for (c, _), ok in zip(parts, oks)])
+            self._cache[key] = (parts, oks, np.concatenate([mask, new]))
+
+    def _cached(self, key: Tuple[str, Any],
+                parts: List[Tuple[str, Callable[[Any, str], bool]]]) -> np.ndarray:
+        # Máscara = OR de un predicado por columna, evaluado sobre los valores únicos
+        hit = self._cache.get(key)
+        if hit is None:
+            if len(self._cache) >= _MAX_CACHED_MASKS:
+                self._cache.clear()
+            oks = [self._cols[c].ok(pred) for c, pred in parts]
+            mask = np.logical_or.reduce([ok[self._cols[c].codes] for (c, _), ok in zip(parts, oks)])
+            hit = self._cache[key] = (parts, oks, mask)
+        return hit[2]
+
+    def area_mask(self, area: str) -> np.ndarray:
+        # Coincidencia exacta con el grupo de competencias o con la hoja
+        same = lambda r, t: r == area
+        return self._cached(("area", area), [(COL_AREA, same), (COL_SHEET, same)])
+
+    def level_mask(self, level: str) -> np.ndarray:
+        return self._cached(("level", level), [(COL_LEVEL, lambda r, t: t.strip() == level)])
+
+    def access_mask(self, access: str) -> np.ndarray:
+        a = access.lower()
+        return self._cached(("access", a), [(COL_ACCESS, lambda r, t: a in t.lower())])
+
+    def population_mask(self, population: str) -> np.ndarray:
+        p = population.lower()
+        return self._cached(("population", p), [(COL_POPULATION, lambda r, t: p in t.lower())])
+
+    def hours_mask(self, max_hours: float) -> np.ndarray:
+        # Excluye cursos con horas > máximo; sin horas (NaN) siempre pasan
+        cut = np.searchsorted(self._hours_sorted[:self._n_valid_hours],
+                              float(max_hours), side="right")
+        m = np.ones(self.n_docs, dtype=bool)
+        m[self._hours_order[cut:self._n_valid_hours]] = False
+        m[self._n_base:] = ~(self._delta_hours > float(max_hours))
+        return m
+
+    def eligible(self, area: str = "", level: str = "", access: str = "",
+                 population: str = "", max_hours: float | None = None) -> np.ndarray | None:
+        """
+        Ids (ordenados) de documentos que cumplen todos los filtros activos,
+        o None si no hay ningún filtro activo.
+        """
+        masks = []
+        if area:
+            masks.append(self.area_mask(area))
+        if level:
+            masks.append(self.level_mask(level))
+        if access:
+            masks.append(self.access_mask(access))
+        if population:
+            masks.append(self.population_mask(population))
+        if max_hours is not None:
+            masks.append(self.hours_mask(max_hours))
+        if not masks:
+            return None
+        m = np.logical_and.reduce(masks) if len(masks) > 1 else masks[0]
+        return np.flatnonzero(m)
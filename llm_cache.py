@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Nov 24 09:37:12 2025
+
+@author: geam9
+"""
+
+from __future__ import annotations
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Callable, Dict, List
+
+
+def content_key(*parts: Any) -> str:
+    """sha256 de la serialización canónica (claves ordenadas, sin espacios) de `parts`."""
+    blob = json.dumps(parts, sort_keys=True, ensure_ascii=False,
+                      separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def message_key(messages: List[Dict[str, str]], model: str, temperature: float) -> str:
+    return content_key("chat", model, temperature, messages)
+
+
+class LLMResponseCache:
+    """
+    Caché persistente de respuestas del LLM en SQLite, direccionada por
+    contenido (ver `content_key`). Acotada por tamaño (descarta las de acceso
+    más antiguo) y por antigüedad (TTL, segundos; None = sin expiración).
+    Misma interfaz y métricas que caching.LRUTTLCache; segura entre hilos.
+    """
+
+    def __init__(self, path: str, maxsize: int = 5000, ttl: float | None = None,
+                 clock: Callable[[], float] = time.time):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                              key TEXT PRIMARY KEY, value TEXT NOT NULL,
+                              created REAL NOT NULL, accessed REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        now = self._clock()
+        with self._lock:
+            row = self._db.execute("SELECT value, created FROM responses WHERE key = ?",
+                                   (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.expirations += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return default
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, value: str) -> str:
+        now = self._clock()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                             (key, value, now, now))
+            over = len(self) - self.maxsize
+            if over > 0:
+                self._db.execute("""DELETE FROM responses WHERE key IN (
+                                      SELECT key FROM responses ORDER BY accessed LIMIT ?)""",
+                                 (over,))
+                self.evictions += over
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
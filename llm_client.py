@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Nov 21 10:14:37 2025
+
+@author: geam9
+"""
+
+from __future__ import annotations
+import json
+import queue
+import random
+import asyncio
+import threading
+from typing import Callable, Dict, List, AsyncIterator, Iterator
+import httpx
+from config import LLM_BASE_URL, LLM_TIMEOUT_S, LLM_MAX_RETRIES, LLM_MAX_CONCURRENCY
+
+# Respuestas que vale la pena reintentar (límite de tasa / caídas del servidor)
+_RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMError(RuntimeError):
+    pass
+
+
+class AsyncLLMClient:
+    """
+    Cliente asíncrono para /chat/completions de la API de OpenAI (o cualquier
+    servidor compatible). Una sola conexión HTTP reutilizada (keep-alive), un
+    semáforo para acotar las llamadas simultáneas y reintentos con backoff
+    exponencial solo antes del primer token: un stream ya iniciado no se
+    repite para no duplicar texto en la UI.
+    """
+
+    def __init__(self, api_key: str, model: str = "gpt-4o-mini", temperature: float = 0.4,
+                 base_url: str = LLM_BASE_URL, timeout: float = LLM_TIMEOUT_S,
+                 max_retries: int = LLM_MAX_RETRIES, max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.api_key = api_key
+        self.model = model
+        self.temperature = temperature
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        # Se crean dentro del loop que los usa (ver _ensure)
+        self._http: httpx.AsyncClient | None = None
+        self._sem: asyncio.Semaphore | None = None
+
+    def _ensure(self) -> httpx.AsyncClient:
+        if self._http is None:
+            self._http = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency))
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        return self._http
+
+    async def aclose(self) -> None:
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+    async def stream(self, messages: List[Dict[str, str]]) -> AsyncIterator[str]:
+        """Fragmentos de texto a medida que llegan (SSE `data: {...}`)."""
+        http = self._ensure()
+        body = {"model": self.model, "temperature": self.temperature,
+                "messages": messages, "stream": True}
+        async with self._sem:
+            for attempt in range(self.max_retries + 1):
+                started = False
+                try:
+                    async with http.stream("POST", "/chat/completions", json=body) as resp:
+                        if resp.status_code in _RETRY_STATUS and attempt < self.max_retries:
+                            await resp.aread()
+                            await self._backoff(attempt)
+                            continue
+                        if resp.status_code != 200:
+                            await resp.aread()
+                            raise LLMError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+                        async for line in resp.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[5:].strip()
+                            if data == "[DONE]":
+                                return
+                            choices = json.loads(data).get("choices") or [{}]
+                            piece = (choices[0].get("delta") or {}).get("content")
+                            if piece:
+                                started = True
+                                yield piece
+                    return
+                except (httpx.TransportError, httpx.TimeoutException) as e:
+                    if started or attempt >= self.max_retries:
+                        raise LLMError(f"{type(e).__name__}: {e}") from e
+                    await self._backoff(attempt)
+
+    async def complete(self, messages: List[Dict[str, str]]) -> str:
+        return "".join([p async for p in self.stream(messages)])
+
+    @staticmethod
+    async def _backoff(attempt: int) -> None:
+        # 0.25s, 0.5s, 1s... con jitter para no sincronizar reintentos
+        await asyncio.sleep(0.25 * (2 ** attempt) * (0.5 + random.random()))
+
+
+# -----------------------------
+# Puente sync -> async (Streamlit ejecuta el script en hilos sin loop)
+# -----------------------------
+class LoopThread:
+    """
+    Un event loop de fondo por proceso. Los clientes viven en él, así las
+    conexiones se reutilizan entre reruns y sesiones.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever,
+                                        name="llm-loop", daemon=True)
+        self._thread.start()
+
+    def run(self, coro, timeout: float | None = None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def start_stream(self, agen: AsyncIterator[str], fallback: str = "",
+                     on_complete: Callable[[str], None] | None = None) -> "StreamHandle":
+        """
+        Arranca el stream ya (en el loop de fondo) y devuelve un iterador sync.
+        `on_complete(texto)` se llama si el stream termina sin error, aunque
+        nadie consuma el iterador.
+        """
+        handle = StreamHandle(fallback)
+
+        async def pump():
+            parts = []
+            try:
+                async for piece in agen:
+                    parts.append(piece)
+                    handle._q.put(piece)
+                if on_complete is not None:
+                    on_complete("".join(parts))
+            except Exception as e:
+                handle._q.put(e)
+            finally:
+                handle._q.put(StreamHandle._END)
+
+        handle._future = asyncio.run_coroutine_threadsafe(pump(), self.loop)
+        return handle
+
+
+class StreamHandle:
+    """Iterador de fragmentos producidos en el loop de fondo; guarda el texto completo."""
+
+    _END = object()
+
+    def __init__(self, fallback: str = ""):
+        self._q: queue.Queue = queue.Queue()
+        self._future = None
+        self.text = ""
+        self.error: Exception | None = None
+        # Texto a mostrar si el stream falla antes de producir algo
+        self.fallback = fallback
+
+    @classmethod
+    def from_text(cls, text: str) -> "StreamHandle":
+        handle = cls()
+        handle._q.put(text)
+        handle._q.put(cls._END)
+        return handle
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            item = self._q.get()
+            if item is StreamHandle._END:
+                return
+            if isinstance(item, Exception):
+                self.error = item
+                if not self.text and self.fallback:
+                    self.text = self.fallback
+                    yield self.fallback
+                return
+            self.text += item
+            yield item
+
+    def result(self) -> str:
+        for _ in self:
+            pass
+        return self.text
+
+
+_LOOP: LoopThread | None = None
+_CLIENTS: Dict[tuple, AsyncLLMClient] = {}
+_LOCK = threading.Lock()
+
+
+def background_loop() -> LoopThread:
+    global _LOOP
+    with _LOCK:
+        if _LOOP is None:
+            _LOOP = LoopThread()
+        return _LOOP
+
+
+def shared_client(api_key: str, model: str, temperature: float,
+                  base_url: str = LLM_BASE_URL) -> AsyncLLMClient:
+    # Un cliente (y su pool de conexiones) por configuración y proceso
+    key = (api_key, model, temperature, base_url)
+    with _LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            client = _CLIENTS[key] = AsyncLLMClient(api_key, model, temperature, base_url)
+        return client
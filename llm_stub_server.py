@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Nov 21 11:02:55 2025
+
+@author: geam9
+"""
+
+from __future__ import annotations
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Tuple
+
+
+class StubConfig:
+    """Latencias y fallas simuladas (segundos / probabilidad)."""
+
+    def __init__(self, ttft: float = 0.3, token_delay: float = 0.02,
+                 fail_rate: float = 0.0, n_tokens: int = 60, seed: int | None = None):
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.fail_rate = fail_rate
+        self.n_tokens = n_tokens
+        self.rng = random.Random(seed)
+        self.requests = 0
+
+
+def stub_reply(messages, n_tokens: int) -> list:
+    # Respuesta determinista: eco de palabras del último mensaje
+    last = messages[-1].get("content", "") if messages else ""
+    words = [w for w in str(last).replace("\n", " ").split(" ") if w] or ["ok"]
+    out = ["(stub)"] + [words[i % len(words)] for i in range(max(n_tokens - 1, 0))]
+    return [w + " " for w in out]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1: keep-alive + chunked, igual que la API real
+    protocol_version = "HTTP/1.1"
+    cfg: StubConfig = StubConfig()
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _json(self, code: int, obj) -> None:
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._json(404, {"error": {"message": "not found"}})
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        cfg = self.cfg
+        cfg.requests += 1
+        if cfg.fail_rate and cfg.rng.random() < cfg.fail_rate:
+            return self._json(503, {"error": {"message": "stub: falla simulada"}})
+        time.sleep(cfg.ttft)
+        pieces = stub_reply(req.get("messages", []), cfg.n_tokens)
+        model = req.get("model", "stub")
+
+        if not req.get("stream"):
+            time.sleep(cfg.token_delay * len(pieces))
+            return self._json(200, {"object": "chat.completion", "model": model, "choices": [
+                {"index": 0, "finish_reason": "stop",
+                 "message": {"role": "assistant", "content": "".join(pieces)}}]})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for p in pieces:
+                evt = {"object": "chat.completion.chunk", "model": model,
+                       "choices": [{"index": 0, "delta": {"content": p}}]}
+                self._chunk(f"data: {json.dumps(evt)}\n\n".encode("utf-8"))
+                time.sleep(cfg.token_delay)
+            self._chunk(b"data: [DONE]\n\n")
+            self._chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente cortó (timeout / cancelación)
+            self.close_connection = True
+
+
+def serve_in_thread(cfg: StubConfig | None = None, host: str = "127.0.0.1",
+                    port: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """Levanta el stub en un hilo; retorna (servidor, base_url). port=0 elige uno libre."""
+    handler = type("StubHandler", (_Handler,), {"cfg": cfg or StubConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="llm-stub", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Servidor local compatible con /v1/chat/completions")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--ttft", type=float, default=0.3, help="latencia hasta el primer token (s)")
+    ap.add_argument("--token-delay", type=float, default=0.02, help="pausa entre tokens (s)")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="probabilidad de HTTP 503")
+    ap.add_argument("--tokens", type=int, default=60)
+    args = ap.parse_args()
+
+    cfg = StubConfig(args.ttft, args.token_delay, args.fail_rate, args.tokens)
+    handler = type("StubHandler", (_Handler,), {"cfg": cfg})
+    print(f"Stub LLM en http://{args.host}:{args.port}/v1 "
+          f"(en .streamlit/secrets.toml: OPENAI_API_KEY=\"stub\", OPENAI_BASE_URL=\"http://{args.host}:{args.port}/v1\")")
+    ThreadingHTTPServer((args.host, args.port), handler).serve_forever()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Dec  3 09:41:18 2025
+
+@author: geam9
+"""
+
+from __future__ import annotations
+import math
+import numpy as np
+from typing import Any, Dict, List, Tuple
+from config import (TOPK_FINAL, PATH_MAX_PER_GROUP, PATH_GROUP_PENALTY, PATH_HOURS_STEP,
+                    PATH_MAX_BUCKETS, PATH_UNKNOWN_HOURS)
+from ranker import CandidateMatrix, FeatureTable
+from text_analyzer import fold
+from tracing import traced
+
+# Progresión de la ruta (niveles sin tildes); sin nivel -> junto a Intermedio
+LEVEL_ORDER = {"basico": 0, "intermedio": 1, "avanzado": 2}
+_UNKNOWN_LEVEL = 1
+
+
+# -----------------------------
+# Atributos de los candidatos
+# -----------------------------
+def level_ranks(table: FeatureTable, idx: np.ndarray) -> np.ndarray:
+    ranks = np.array([LEVEL_ORDER.get(fold(v), _UNKNOWN_LEVEL) for v in table.level.values],
+                     dtype=np.int64)
+    return ranks[table.level.codes[idx]]
+
+
+def course_hours(table: FeatureTable, idx: np.ndarray) -> np.ndarray:
+    """Horas por candidato; sin duración -> mediana de los candidatos que la tienen."""
+    hours = table.hours[idx].copy()
+    known = ~np.isnan(hours)
+    hours[~known] = float(np.median(hours[known])) if known.any() else PATH_UNKNOWN_HOURS
+    return hours
+
+
+def hour_units(hours: np.ndarray, budget: float | None) -> Tuple[np.ndarray, int]:
+    """
+    Horas -> unidades enteras del DP (hacia arriba: la ruta nunca se pasa del
+    presupuesto) y capacidad. Sin presupuesto todo cuesta 0.
+    """
+    if not budget or budget <= 0:
+        return np.zeros(len(hours), dtype=np.int64), 0
+    unit = max(PATH_HOURS_STEP, budget / PATH_MAX_BUCKETS)
+    cap = int(math.floor(budget / unit + 1e-9))
+    return np.ceil(hours / unit - 1e-9).astype(np.int64), cap
+
+
+# -----------------------------
+# Knapsack
+# -----------------------------
+def group_cap(area: str) -> int:
+    """Cursos por grupo con score completo: con filtro de área todos comparten grupo -> sin tope."""
+    return 0 if (area or "").strip() else PATH_MAX_PER_GROUP
+
+
+def select(scores: np.ndarray, cost: np.ndarray, groups: np.ndarray, capacity: int,
+           max_items: int, max_per_group: int = PATH_MAX_PER_GROUP,
+           penalty: float = PATH_GROUP_PENALTY) -> List[int]:
+    """
+    Knapsack 0/1 exacto: máximo score total con costo <= `capacity` y a lo
+    sumo `max_items` ítems. Diversidad blanda: dentro de un grupo, los ítems
+    que pasan de `max_per_group` valen `penalty` veces su score (0 = sin
+    penalización; grupo < 0 = sin grupo). Estado dp[k, b, c]: k ítems,
+    capacidad b, c = min(ítems del grupo en curso, tope); los ítems se
+    recorren agrupados y por score, así el más alto de cada grupo es el que
+    cuenta completo. Retorna las posiciones elegidas.
+    """
+    ok = (scores > 0) & (cost <= capacity)
+    if not ok.any() or max_items <= 0:
+        return []
+    G = max_per_group if 0 < max_per_group < max_items and penalty < 1 else 0
+    # Orden determinista: grupos por su mejor ítem, ítems por score (empates: posición).
+    # De cada (grupo, costo) sirven solo los mejores K: cambiar uno por otro
+    # mejor de la misma clase nunca baja el total
+    pos = np.flatnonzero(ok)
+    pos = pos[np.argsort(-scores[pos], kind="stable")]
+    runs: Dict[Any, List[int]] = {}
+    seen: Dict[Tuple[int, int], int] = {}
+    for p in pos.tolist():
+        g = int(groups[p]) if G else 0
+        cls = (g, int(cost[p]))
+        if seen.get(cls, 0) >= max_items:
+            continue
+        seen[cls] = seen.get(cls, 0) + 1
+        runs.setdefault(g if g >= 0 else ("solo", p), []).append(p)
+
+    K, B, C = max_items, capacity, G + 1
+    dp = np.full((K + 1, B + 1, C), -np.inf)
+    dp[0, :, 0] = 0.0
+    trail = []     # por grupo: (c de origen al reiniciar, [(posición, tomado, desde c=tope)])
+    for items in runs.values():
+        arg = dp.argmax(axis=2)
+        dp0 = np.take_along_axis(dp, arg[..., None], axis=2)
+        dp = np.full_like(dp, -np.inf)
+        dp[:, :, :1] = dp0
+        steps = []
+        for p in items:
+            w, s = int(cost[p]), float(scores[p])
+            src = dp[:-1, :B + 1 - w]          # se lee entero antes de escribir dp[1:, w:]
+            sat = None
+            if G:
+                # c -> c+1 con score completo; en el tope se queda en G con penalización
+                cand = np.full(src.shape, -np.inf)
+                cand[..., 1:] = src[..., :-1] + s
+                pen = src[..., G] + s * penalty
+                sat = pen > cand[..., G]
+                np.maximum(cand[..., G], pen, out=cand[..., G])
+            else:
+                cand = src + s
+            cur = dp[1:, w:]
+            took = cand > cur
+            cur[took] = cand[took]
+            steps.append((p, took, sat))
+        trail.append((arg, steps))
+
+    best = dp.max(axis=2)[:, B]
+    k = int(np.argmax(best))
+    if not np.isfinite(best[k]) or best[k] <= 0:
+        return []
+    b, c = B, int(dp[k, B].argmax())
+    chosen = []
+    for arg, steps in reversed(trail):
+        for p, took, sat in reversed(steps):
+            w = int(cost[p])
+            # took cubre las celdas destino k >= 1, b >= w
+            if k >= 1 and b >= w and took[k - 1, b - w, c]:
+                chosen.append(p)
+                if G and not (c == G and sat[k - 1, b - w]):
+                    c -= 1
+                k, b = k - 1, b - w
+        c = int(arg[k, b])
+    return chosen[::-1]
+
+
+# -----------------------------
+# Ruta
+# -----------------------------
+@traced("path.plan")
+def plan_path(cm: CandidateMatrix, table: FeatureTable, weights: Dict[str, float],
+              max_hours: float | None, max_courses: int = TOPK_FINAL,
+              max_per_group: int = PATH_MAX_PER_GROUP) -> List[Dict[str, Any]]:
+    """
+    Ruta determinista sobre los candidatos ya puntuados: knapsack por score
+    con presupuesto `max_hours` (total de la ruta), tope de cursos y
+    penalización a partir del curso `max_per_group` de un mismo Grupo de
+    Competencias (ver group_cap); luego orden Básico -> Intermedio ->
+    Avanzado (dentro de cada nivel, por score). El LLM solo la narra.
+    """
+    n = len(cm.candidates)
+    if n == 0:
+        return []
+    scores = cm.scores(weights)
+    idx = np.fromiter((c["idx"] for c in cm.candidates), dtype=np.int64, count=n)
+    cost, capacity = hour_units(course_hours(table, idx), max_hours)
+    codes = table.area.codes[idx]
+    named = np.array([v != "" for v in table.area.values], dtype=bool)
+    groups = np.where(named[codes], codes, -1)
+    chosen = select(scores, cost, groups, capacity, max_courses, max_per_group)
+    levels = level_ranks(table, idx)
+    order = sorted(chosen, key=lambda p: (levels[p], -scores[p], p))
+    return cm.take(order, scores)
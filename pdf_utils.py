@@ -6,22 +6,35 @@ Created on Mon Nov  3 16:20:41 2025
 """
 
 from __future__ import annotations
+import os
 from io import BytesIO
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from reportlab.lib.pagesizes import LETTER
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import inch
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from tracing import traced
 
+FONT = "Helvetica"
 
+# Campos de la fila que usa el PDF (lo único que viaja a los procesos del lote)
+PDF_FIELDS = ["Curso", "Nivel de complejidad", "Duración del Curso", "Portal o Aliado",
+              "_sheet", "URL del Curso", "Descripción del Curso"]
+
+
+@traced("pdf.build")
 def build_path_pdf(title: str, profile_text: str, courses: list[dict]) -> bytes:
     buf = BytesIO()
     c = canvas.Canvas(buf, pagesize=LETTER)
     width, height = LETTER
     x, y = 0.8*inch, height - 1*inch
+    max_w = width - 2*x
 
     def line(txt, size=10, leading=14):
         nonlocal y
-        c.setFont("Helvetica", size)
-        for part in wrap_text(txt, 90):
+        c.setFont(FONT, size)
+        for part in wrap_text_width(txt, FONT, size, max_w):
             c.drawString(x, y, part)
             y -= leading
             if y < 1*inch:
@@ -57,16 +70,96 @@ def build_path_pdf(title: str, profile_text: str, courses: list[dict]) -> bytes:
     return buf.getvalue()
 
 
-def wrap_text(text: str, width: int) -> list[str]:
-    words = (text or "").split()
-    lines, current = [], []
-    for w in words:
-        tentative = " ".join(current + [w])
-        if len(tentative) > width:
+@lru_cache(maxsize=50_000)
+def _word_width(word: str, font: str, size: float) -> float:
+    # Palabras y tamaños se repiten mucho entre cursos y documentos
+    return stringWidth(word, font, size)
+
+
+def wrap_text_width(text: str, font: str, size: float, max_width: float) -> list[str]:
+    """
+    Corte por ancho real en puntos (métricas de la fuente): cada palabra se
+    mide una vez y el ancho de la línea se acumula, sin re-medir la línea.
+    Una palabra más ancha que la línea queda sola en la suya.
+    """
+    space = _word_width(" ", font, size)
+    lines, current, w_line = [], [], 0.0
+    for w in (text or "").split():
+        ww = _word_width(w, font, size)
+        if current and w_line + space + ww > max_width:
             lines.append(" ".join(current))
-            current = [w]
-        else:
-            current.append(w)
+            current, w_line = [], 0.0
+        w_line += ww + (space if current else 0.0)
+        current.append(w)
     if current:
         lines.append(" ".join(current))
     return lines
+
+
+# -----------------------------
+# Lote (exportación de cohortes)
+# -----------------------------
+def pdf_courses(courses: list[dict]) -> list[dict]:
+    """Candidatos -> solo los campos del PDF (livianos para enviar a otro proceso)."""
+    return [{"row": {k: c["row"].get(k, "") for k in PDF_FIELDS}} for c in courses]
+
+
+def _warm_worker() -> None:
+    # Cada proceso carga las métricas de la fuente una sola vez; la caché de
+    # anchos de palabra se reutiliza en todos los PDFs que le toquen
+    _word_width(" ", FONT, 9)
+
+
+def _build_job(job: tuple) -> bytes:
+    return build_path_pdf(*job)
+
+
+def build_path_pdfs(jobs: list[tuple], workers: int | None = None) -> list[bytes]:
+    """
+    Varios PDFs (title, profile_text, courses) en un pool de procesos, en el
+    mismo orden que `jobs`. Pasar los cursos por `pdf_courses` evita serializar
+    filas completas de pandas. Ejemplo (cohorte):
+
+        routes = service.recommend_many(profiles)
+        pdfs = build_path_pdfs([("Ruta recomendada", str(p), pdf_courses(r))
+                                for p, r in zip(profiles, routes)])
+
+    Desde la consola: python pdf_utils.py catalogo.xlsx perfiles.jsonl --out pdfs/
+    """
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+    if workers <= 1:
+        return [_build_job(j) for j in jobs]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_warm_worker) as ex:
+        return list(ex.map(_build_job, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+
+
+if __name__ == "__main__":
+    import json
+    import argparse
+    from config import INDEX_CACHE_DIR
+    from rag_build import load_or_build_index
+    from reco_service import RecommendationService, _as_state
+
+    ap = argparse.ArgumentParser(description="Exporta la ruta en PDF de cada perfil de una cohorte")
+    ap.add_argument("xlsx")
+    ap.add_argument("profiles", help="JSONL: un perfil (campos de ProfileState) por línea; "
+                                     "'id' opcional para el nombre del archivo")
+    ap.add_argument("--out", default="pdfs")
+    ap.add_argument("--workers", type=int, default=None)
+    args = ap.parse_args()
+
+    with open(args.profiles, "r", encoding="utf-8") as fh:
+        records = [json.loads(line) for line in fh if line.strip()]
+    rag_index = load_or_build_index(args.xlsx, INDEX_CACHE_DIR)
+    if rag_index is None:
+        raise SystemExit("El catálogo no tiene filas.")
+    states = [_as_state({k: v for k, v in r.items() if k != "id"}) for r in records]
+    routes = RecommendationService(rag_index).recommend_many(states)
+    jobs = [("Ruta recomendada",
+             " | ".join(f"{k}: {v}" for k, v in s.model_dump().items() if v not in ("", None, [])),
+             pdf_courses(r)) for s, r in zip(states, routes)]
+    os.makedirs(args.out, exist_ok=True)
+    for i, (r, pdf) in enumerate(zip(records, build_path_pdfs(jobs, args.workers))):
+        with open(os.path.join(args.out, f"{r.get('id', i)}.pdf"), "wb") as fh:
+            fh.write(pdf)
+    print(f"{len(jobs)} PDFs en {args.out}")
@@ -6,22 +6,38 @@ Created on Mon Nov  3 16:03:16 2025
 """
 
 from __future__ import annotations
+import io
+import os
 import re
+import sys
+import json
+import time
+import shutil
+import bisect
+import hashlib
 import numpy as np
 import pandas as pd
-from typing import List, Dict, Any, Tuple
-from rank_bm25 import BM25Okapi
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from itertools import repeat
+from scipy import sparse
+from typing import List, Dict, Any, Tuple, Callable
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from config import (INGEST_WORKERS, INDEX_BUILD_WORKERS, INDEX_COMPACT, INDEX_HASH_BITS,
+                    DENSE_DIM, FUSION_STRATEGY, RRF_K)
+from bm25_sparse import SparseBM25, count_matrix
+from tfidf_sparse import SparseTfidf, remap_keys
+from text_analyzer import Analyzer
+from filter_index import FilterIndex
+from dense_index import DenseIndex
+from caching import LRUTTLCache
+from tracing import span, traced
 
 
 # -----------------------------
 # Limpieza / Normalización
 # -----------------------------
 def _norm_cols(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    df.columns = [re.sub(r"\s+", " ", c).strip() for c in df.columns]
-    return df
+    # set_axis no copia los datos (copy-on-write): solo renombra
+    return df.set_axis([re.sub(r"\s+", " ", str(c)).strip() for c in df.columns], axis=1)
 
 
 def _safe(s) -> str:
@@ -39,6 +55,14 @@ def parse_hours(x) -> float:
     return val if "min" not in s else round(val/60.0, 2)
 
 
+def parse_hours_series(s: pd.Series) -> pd.Series:
+    """parse_hours vectorizado: una pasada de str.extract sobre toda la columna."""
+    txt = s.astype(str).str.lower().where(s.notna())
+    val = txt.str.extract(r"(\d+(?:\.\d+)?)", expand=False).astype(np.float64)
+    mins = txt.str.contains("min", regex=False).fillna(False).astype(bool)
+    return val.where(~mins, (val / 60.0).round(2))
+
+
 # -----------------------------
 # Carga del catálogo
 # -----------------------------
@@ -60,11 +84,46 @@ KEY_COLS = [
 ]
 
 
-def load_catalog(xls_file) -> pd.DataFrame:
-    xl = pd.ExcelFile(xls_file)
+# Libros más pequeños se leen en un solo proceso (arrancar el pool cuesta más)
+_MIN_PARALLEL_BYTES = 1 << 20
+
+
+def _read_sheet(src, sheet: str) -> pd.DataFrame:
+    # Nivel de módulo para poder enviarse a procesos hijos
+    if isinstance(src, (bytes, bytearray)):
+        src = io.BytesIO(src)
+    return pd.read_excel(src, sheet_name=sheet)
+
+
+def _read_sheets(xls_file, workers: int) -> List[Tuple[str, pd.DataFrame]]:
+    """
+    Lee todas las hojas. Con varias hojas y workers > 1 se reparten entre
+    procesos (openpyxl es puro Python y no libera el GIL); cada proceso abre
+    el libro en modo solo lectura y parsea únicamente su hoja.
+    """
+    if isinstance(xls_file, (str, os.PathLike)):
+        src = os.fspath(xls_file)
+    elif isinstance(xls_file, (bytes, bytearray)):
+        src = bytes(xls_file)
+    elif hasattr(xls_file, "getvalue"):
+        src = xls_file.getvalue()
+    else:
+        src = xls_file.read()
+    xl = pd.ExcelFile(io.BytesIO(src) if isinstance(src, bytes) else src)
+    names = xl.sheet_names
+    workers = min(workers, len(names), os.cpu_count() or 1)
+    size = len(src) if isinstance(src, bytes) else os.path.getsize(src)
+    if workers <= 1 or size < _MIN_PARALLEL_BYTES:
+        return [(n, pd.read_excel(xl, sheet_name=n)) for n in names]
+    xl.close()
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return list(zip(names, ex.map(_read_sheet, [src] * len(names), names)))
+
+
+@traced("catalog.load_excel")
+def load_catalog(xls_file, workers: int = INGEST_WORKERS) -> pd.DataFrame:
     frames = []
-    for sheet in xl.sheet_names:
-        df = pd.read_excel(xl, sheet_name=sheet)
+    for sheet, df in _read_sheets(xls_file, workers):
         df = _norm_cols(df)
         if df.empty:
             continue
@@ -72,81 +131,1115 @@ def load_catalog(xls_file) -> pd.DataFrame:
             if c not in df.columns:
                 df[c] = np.nan
         df["_sheet"] = sheet
-        df["_horas"] = df["Duración del Curso"].apply(parse_hours)
+        df["_horas"] = parse_hours_series(df["Duración del Curso"])
         frames.append(df)
     if not frames:
         return pd.DataFrame()
     out = pd.concat(frames, ignore_index=True)
+    out["_id"] = course_ids(out)
     return out
 
 
+def _arrow_safe(df: pd.DataFrame) -> pd.DataFrame:
+    # Columnas object con tipos mezclados (p. ej. duración 40 / "2 horas") a str:
+    # todo el pipeline las lee con str()/_safe(), así que no cambia nada aguas abajo
+    fixed = {}
+    for c in df.columns[df.dtypes == object]:
+        s = df[c]
+        kinds = {type(v) for v in s.dropna()}
+        if len(kinds) > 1 or (kinds and kinds != {str}):
+            fixed[c] = s.map(str, na_action="ignore")
+    return df.assign(**fixed) if fixed else df
+
+
+CATALOG_CACHE_SUFFIX = ".catalog.parquet"
+
+
+def load_catalog_cached(xls_file, cache_dir: str, fingerprint: str | None = None) -> pd.DataFrame:
+    """
+    load_catalog con caché columnar: el catálogo normalizado se guarda en
+    Parquet por hash del Excel y las cargas siguientes no parsean el libro.
+    Sin pyarrow se comporta como load_catalog. Con el snapshot del índice
+    en disco es solo un respaldo: evita parsear el Excel cuando falta el
+    snapshot del modo pedido (compacto / hashing / denso) pero existe el de
+    otro. publish_index borra las cachés cuyo snapshot ya no existe.
+    """
+    fp = fingerprint or catalog_fingerprint(xls_file)
+    path = os.path.join(cache_dir, f"{fp}{CATALOG_CACHE_SUFFIX}")
+    try:
+        with span("catalog.load_parquet"):
+            return pd.read_parquet(path)
+    except (FileNotFoundError, ImportError):
+        pass
+    if hasattr(xls_file, "seek"):
+        xls_file.seek(0)
+    df = load_catalog(xls_file)
+    if df.empty:
+        return df
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{path}.tmp{os.getpid()}"
+        _arrow_safe(df).to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+    except ImportError:
+        pass
+    return df
+
+
+def course_ids(df: pd.DataFrame) -> pd.Series:
+    """
+    Id estable por curso: hash de hoja + nombre + URL. Repetidos dentro del
+    mismo catálogo se desambiguan con sufijo -2, -3, ...
+    """
+    keys = [f"{_safe(s)}|{_safe(c)}|{_safe(u)}" for s, c, u in
+            zip(df["_sheet"], df["Curso"], df["URL del Curso"])]
+    h = pd.Series([hashlib.sha1(k.encode("utf-8")).hexdigest()[:12] for k in keys],
+                  index=df.index)
+    dup = h.groupby(h).cumcount()
+    return h.where(dup == 0, h + "-" + (dup + 1).astype(str))
+
+
+def prepare_rows(rows: pd.DataFrame, sheet: str = "") -> pd.DataFrame:
+    """Normaliza filas sueltas (p. ej. de un Excel de cambios) al esquema de load_catalog."""
+    df = _norm_cols(rows)
+    for c in KEY_COLS:
+        if c not in df.columns:
+            df[c] = np.nan
+    if "_sheet" not in df.columns:
+        df["_sheet"] = sheet
+    if "_horas" not in df.columns:
+        df["_horas"] = parse_hours_series(df["Duración del Curso"])
+    if "_id" not in df.columns:
+        df["_id"] = course_ids(df)
+    return df.reset_index(drop=True)
+
+
+def catalog_fingerprint(xls_file) -> str:
+    """Hash de contenido (sha256) del Excel: ruta, bytes o archivo subido."""
+    h = hashlib.sha256()
+    if isinstance(xls_file, (str, os.PathLike)):
+        with open(xls_file, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                h.update(chunk)
+    elif isinstance(xls_file, (bytes, bytearray, memoryview)):
+        h.update(xls_file)
+    elif hasattr(xls_file, "getvalue"):
+        h.update(xls_file.getvalue())
+    else:
+        pos = xls_file.tell()
+        h.update(xls_file.read())
+        xls_file.seek(pos)
+    return h.hexdigest()
+
+
+# Hash ya calculado por identidad barata del origen: un rerun no vuelve a leer
+# ni a hashear el Excel
+_FINGERPRINTS = LRUTTLCache(maxsize=32)
+
+
+def source_fingerprint(xls_file) -> str:
+    """
+    catalog_fingerprint memoizado: rutas por (ruta, tamaño, mtime) y archivos
+    subidos por su file_id (Streamlit asigna uno nuevo a cada subida).
+    """
+    if isinstance(xls_file, (str, os.PathLike)):
+        info = os.stat(xls_file)
+        key = ("path", os.fspath(xls_file), info.st_size, info.st_mtime_ns)
+    elif getattr(xls_file, "file_id", None):
+        key = ("upload", xls_file.file_id, getattr(xls_file, "size", None))
+    else:
+        return catalog_fingerprint(xls_file)
+    fp = _FINGERPRINTS.get(key)
+    return fp if fp is not None else _FINGERPRINTS.put(key, catalog_fingerprint(xls_file))
+
+
 # -----------------------------
 # RAG híbrido (BM25 + TF-IDF)
 # -----------------------------
-def doc_text(row: pd.Series) -> str:
-    return " | ".join([
-        _safe(row.get("Curso")),
-        _safe(row.get("Descripción del Curso")),
-        _safe(row.get("Competencia que se fomenta con el curso")),
-        _safe(row.get("Habilidad")),
-        _safe(row.get("Palabras Clave")),
-        _safe(row.get("Grupo de Competencias")),
-        _safe(row.get("Población objetivo")),
-        _safe(row.get("_sheet")),
-        _safe(row.get("Portal o Aliado")),
-    ])
-
-
-def tokenize(s: str) -> List[str]:
-    s = (s or "").lower()
-    parts = re.split(r"[^a-záéíóúñ0-9]+", s, flags=re.IGNORECASE)
-    return [p for p in parts if p]
+# Columnas que forman el texto indexado de cada curso (en este orden)
+DOC_FIELDS = [
+    "Curso",
+    "Descripción del Curso",
+    "Competencia que se fomenta con el curso",
+    "Habilidad",
+    "Palabras Clave",
+    "Grupo de Competencias",
+    "Población objetivo",
+    "_sheet",
+    "Portal o Aliado",
+]
+
+
+def doc_texts(df: pd.DataFrame) -> List[str]:
+    """Texto indexado de cada fila, armado por columnas (sin iterrows)."""
+    cols = []
+    for c in DOC_FIELDS:
+        if c not in df.columns:
+            cols.append([""] * len(df))
+            continue
+        s = df[c].astype(object)
+        cols.append(s.where(s.notna(), "").map(str).tolist())
+    return list(map(" | ".join, zip(*cols)))
+
+
+# Corpus más chicos se analizan en un solo proceso (arrancar el pool cuesta más)
+_MIN_PARALLEL_DOCS = 20000
+
+
+def _count_chunk(texts: List[str], hash_bits: int, ngram_range: Tuple[int, int]):
+    """
+    Un bloque del ajuste: análisis + conteos BM25 y TF-IDF con vocabulario
+    local (nivel de módulo para poder enviarse a procesos hijos).
+    """
+    analyzer = Analyzer(hash_bits=hash_bits)
+    docs = analyzer.encode_many(texts, grow=True)
+    counts, keys = SparseTfidf(ngram_range=ngram_range, hash_bits=hash_bits).count_keys(docs)
+    terms = [] if hash_bits else list(analyzer.terms)
+    return terms, count_matrix(docs, analyzer.n_terms), counts, keys
+
+
+def _count_corpus(texts: List[str], analyzer: Analyzer, ngram_range: Tuple[int, int],
+                  workers: int):
+    """
+    Analiza y cuenta el corpus por bloques (en procesos si workers > 1) y
+    fusiona las estadísticas parciales: cada vocabulario local se traduce al
+    del `analyzer` en orden de bloque, así los ids (primera aparición) y las
+    matrices quedan iguales a las de un ajuste secuencial.
+    Retorna (conteos BM25, conteos TF-IDF, claves TF-IDF).
+    """
+    workers = min(workers, os.cpu_count() or 1)
+    if workers <= 1 or len(texts) < _MIN_PARALLEL_DOCS:
+        parts = [_count_chunk(texts, analyzer.hash_bits, ngram_range)]
+    else:
+        size = -(-len(texts) // (2 * workers))
+        chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            parts = list(ex.map(_count_chunk, chunks, repeat(analyzer.hash_bits),
+                                repeat(ngram_range)))
+
+    luts = [None] * len(parts)
+    if not analyzer.hash_bits:
+        terms = analyzer.terms
+        luts = [np.fromiter((terms.setdefault(t, len(terms)) for t in p[0]),
+                            dtype=np.int64, count=len(p[0])) for p in parts]
+    n_terms = analyzer.n_terms
+    tf = sparse.vstack([p[1] if lut is None else
+                        sparse.csr_matrix((p[1].data, lut[p[1].indices], p[1].indptr),
+                                          shape=(p[1].shape[0], n_terms))
+                        for p, lut in zip(parts, luts)], format="csr")
+    if analyzer.hash_bits:
+        return tf, sparse.vstack([p[2] for p in parts], format="csr"), np.zeros(0, dtype=np.int64)
+    # Claves globales ordenadas; cada bloque re-numera sus columnas
+    keys = [remap_keys(p[3], lut) for p, lut in zip(parts, luts)]
+    all_keys = np.unique(np.concatenate(keys))
+    counts = sparse.vstack([sparse.csr_matrix((p[2].data, np.searchsorted(all_keys, k)[p[2].indices],
+                                               p[2].indptr), shape=(p[2].shape[0], len(all_keys)))
+                            for p, k in zip(parts, keys)], format="csr")
+    return tf, counts, all_keys
+
+
+# Formato del snapshot en disco (subir si cambia la estructura de archivos)
+SNAPSHOT_VERSION = 7
+
+# Compactar cuando filas borradas + delta superan esta fracción del índice
+COMPACT_RATIO = 0.2
+
+
+def _write_vocab(path: str, terms: List[str]) -> None:
+    # Un término por línea: los tokens nunca contienen saltos de línea
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write("\n".join(terms))
+
+
+def _read_vocab(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8") as fh:
+        blob = fh.read()
+    return blob.split("\n") if blob else []
+
+
+def _save_engine(path: str, prefix: str, engine) -> Dict[str, Any]:
+    meta, arrays, terms = engine.to_arrays()
+    for name, arr in arrays.items():
+        np.save(os.path.join(path, f"{prefix}_{name}.npy"), arr)
+    _write_vocab(os.path.join(path, f"{prefix}_vocab.txt"), terms)
+    return {**meta, "arrays": sorted(arrays)}
+
+
+def _save_rows(path: str, df: pd.DataFrame) -> str:
+    # Arrow IPC sin comprimir: se abre con mmap y las columnas de texto y
+    # numéricas sin nulos quedan sobre las páginas del archivo (sin copia)
+    try:
+        import pyarrow as pa
+        table = pa.Table.from_pandas(_arrow_safe(df), preserve_index=False)
+        with pa.OSFile(os.path.join(path, "rows.arrow"), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        return "rows.arrow"
+    except ImportError:
+        df.to_pickle(os.path.join(path, "rows.pkl"))
+        return "rows.pkl"
+
+
+def _load_rows(path: str, name: str) -> pd.DataFrame:
+    if name == "rows.pkl":
+        return pd.read_pickle(os.path.join(path, name))
+    import pyarrow as pa
+    table = pa.ipc.open_file(pa.memory_map(os.path.join(path, name), "r")).read_all()
+    return table.to_pandas(split_blocks=True)
+
+
+def _load_engine(path: str, prefix: str, cls, meta: Dict[str, Any]):
+    # mmap: el SO pagina los arreglos bajo demanda, no hay copia al cargar
+    arrays = {name: np.load(os.path.join(path, f"{prefix}_{name}.npy"), mmap_mode="r")
+              for name in meta["arrays"]}
+    return cls.from_arrays(meta, arrays, _read_vocab(os.path.join(path, f"{prefix}_vocab.txt")))
+
+
+# Modo compacto: columnas de texto con a lo sumo esta fracción de valores
+# distintos pasan a categóricas
+CATEGORY_MAX_RATIO = 0.5
+
+
+def _categorize(df: pd.DataFrame) -> pd.DataFrame:
+    cols = {}
+    for c in df.columns:
+        s = df[c]
+        if c == "_id" or isinstance(s.dtype, pd.CategoricalDtype):
+            continue
+        if (s.dtype == object or pd.api.types.is_string_dtype(s)) and \
+                s.nunique() <= CATEGORY_MAX_RATIO * len(s):
+            cols[c] = s.astype("category")
+    return df.assign(**cols) if cols else df
+
+
+def _str_list_bytes(items) -> int:
+    # Lista de str o de listas de str (corpus / tokens)
+    if items is None:
+        return 0
+    total = sys.getsizeof(items)
+    for it in items:
+        total += sys.getsizeof(it)
+        if isinstance(it, list):
+            total += sum(sys.getsizeof(t) for t in it)
+    return total
+
+
+def _topk_rows(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k por fila de una matriz (consultas x docs): índices y puntajes
+    ordenados de mayor a menor (empates por índice de documento).
+    """
+    nq, n = scores.shape
+    k = max(min(k, n), 0)
+    if k == 0:
+        return np.zeros((nq, 0), dtype=np.int64), np.zeros((nq, 0))
+    if k < n:
+        idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.tile(np.arange(n), (nq, 1))
+    vals = np.take_along_axis(scores, idx, axis=1)
+    order = np.lexsort((idx, -vals), axis=-1)
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(vals, order, axis=1)
+
+
+# -----------------------------
+# Fusión de legs
+# -----------------------------
+# Cada estrategia convierte los puntajes top-k de un leg (consultas x k,
+# ordenados) en su aporte a la suma fusionada
+def _fusion_weighted_rank(scores: np.ndarray) -> np.ndarray:
+    # score/max(score) * 1/rank
+    top = np.maximum(scores.max(axis=1, initial=0.0), 1e-9)[:, None]
+    return scores / top / np.arange(1, scores.shape[1] + 1)
+
+
+def _fusion_rrf(scores: np.ndarray) -> np.ndarray:
+    # Reciprocal Rank Fusion: 1 / (k + rank), ignora la escala de los puntajes
+    return np.broadcast_to(1.0 / (RRF_K + np.arange(1, scores.shape[1] + 1)), scores.shape)
+
+
+def _fusion_combsum(scores: np.ndarray) -> np.ndarray:
+    # CombSUM con cada leg normalizado por su máximo
+    return scores / np.maximum(scores.max(axis=1, initial=0.0), 1e-9)[:, None]
+
+
+FUSION_STRATEGIES: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "weighted_rank": _fusion_weighted_rank,
+    "rrf": _fusion_rrf,
+    "combsum": _fusion_combsum,
+}
+
+
+def _fuse_rows(legs: List[Tuple[np.ndarray, np.ndarray]], topk: int, n_docs: int,
+               strategy: str = "weighted_rank"):
+    """
+    Fusión vectorizada para un lote de consultas. Cada leg (índices, puntajes;
+    consultas x k, índice -1 = relleno) aporta según `strategy` (ver
+    FUSION_STRATEGIES); la unión de los top-k se ordena por la suma (empates:
+    orden de inserción bm25 -> tfidf -> denso) y se corta en topk.
+    Retorna (fila_consulta, idx_doc, [aporte por leg]) aplanados y ordenados.
+    """
+    weigh = FUSION_STRATEGIES.get(strategy)
+    if weigh is None:
+        raise ValueError(f"Estrategia de fusión desconocida: {strategy!r} "
+                         f"(opciones: {', '.join(FUSION_STRATEGIES)})")
+    nq = legs[0][0].shape[0]
+    widths = [idx.shape[1] for idx, _ in legs]
+    width = sum(widths)
+    ids = np.hstack([idx for idx, _ in legs])
+    contrib = []
+    start = 0
+    for (idx, sc), k in zip(legs, widths):
+        c = np.zeros((nq, width))
+        c[:, start:start + k] = weigh(sc)
+        contrib.append(c.ravel())
+        start += k
+
+    rows = np.repeat(np.arange(nq), width)
+    col = np.tile(np.arange(width), nq)
+    valid = ids.ravel() >= 0
+    keys = rows[valid] * n_docs + ids.ravel()[valid]
+    uniq, first, inv = np.unique(keys, return_index=True, return_inverse=True)
+    sums = [np.bincount(inv, weights=c[valid], minlength=len(uniq)) for c in contrib]
+
+    q_rows = uniq // n_docs
+    order = np.lexsort((col[valid][first], -np.sum(sums, axis=0), q_rows))
+    q_rows = q_rows[order]
+    starts = np.searchsorted(q_rows, np.arange(nq))
+    keep = (np.arange(len(order)) - starts[q_rows]) < topk
+    order = order[keep]
+    return q_rows[keep], (uniq % n_docs)[order], [x[order] for x in sums]
+
+
+class _SegmentRows:
+    """
+    Filas base + segmentos delta sin concatenar, con acceso por posición
+    (`rows.iloc[i]`) como un DataFrame. Lo usan los Candidate mientras hay
+    cambios sin compactar.
+    """
+
+    def __init__(self, segments: List[pd.DataFrame]):
+        self._segments = segments
+        self._starts = np.cumsum([0] + [len(d) for d in segments[:-1]]).tolist()
+
+    @property
+    def iloc(self) -> "_SegmentRows":
+        return self
+
+    def __getitem__(self, i: int) -> pd.Series:
+        k = bisect.bisect_right(self._starts, i) - 1
+        return self._segments[k].iloc[i - self._starts[k]]
+
+    def __len__(self) -> int:
+        return self._starts[-1] + len(self._segments[-1])
+
+
+class Candidate:
+    """
+    Resultado de búsqueda: posición de la fila + aporte de cada leg (y, tras el
+    rerank, features y score). La fila de pandas (`row`) se arma recién al
+    pedirla, en la práctica solo para los resultados finales que se muestran.
+    Admite acceso tipo dict (c["row"], c.get("score")) como los candidatos
+    anteriores.
+    """
+    __slots__ = ("idx", "bm25_norm", "tfidf_norm", "dense_norm", "feats", "score", "_df", "_row")
+    FIELDS = ("idx", "row", "bm25_norm", "tfidf_norm", "dense_norm", "feats", "score")
+
+    def __init__(self, idx: int, df: pd.DataFrame | _SegmentRows, bm25_norm: float = 0.0,
+                 tfidf_norm: float = 0.0, dense_norm: float = 0.0):
+        self.idx = idx
+        self.bm25_norm = bm25_norm
+        self.tfidf_norm = tfidf_norm
+        self.dense_norm = dense_norm
+        self.feats: Dict[str, float] | None = None
+        self.score: float | None = None
+        self._df = df
+        self._row: pd.Series | None = None
+
+    @property
+    def row(self) -> pd.Series:
+        if self._row is None:
+            self._row = self._df.iloc[self.idx]
+        return self._row
+
+    def scored(self, feats: Dict[str, float], score: float) -> "Candidate":
+        """Copia con features y score (el original puede seguir en caché)."""
+        c = Candidate(self.idx, self._df, self.bm25_norm, self.tfidf_norm, self.dense_norm)
+        c.feats, c.score, c._row = feats, score, self._row
+        return c
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in self.FIELDS or key == "row":
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.FIELDS
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def keys(self):
+        return self.FIELDS
+
+    def __repr__(self) -> str:
+        return f"Candidate(idx={self.idx}, score={self.score})"
 
 
 class RAGIndex:
-    def __init__(self, df: pd.DataFrame):
-        self.df = df.copy()
-        self.corpus = [doc_text(r) for _, r in self.df.iterrows()]
-        # BM25
-        self._bm25_tokens = [tokenize(t) for t in self.corpus]
-        self.bm25 = BM25Okapi(self._bm25_tokens)
-        # TF-IDF
-        self.tfidf = TfidfVectorizer(min_df=1, ngram_range=(1, 2))
-        self.tfidf_mat = self.tfidf.fit_transform(self.corpus)
-
-    def _bm25_search(self, q: str, topk: int) -> Tuple[List[int], np.ndarray]:
-        qtok = tokenize(q)
-        scores = np.array(self.bm25.get_scores(qtok))
-        idx = np.argsort(-scores)[:topk]
-        return idx.tolist(), scores[idx]
-
-    def _tfidf_search(self, q: str, topk: int) -> Tuple[List[int], np.ndarray]:
-        qv = self.tfidf.transform([q])
-        sims = cosine_similarity(qv, self.tfidf_mat).ravel()
-        idx = np.argsort(-sims)[:topk]
-        return idx.tolist(), sims[idx]
-
-    def hybrid_search(self, q: str, topk: int = 80) -> List[Dict[str, Any]]:
-        idx_b, s_b = self._bm25_search(q, topk)
-        idx_t, s_t = self._tfidf_search(q, topk)
-        # fusión por rank y suma normalizada
-        items = {}
-        for rank, (i, sc) in enumerate(zip(idx_b, s_b), start=1):
-            items.setdefault(i, {"bm25": 0.0, "tfidf": 0.0})
-            items[i]["bm25"] = float(sc) / max(s_b.max(), 1e-9) * (1.0 / rank)
-        for rank, (i, sc) in enumerate(zip(idx_t, s_t), start=1):
-            items.setdefault(i, {"bm25": 0.0, "tfidf": 0.0})
-            items[i]["tfidf"] = float(sc) / max(s_t.max(), 1e-9) * (1.0 / rank)
-
-        fused = []
-        for i, scs in items.items():
-            row = self.df.iloc[i]
-            fused.append({
-                "idx": i,
-                "row": row,
-                "bm25_norm": scs["bm25"],
-                "tfidf_norm": scs["tfidf"],
-            })
-        fused.sort(key=lambda x: (
-            x["bm25_norm"] + x["tfidf_norm"]), reverse=True)
-        return fused[:topk]
+    """
+    Índice híbrido BM25 + TF-IDF sobre el catálogo.
+
+    Un solo Analyzer (text_analyzer) convierte cada documento y cada consulta
+    en ids de término una vez; BM25 y TF-IDF consumen esos ids.
+
+    `compact_mode`: pesos float32 (proyección LSA en float16), columnas de
+    metadatos repetitivas como categóricas y sin guardar el corpus después
+    del ajuste (las actualizaciones re-analizan desde las filas).
+    `hash_bits` > 0 cambia los vocabularios por hashing de 2**hash_bits
+    columnas: memoria constante a cambio de colisiones entre términos. Ver
+    `memory_footprint`.
+
+    `dense_dim` > 0 agrega un tercer leg semántico (LSA sobre tf-idf servido
+    por un índice IVF, ver dense_index.DenseIndex) que se fusiona con los dos
+    léxicos. Es opcional (DENSE_DIM = 0 por defecto): multiplica el tiempo de
+    construcción y suma la matriz de proyección a la memoria.
+    """
+
+    def __init__(self, df: pd.DataFrame, fingerprint: str = "",
+                 compact_mode: bool = False, hash_bits: int = 0, dense_dim: int = DENSE_DIM,
+                 workers: int = INDEX_BUILD_WORKERS):
+        self.fingerprint = fingerprint
+        self.compact_mode = compact_mode
+        self.hash_bits = hash_bits
+        self.dense_dim = dense_dim
+        # Copia superficial: el índice nunca modifica columnas en sitio
+        # (upsert agrega segmentos, compact crea un DataFrame nuevo)
+        df = df.copy(deep=False)
+        if "_id" not in df.columns:
+            df["_id"] = course_ids(df)
+        self.df = df
+        dtype = np.float32 if compact_mode else np.float64
+        self.corpus = doc_texts(self.df)
+        # Un solo análisis del corpus (ids de término) para ambos motores, por
+        # bloques en `workers` procesos
+        self.analyzer = Analyzer(hash_bits=hash_bits)
+        tf, counts, keys = _count_corpus(self.corpus, self.analyzer, (1, 2), workers)
+        self.bm25 = SparseBM25(dtype=dtype)
+        self.tfidf = SparseTfidf(ngram_range=(1, 2), min_df=1, dtype=dtype, hash_bits=hash_bits)
+
+        def tfidf_dense():
+            # Denso (LSA + IVF) sobre la matriz tf-idf
+            self.tfidf.fit_counts(counts, keys)
+            if not dense_dim:
+                return None
+            return DenseIndex.fit(self.tfidf.mat, dense_dim,
+                                  dtype=np.float16 if compact_mode else np.float32)
+
+        # BM25 en paralelo con TF-IDF -> LSA (numpy/scipy sueltan el GIL)
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            bm25 = ex.submit(self.bm25.fit_counts, tf)
+            dense = ex.submit(tfidf_dense)
+            bm25.result()
+            self.dense = dense.result()
+        if compact_mode:
+            self.corpus = None
+        self._init_rows()
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """
+        Filas por posición. Con cambios sin compactar, base + segmentos delta
+        se concatenan al pedirlo (una vez, hasta el próximo upsert).
+        """
+        if self._delta_rows:
+            self._df = pd.concat([self._df, *self._delta_rows], ignore_index=True)
+            self._delta_rows = []
+        return self._df
+
+    @df.setter
+    def df(self, value: pd.DataFrame) -> None:
+        self._df = value
+        self._delta_rows: List[pd.DataFrame] = []
+
+    @property
+    def n_rows(self) -> int:
+        return len(self._df) + sum(len(d) for d in self._delta_rows)
+
+    def _rows(self) -> pd.DataFrame | _SegmentRows:
+        # Acceso por posición sin concatenar el segmento delta
+        return _SegmentRows([self._df, *self._delta_rows]) if self._delta_rows else self._df
+
+    def _take(self, positions: List[int]) -> pd.DataFrame:
+        rows = self._rows()
+        if isinstance(rows, pd.DataFrame):
+            return rows.iloc[positions]
+        return pd.DataFrame([rows.iloc[i] for i in positions])
+
+    def _init_rows(self) -> None:
+        if self.compact_mode:
+            self.df = _categorize(self.df)
+        # Filtros de metadatos + estado de filas (vivas / posición por id)
+        self.filters = FilterIndex(self.df)
+        self._alive = np.ones(len(self.df), dtype=bool)
+        self._n_dead = 0
+        self._pos = dict(zip(self.df["_id"], range(len(self.df))))
+
+    # -----------------------------
+    # Actualizaciones incrementales
+    # -----------------------------
+    def upsert(self, rows: pd.DataFrame) -> None:
+        """
+        Agrega o reemplaza cursos (por `_id`) sin re-ajustar: analiza solo las
+        filas nuevas, actualiza df/idf/avgdl y el vocabulario de ambos motores y
+        las agrega al segmento delta (filas y filtros incluidos: el costo
+        depende de las filas nuevas, no del catálogo). La versión anterior de
+        un id queda como fila muerta hasta la próxima compactación.
+        """
+        rows = prepare_rows(rows)
+        if rows.empty:
+            return
+        rows = rows.drop_duplicates("_id", keep="last").reset_index(drop=True)
+        ids = rows["_id"].tolist()
+        self._retire([self._pos[i] for i in ids if i in self._pos])
+
+        texts = doc_texts(rows)
+        docs = self.analyzer.encode_many(texts, grow=True)
+        self.bm25.add_docs(docs, self.analyzer.n_terms)
+        self.tfidf.add_docs(docs)
+        if self.dense is not None:
+            self.dense.add(self.dense.project(self.tfidf.transform(docs)))
+        if self.corpus is not None:
+            self.corpus.extend(texts)
+
+        start = self.n_rows
+        # Mismas columnas que la base; índice = posición global (como tras concatenar)
+        base_cols = list(self._df.columns)
+        rows = rows.reindex(columns=base_cols + [c for c in rows.columns if c not in base_cols])
+        rows.index = pd.RangeIndex(start, start + len(rows))
+        self._delta_rows.append(rows)
+        self.filters.append(rows)
+        self._alive = np.concatenate([self._alive, np.ones(len(rows), dtype=bool)])
+        self._pos.update(zip(ids, range(start, start + len(rows))))
+        self._touch("upsert", ids, rows)
+        self._maybe_compact()
+
+    def delete(self, ids: List[str]) -> None:
+        """Da de baja cursos por `_id` (los desconocidos se ignoran)."""
+        gone = [i for i in dict.fromkeys(ids) if i in self._pos]
+        self._retire([self._pos.pop(i) for i in gone])
+        if gone:
+            self._touch("delete", gone)
+            self._maybe_compact()
+
+    def _retire(self, positions: List[int]) -> None:
+        if not positions:
+            return
+        # Se re-analiza el texto de la fila: mismo resultado que al indexarla
+        docs = self.analyzer.encode_many(doc_texts(self._take(positions)))
+        self.bm25.remove_docs(docs)
+        self.tfidf.remove_docs(docs)
+        self._alive[positions] = False
+        self._n_dead += len(positions)
+
+    def _touch(self, op: str, ids: List[str], rows: pd.DataFrame | None = None) -> None:
+        # Nuevo fingerprint: las cachés por índice (features, resultados) se invalidan
+        h = hashlib.sha256(f"{self.fingerprint}|{op}|".encode("utf-8"))
+        h.update("\n".join(ids).encode("utf-8"))
+        if rows is not None:
+            h.update(pd.util.hash_pandas_object(rows.astype(str), index=False).values.tobytes())
+        self.fingerprint = h.hexdigest()
+
+    def _maybe_compact(self) -> None:
+        pending = self._n_dead + len(self.bm25._delta)
+        if pending > COMPACT_RATIO * max(self.bm25.n_docs, 1):
+            self.compact()
+
+    @property
+    def pending_changes(self) -> int:
+        return self._n_dead + len(self.bm25._delta)
+
+    def compact(self) -> None:
+        """
+        Integra el segmento delta y descarta filas muertas: re-pondera ambos
+        motores desde los conteos guardados (sin tokenizar ni re-ajustar),
+        concatena y renumera las filas y reconstruye los filtros, por lo que
+        cambia el fingerprint.
+        """
+        if not self.pending_changes:
+            return
+        keep = np.flatnonzero(self._alive)
+        self.bm25.compact(keep)
+        new_col = self.tfidf.compact(keep)
+        # Sin re-ajustar el SVD ni el IVF: se renumeran las columnas de la
+        # proyección y se descartan los vectores muertos (re-ajuste = nuevo build)
+        if self.dense is not None:
+            if new_col is not None:
+                self.dense.remap_columns(new_col)
+            self.dense.keep(keep)
+        self.df = self.df.iloc[keep].reset_index(drop=True)
+        if self.corpus is not None:
+            self.corpus = [self.corpus[i] for i in keep]
+        self._init_rows()
+        self.fingerprint = hashlib.sha256(
+            f"{self.fingerprint}|compact".encode("utf-8")).hexdigest()
+
+    @traced("search.filters")
+    def _eligible(self, filters: Dict[str, Any] | None) -> np.ndarray | None:
+        docs = self.filters.eligible(**filters) if filters else None
+        if self._n_dead:
+            docs = np.flatnonzero(self._alive) if docs is None else docs[self._alive[docs]]
+        return docs
+
+    # -----------------------------
+    # Snapshot en disco
+    # -----------------------------
+    def save(self, path: str) -> None:
+        """
+        Guarda vocabularios, matrices dispersas (pesos + conteos), estadísticas
+        de ambos motores y metadatos de filas en el directorio `path`. Compacta
+        antes si hay cambios pendientes. Se escribe en un temporal y se renombra
+        al final para que un lector nunca vea un snapshot a medias.
+        """
+        self.compact()
+        tmp = path.rstrip("/\\") + f".tmp{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        meta = {
+            "version": SNAPSHOT_VERSION,
+            "fingerprint": self.fingerprint,
+            "n_docs": int(len(self.df)),
+            "analyzer": _save_engine(tmp, "analyzer", self.analyzer),
+            "tfidf": _save_engine(tmp, "tfidf", self.tfidf),
+            "bm25": _save_engine(tmp, "bm25", self.bm25),
+            "dense": _save_engine(tmp, "dense", self.dense) if self.dense is not None else None,
+            "dense_dim": self.dense_dim,
+            "compact_mode": self.compact_mode,
+            "hash_bits": self.hash_bits,
+            # Metadatos de filas (incluye _sheet/_horas/_id)
+            "rows": _save_rows(tmp, self.df),
+        }
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as fh:
+            json.dump(meta, fh)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "RAGIndex":
+        """
+        Carga un snapshot creado con `save` sin re-ajustar BM25 ni TF-IDF.
+        Matrices, estadísticas y filas quedan mapeadas en solo lectura: varios
+        procesos que cargan el mismo snapshot comparten las páginas del SO.
+        Lanza FileNotFoundError si no existe y ValueError si es de otra versión.
+        """
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as fh:
+            meta = json.load(fh)
+        if meta.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(
+                f"Snapshot versión {meta.get('version')} != {SNAPSHOT_VERSION}")
+
+        self = cls.__new__(cls)
+        self.fingerprint = meta["fingerprint"]
+        self.compact_mode = meta.get("compact_mode", False)
+        self.hash_bits = meta.get("hash_bits", 0)
+        self.dense_dim = meta.get("dense_dim", 0)
+        self.df = _load_rows(path, meta["rows"])
+        # El texto del corpus no se persiste: no se usa al buscar
+        self.corpus = None
+        self.analyzer = _load_engine(path, "analyzer", Analyzer, meta["analyzer"])
+        self.tfidf = _load_engine(path, "tfidf", SparseTfidf, meta["tfidf"])
+        self.bm25 = _load_engine(path, "bm25", SparseBM25, meta["bm25"])
+        self.dense = _load_engine(path, "dense", DenseIndex, meta["dense"]) if meta.get("dense") else None
+        self._init_rows()
+        return self
+
+    def memory_footprint(self) -> Dict[str, int]:
+        """
+        Bytes aproximados por componente: filas (pandas, profundo), corpus en
+        memoria, vocabulario del analizador y arreglos de cada motor. Los
+        arreglos de un snapshot cargado cuentan aunque vivan en páginas mapeadas.
+        """
+        out = {
+            "rows": int(sum(d.memory_usage(deep=True).sum() for d in [self._df, *self._delta_rows])),
+            "corpus": _str_list_bytes(self.corpus),
+            "vocab": self.analyzer.memory_bytes(),
+            "bm25_arrays": self.bm25.memory_bytes()["arrays"],
+            "tfidf_arrays": self.tfidf.memory_bytes()["arrays"],
+            "dense": self.dense.memory_bytes() if self.dense is not None else 0,
+        }
+        out["total"] = sum(out.values())
+        return out
+
+    @traced("search.bm25")
+    def _bm25_scores_many(self, encoded: List[np.ndarray],
+                          docs: np.ndarray | None = None) -> np.ndarray:
+        return self.bm25.get_scores_many(encoded, docs)
+
+    @traced("search.tfidf")
+    def _tfidf_scores_many(self, encoded: List[np.ndarray], docs: np.ndarray | None = None,
+                           qv=None) -> np.ndarray:
+        # `qv`: vectores ya calculados (se reutilizan para el leg denso)
+        return self.tfidf.scores_vectors(self.tfidf.transform(encoded) if qv is None else qv, docs)
+
+    @traced("search.dense")
+    def _dense_topk_many(self, qv, topk: int, docs: np.ndarray | None = None):
+        # Mismos vectores tf-idf de la consulta, proyectados al espacio LSA
+        return self.dense.search(self.dense.project(qv), topk, docs)
+
+    def hybrid_search(self, q: str, topk: int = 80, filters: Dict[str, Any] | None = None,
+                      fusion: str = FUSION_STRATEGY) -> List[Candidate]:
+        return self.hybrid_search_many([q], topk=topk, filters=filters, fusion=fusion)[0]
+
+    def hybrid_search_many(self, queries: List[str], topk: int = 80, chunk_size: int = 256,
+                           filters: Dict[str, Any] | None = None,
+                           fusion: str = FUSION_STRATEGY) -> List[List[Candidate]]:
+        """
+        Versión por lotes de `hybrid_search`: puntúa cada bloque de consultas con
+        productos matriz-matriz dispersos y fusiona vectorizado. La memoria queda
+        acotada a ~2 * chunk_size * n_docs floats. Con leg denso, su top-k (IVF)
+        entra a la misma fusión.
+
+        `filters` (area, level, access, population, max_hours) se resuelve con el
+        FilterIndex antes de puntuar: solo compiten los documentos elegibles, así
+        el top-k sale completo con resultados válidos. Las filas dadas de baja
+        nunca son elegibles.
+
+        `fusion`: estrategia de FUSION_STRATEGIES (weighted_rank, rrf, combsum).
+        Los resultados son Candidate livianos; la fila de pandas se arma solo
+        al leer `row`.
+        """
+        docs = self._eligible(filters)
+        n_docs = self.n_rows if docs is None else len(docs)
+        if n_docs == 0:
+            return [[] for _ in queries]
+        out: List[List[Candidate]] = []
+        for start in range(0, len(queries), max(chunk_size, 1)):
+            # Cada consulta se analiza una vez (con caché) para los tres legs
+            encoded = [self.analyzer.query(q) for q in queries[start:start + chunk_size]]
+            qv = self.tfidf.transform(encoded)
+            s_bm25 = self._bm25_scores_many(encoded, docs)
+            s_tfidf = self._tfidf_scores_many(encoded, docs, qv)
+            out.extend(self._fuse_candidates(s_bm25, s_tfidf, qv, topk, docs, fusion))
+        return out
+
+    def hybrid_search_session(self, scorer: "SessionScorer", q: str, topk: int = 80,
+                              filters: Dict[str, Any] | None = None,
+                              fusion: str = FUSION_STRATEGY) -> List[Candidate]:
+        """
+        `hybrid_search` para una conversación: BM25 y tf-idf salen del
+        SessionScorer, que solo suma/resta los términos que cambiaron desde el
+        turno anterior. Mismos resultados que `hybrid_search(q)`.
+        """
+        docs = self._eligible(filters)
+        if docs is not None and len(docs) == 0:
+            return []
+        s_bm25, s_tfidf = scorer.update(self, q)
+        if docs is not None:
+            s_bm25, s_tfidf = s_bm25[docs], s_tfidf[docs]
+        qv = self.tfidf.transform([self.analyzer.query(q)]) if self.dense is not None else None
+        return self._fuse_candidates(s_bm25[None, :], s_tfidf[None, :], qv, topk, docs, fusion)[0]
+
+    def _fuse_candidates(self, s_bm25: np.ndarray, s_tfidf: np.ndarray, qv, topk: int,
+                         docs: np.ndarray | None, fusion: str) -> List[List[Candidate]]:
+        """Top-k por leg (+ leg denso) -> fusión -> Candidate, para un bloque de consultas."""
+        n_docs = s_bm25.shape[1]
+        dense = self._dense_topk_many(qv, topk, docs) if self.dense is not None else None
+        out: List[List[Candidate]] = []
+        df = self._rows()
+        with span("search.fusion"):
+            legs = [_topk_rows(s_bm25, topk), _topk_rows(s_tfidf, topk)]
+            if dense is not None:
+                legs.append(dense)
+            rows, ids, contrib = _fuse_rows(legs, topk, n_docs, fusion)
+            if docs is not None:
+                ids = docs[ids]
+            if dense is None:
+                contrib.append(np.zeros(len(ids)))
+            ids, bm, tf, dn = ids.tolist(), *(c.tolist() for c in contrib)
+            bounds = np.searchsorted(rows, np.arange(len(s_bm25) + 1)).tolist()
+            for a, z in zip(bounds[:-1], bounds[1:]):
+                out.append([Candidate(ids[j], df, bm[j], tf[j], dn[j]) for j in range(a, z)])
+        return out
+
+
+def _count_delta(old: Dict[int, int], new: Dict[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """Términos cuyo conteo cambió entre dos consultas y la diferencia (nuevo - viejo)."""
+    diff = {j: c - old.get(j, 0) for j, c in new.items() if c != old.get(j, 0)}
+    diff.update({j: -c for j, c in old.items() if j not in new})
+    ids = np.fromiter(diff.keys(), dtype=np.int64, count=len(diff))
+    return ids, np.fromiter(diff.values(), dtype=np.float64, count=len(diff))
+
+
+class SessionScorer:
+    """
+    Puntajes BM25 y tf-idf de la última consulta de una sesión de chat, para
+    re-puntuar por diferencia: entre turnos solo se suman (o restan) las
+    columnas de los términos agregados o quitados, así el costo depende del
+    tamaño del cambio y no del largo de la consulta.
+
+    BM25 es lineal en los conteos de la consulta. Para tf-idf se guarda el
+    producto sin normalizar M @ (idf * conteos) y la norma de la consulta se
+    recalcula de los conteos (barato): coseno = producto / norma.
+
+    Se re-puntúa desde cero si cambia el índice (otro objeto o un upsert que
+    mueve el fingerprint, porque cambian idf y filas) o si el cambio es más
+    grande que la consulta nueva. Un scorer por sesión; no es thread-safe.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self._index: RAGIndex | None = None
+        self._fingerprint = ""
+        self._bm25_counts: Dict[int, int] = {}
+        self._tfidf_counts: Dict[int, int] = {}
+        self._bm25 = np.zeros(0)
+        self._tfidf_dot = np.zeros(0)
+        self.last_delta = 0          # términos re-puntuados en el último turno
+
+    @traced("search.incremental")
+    def update(self, index: RAGIndex, q: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(bm25, coseno tf-idf) de `q` para todos los documentos del índice."""
+        encoded = index.analyzer.query(q)
+        bm25_counts = index.bm25.term_counts(encoded)
+        tfidf_counts = index.tfidf.term_counts(encoded)
+        if (index is not self._index or index.fingerprint != self._fingerprint
+                or len(self._bm25) != index.bm25.corpus_size):
+            self.reset()
+            self._index, self._fingerprint = index, index.fingerprint
+        bm_ids, bm_diff = _count_delta(self._bm25_counts, bm25_counts)
+        tf_ids, tf_diff = _count_delta(self._tfidf_counts, tfidf_counts)
+        if len(bm_ids) + len(tf_ids) >= len(bm25_counts) + len(tfidf_counts) or not len(self._bm25):
+            # Desde cero: el cambio no es menor que la consulta
+            bm_ids, bm_diff = _count_delta({}, bm25_counts)
+            tf_ids, tf_diff = _count_delta({}, tfidf_counts)
+            self._bm25 = np.zeros(index.bm25.corpus_size)
+            self._tfidf_dot = np.zeros(index.bm25.corpus_size)
+        if len(bm_ids):
+            self._bm25 += index.bm25.columns_dot(bm_ids, index.bm25.idf[bm_ids] * bm_diff)
+        if len(tf_ids):
+            self._tfidf_dot += index.tfidf.columns_dot(tf_ids, index.tfidf.idf[tf_ids] * tf_diff)
+        self._bm25_counts, self._tfidf_counts = bm25_counts, tfidf_counts
+        self.last_delta = len(bm_ids) + len(tf_ids)
+
+        ids = np.fromiter(tfidf_counts.keys(), dtype=np.int64, count=len(tfidf_counts))
+        qc = np.fromiter(tfidf_counts.values(), dtype=np.float64, count=len(tfidf_counts))
+        norm = float(np.linalg.norm(index.tfidf.idf[ids] * qc))
+        tfidf = self._tfidf_dot / norm if norm > 0 else np.zeros_like(self._tfidf_dot)
+        return self._bm25.copy(), tfidf
+
+
+def snapshot_path(cache_dir: str, fingerprint: str) -> str:
+    return os.path.join(cache_dir, f"{fingerprint}.v{SNAPSHOT_VERSION}")
+
+
+# -----------------------------
+# Versión publicada (compartida entre procesos)
+# -----------------------------
+CURRENT_FILE = "CURRENT"
+# Snapshots publicados alguna vez (uno por línea, el más reciente al final)
+PUBLISHED_FILE = "PUBLISHED"
+
+
+def publish_index(index: RAGIndex, cache_dir: str, keep: int = 3) -> str:
+    """
+    Guarda el snapshot del índice (si aún no existe) y lo marca como versión
+    vigente en `cache_dir/CURRENT` con un reemplazo atómico. Los procesos con
+    un SharedIndex lo adoptan en su próxima revisión. De los snapshots
+    publicados (registro PUBLISHED) conserva los `keep` más recientes; los
+    que solo se construyeron (cargas de usuarios, precalentamiento) no se
+    tocan. Con ellos se van las cachés Parquet del catálogo sin snapshot.
+    En POSIX, borrar uno que otro proceso tiene mapeado es seguro (las
+    páginas viven hasta que lo suelta). Es una acción explícita: ver el CLI
+    de este módulo.
+    """
+    index.compact()
+    path = snapshot_path(cache_dir, index.fingerprint)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        os.makedirs(cache_dir, exist_ok=True)
+        index.save(path)
+    tmp = os.path.join(cache_dir, f"{CURRENT_FILE}.tmp{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(os.path.basename(path))
+    os.replace(tmp, os.path.join(cache_dir, CURRENT_FILE))
+
+    name = os.path.basename(path)
+    published = [n for n in _read_published(cache_dir) if n != name] + [name]
+    retired = published[:-max(keep, 1)]
+    for n in retired:
+        shutil.rmtree(os.path.join(cache_dir, n), ignore_errors=True)
+    _write_published(cache_dir, published[len(retired):])
+    _drop_catalog_caches(cache_dir)
+    return path
+
+
+def _drop_catalog_caches(cache_dir: str) -> None:
+    # Caché Parquet sin snapshot (retirado o de otra versión) ni construcción en curso
+    for d in os.listdir(cache_dir):
+        if not d.endswith(CATALOG_CACHE_SUFFIX):
+            continue
+        snap = snapshot_path(cache_dir, d[:-len(CATALOG_CACHE_SUFFIX)])
+        if not os.path.exists(snap) and not os.path.exists(snap + ".lock"):
+            try:
+                os.remove(os.path.join(cache_dir, d))
+            except FileNotFoundError:
+                pass
+
+
+def _read_published(cache_dir: str) -> List[str]:
+    try:
+        with open(os.path.join(cache_dir, PUBLISHED_FILE), "r", encoding="utf-8") as fh:
+            return [line.strip() for line in fh if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def _write_published(cache_dir: str, names: List[str]) -> None:
+    tmp = os.path.join(cache_dir, f"{PUBLISHED_FILE}.tmp{os.getpid()}")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write("".join(n + "\n" for n in names))
+    os.replace(tmp, os.path.join(cache_dir, PUBLISHED_FILE))
+
+
+def current_snapshot(cache_dir: str) -> str | None:
+    """Ruta del snapshot publicado en `cache_dir` (None si no hay)."""
+    try:
+        with open(os.path.join(cache_dir, CURRENT_FILE), "r", encoding="utf-8") as fh:
+            name = fh.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(cache_dir, name) if name else None
+
+
+class SharedIndex:
+    """
+    Índice publicado en `cache_dir`, adjunto en solo lectura (mmap). `get()`
+    revisa el puntero CURRENT a lo sumo cada `check_every` segundos y, si hay
+    otra versión, la carga y la cambia de forma atómica: quien ya tenía la
+    anterior termina su búsqueda con ella.
+    """
+
+    def __init__(self, cache_dir: str, check_every: float = 2.0):
+        self.cache_dir = cache_dir
+        self.check_every = check_every
+        self.path: str | None = None
+        self._index: RAGIndex | None = None
+        self._checked = float("-inf")
+
+    def get(self) -> RAGIndex | None:
+        now = time.monotonic()
+        if now - self._checked >= self.check_every:
+            self._checked = now
+            path = current_snapshot(self.cache_dir)
+            if path is not None and path != self.path:
+                try:
+                    index = RAGIndex.load(path)
+                except (FileNotFoundError, ValueError):
+                    return self._index
+                self._index, self.path = index, path
+        return self._index
+
+
+class _BuildLock:
+    """
+    Candado entre procesos (archivo creado con O_EXCL) para que un solo worker
+    construya el snapshot de un catálogo; los demás esperan y lo cargan. Un
+    candado más viejo que `stale_s` se considera abandonado.
+    """
+
+    def __init__(self, path: str, stale_s: float = 600.0, poll_s: float = 0.2):
+        self.path = path
+        self.stale_s = stale_s
+        self.poll_s = poll_s
+
+    def __enter__(self):
+        while True:
+            try:
+                os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return self
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) > self.stale_s:
+                        os.remove(self.path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(self.poll_s)
+
+    def __exit__(self, *exc):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        return False
+
+
+def _load_matching(path: str, compact_mode: bool, hash_bits: int) -> RAGIndex | None:
+    # Un snapshot de otro modo (compacto / hashing / leg denso) cuenta como ausente
+    try:
+        with span("index.load_snapshot"):
+            index = RAGIndex.load(path)
+    except (FileNotFoundError, ValueError):
+        return None
+    mode = (index.compact_mode, index.hash_bits, index.dense_dim)
+    return index if mode == (compact_mode, hash_bits, DENSE_DIM) else None
+
+
+def load_or_build_index(xls_file, cache_dir: str, compact_mode: bool = INDEX_COMPACT,
+                        hash_bits: int = INDEX_HASH_BITS,
+                        fingerprint: str | None = None) -> RAGIndex | None:
+    """
+    Devuelve el índice del catálogo: si hay snapshot para el hash del Excel lo
+    carga (milisegundos, mapeado en memoria); si no, parsea el Excel, ajusta
+    y guarda el snapshot. No lo publica como versión vigente (publish_index
+    es explícito: ver el CLI de este módulo). Con varios procesos,
+    solo uno construye y el resto carga su snapshot. Retorna None si el
+    catálogo no tiene filas. `fingerprint` evita re-hashear si ya se conoce.
+    """
+    fp = fingerprint or catalog_fingerprint(xls_file)
+    path = snapshot_path(cache_dir, fp)
+    index = _load_matching(path, compact_mode, hash_bits)
+    if index is not None:
+        return index
+    os.makedirs(cache_dir, exist_ok=True)
+    with _BuildLock(path + ".lock"):
+        # Otro proceso pudo terminarlo mientras esperábamos el candado
+        index = _load_matching(path, compact_mode, hash_bits)
+        if index is not None:
+            return index
+        catalog = load_catalog_cached(xls_file, cache_dir, fp)
+        if catalog.empty:
+            return None
+        with span("index.build"):
+            index = RAGIndex(catalog, fingerprint=fp, compact_mode=compact_mode,
+                             hash_bits=hash_bits)
+        with span("index.save"):
+            index.save(path)
+    return index
+
+
+if __name__ == "__main__":
+    import argparse
+    from config import INDEX_CACHE_DIR
+    # Desde el módulo importado (no __main__): los workers de construcción lo necesitan
+    from rag_build import load_or_build_index, publish_index
+
+    ap = argparse.ArgumentParser(
+        description="Construye (o carga) el índice de un catálogo y lo publica como versión vigente")
+    ap.add_argument("xlsx")
+    ap.add_argument("--cache-dir", default=INDEX_CACHE_DIR)
+    ap.add_argument("--keep", type=int, default=3, help="snapshots publicados que se conservan")
+    args = ap.parse_args()
+
+    rag_index = load_or_build_index(args.xlsx, args.cache_dir)
+    if rag_index is None:
+        raise SystemExit("El catálogo no tiene filas.")
+    print(f"Publicado: {publish_index(rag_index, args.cache_dir, keep=args.keep)}")
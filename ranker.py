@@ -10,6 +10,17 @@ from typing import Dict, Any, List
 import numpy as np
 import pandas as pd
 from config import RANK_WEIGHTS, MAX_KW
+from tracing import traced
+
+# Orden de las columnas de la matriz de features (modo vectorizado)
+FEATURES = [
+    "area_exact", "sheet_match", "level",
+    "duration_fit", "access", "population",
+    "kw_overlap", "sim_tfidf", "sim_bm25", "sim_dense"
+]
+
+# Máximo de máscaras por token que se guardan por catálogo
+_MAX_CACHED_TOKENS = 512
 
 
 def _safe(x): return "" if pd.isna(x) else str(x)
@@ -23,24 +34,23 @@ def kw_overlap(user_tokens: List[str], text: str) -> int:
     return min(hits, MAX_KW)
 
 
+BLOB_COLS = [
+    "Palabras Clave",
+    "Descripción del Curso",
+    "Curso",
+    "Competencia que se fomenta con el curso",
+    "Habilidad",
+]
+
+
 def build_text_blob(r: pd.Series) -> str:
-    return " | ".join([
-        _safe(r.get("Palabras Clave")),
-        _safe(r.get("Descripción del Curso")),
-        _safe(r.get("Curso")),
-        _safe(r.get("Competencia que se fomenta con el curso")),
-        _safe(r.get("Habilidad")),
-    ])
+    return " | ".join(_safe(r.get(c)) for c in BLOB_COLS)
 
 
 def featureize(candidate: Dict[str, Any], profile: Dict[str, Any], user_tokens: List[str]) -> Dict[str, float]:
     r = candidate["row"]
 
-    f = dict.fromkeys([
-        "area_exact", "sheet_match", "level",
-        "duration_fit", "access", "population",
-        "kw_overlap", "sim_tfidf", "sim_bm25"
-    ], 0.0)
+    f = dict.fromkeys(FEATURES, 0.0)
 
     # Área / hoja
     area = profile.get("area", "").lower().strip()
@@ -81,6 +91,7 @@ def featureize(candidate: Dict[str, Any], profile: Dict[str, Any], user_tokens:
     # Similitudes del retriever
     f["sim_tfidf"] = float(candidate.get("tfidf_norm", 0.0))
     f["sim_bm25"] = float(candidate.get("bm25_norm",  0.0))
+    f["sim_dense"] = float(candidate.get("dense_norm", 0.0))
 
     return f
 
@@ -89,7 +100,107 @@ def score_features(feats: Dict[str, float], weights: Dict[str, float]) -> float:
     return sum(feats[k]*weights.get(k, 0.0) for k in feats.keys())
 
 
-def rerank(candidates: List[Dict[str, Any]], profile: Dict[str, Any], user_tokens: List[str], weights=RANK_WEIGHTS):
+# -----------------------------
+# Modo columnar (vectorizado)
+# -----------------------------
+class _LowerColumn:
+    """Columna como códigos + valores únicos ya normalizados con _safe().lower()."""
+
+    def __init__(self, s: pd.Series, strip: bool):
+        codes, uniques = pd.factorize(s, use_na_sentinel=False)
+        self.codes = codes
+        self.values = [_safe(u).lower().strip() if strip else _safe(u).lower()
+                       for u in uniques]
+
+    def equals(self, value: str, idx: np.ndarray) -> np.ndarray:
+        ok = np.fromiter((v == value for v in self.values), dtype=bool, count=len(self.values))
+        return ok[self.codes[idx]]
+
+    def contains(self, value: str, idx: np.ndarray) -> np.ndarray:
+        ok = np.fromiter((value in v for v in self.values), dtype=bool, count=len(self.values))
+        return ok[self.codes[idx]]
+
+
+class FeatureTable:
+    """
+    Features por curso precalculadas una vez por catálogo: categóricas en
+    minúsculas como códigos, horas como float y el blob de texto para
+    kw_overlap. `matrix` arma todas las columnas de features para un conjunto
+    de candidatos como arreglos NumPy (mismas reglas que `featureize`).
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.area = _LowerColumn(df["Grupo de Competencias"], strip=True)
+        self.sheet = _LowerColumn(df["_sheet"], strip=True)
+        self.level = _LowerColumn(df["Nivel de complejidad"], strip=True)
+        self.access = _LowerColumn(df["Tipo de Acceso (REA o Redireccionamiento)"], strip=False)
+        self.population = _LowerColumn(df["Población objetivo"], strip=False)
+        self.hours = pd.to_numeric(df["_horas"], errors="coerce").to_numpy(dtype=np.float64)
+        # Mismo texto que build_text_blob, armado por columnas (sin iterrows)
+        cols = [[_safe(v) for v in df[c]] for c in BLOB_COLS]
+        self.blob = pd.Series([" | ".join(p).lower() for p in zip(*cols)], dtype=object)
+        self._token_masks: Dict[str, np.ndarray] = {}
+
+    def _token_mask(self, tok: str) -> np.ndarray:
+        # Máscara por token sobre todo el catálogo, reutilizable entre reruns
+        m = self._token_masks.get(tok)
+        if m is None:
+            if len(self._token_masks) >= _MAX_CACHED_TOKENS:
+                self._token_masks.clear()
+            m = self._token_masks[tok] = self.blob.str.contains(
+                tok, regex=False).to_numpy(dtype=bool)
+        return m
+
+    def matrix(self, idx: np.ndarray, profile: Dict[str, Any], user_tokens: List[str],
+               sim_tfidf: np.ndarray, sim_bm25: np.ndarray,
+               sim_dense: np.ndarray | None = None) -> np.ndarray:
+        F = np.zeros((len(idx), len(FEATURES)))
+
+        area = profile.get("area", "").lower().strip()
+        if area:
+            exact = self.area.equals(area, idx)
+            F[:, 0] = exact
+            F[:, 1] = ~exact & self.sheet.equals(area, idx)
+
+        level = profile.get("level", "").lower().strip()
+        if level:
+            F[:, 2] = self.level.equals(level, idx)
+
+        max_hours = profile.get("max_hours", None)
+        if max_hours is not None:
+            # NaN <= x es False: sin horas no suma
+            F[:, 3] = self.hours[idx] <= float(max_hours)
+
+        access = profile.get("access", "").lower().strip()
+        if access:
+            F[:, 4] = self.access.contains(access, idx)
+
+        pop = profile.get("population", "").lower().strip()
+        if pop:
+            F[:, 5] = self.population.contains(pop, idx)
+
+        if user_tokens:
+            hits = np.zeros(len(idx))
+            for t in user_tokens:
+                hits += self._token_mask(t)[idx]
+            F[:, 6] = np.minimum(hits, MAX_KW)
+
+        F[:, 7] = sim_tfidf
+        F[:, 8] = sim_bm25
+        if sim_dense is not None:
+            F[:, 9] = sim_dense
+        return F
+
+
+def rerank(candidates: List[Dict[str, Any]], profile: Dict[str, Any], user_tokens: List[str], weights=RANK_WEIGHTS,
+           table: FeatureTable | None = None, topk: int | None = None):
+    """
+    Ordena candidatos por score ponderado. Con `table` usa el modo columnar:
+    una matriz de features para todos los candidatos y un producto
+    matriz-vector con los pesos; `feats` solo se arma para los `topk` finales.
+    """
+    if table is not None:
+        return featurize_candidates(candidates, profile, user_tokens, table).rank(weights, topk)
     scored = []
     for c in candidates:
         feats = featureize(c, profile, user_tokens)
@@ -97,4 +208,52 @@ def rerank(candidates: List[Dict[str, Any]], profile: Dict[str, Any], user_token
         c["score"] = score_features(feats, weights)
         scored.append(c)
     scored.sort(key=lambda x: x["score"], reverse=True)
-    return scored
+    return scored if topk is None else scored[:topk]
+
+
+def _scored(c, feats: Dict[str, float], score: float):
+    # rag_build.Candidate o dict (candidatos armados a mano)
+    if isinstance(c, dict):
+        return {**c, "feats": feats, "score": score}
+    return c.scored(feats, score)
+
+
+class CandidateMatrix:
+    """
+    Candidatos de una consulta + su matriz de features (n x len(FEATURES)).
+    Cambiar los pesos solo cuesta `rank`: un producto matriz-vector y un orden.
+    """
+
+    def __init__(self, candidates: List[Dict[str, Any]], F: np.ndarray):
+        self.candidates = candidates
+        self.F = F
+
+    def scores(self, weights: Dict[str, float]) -> np.ndarray:
+        return self.F @ np.array([weights.get(k, 0.0) for k in FEATURES])
+
+    @traced("rerank.rank")
+    def rank(self, weights: Dict[str, float] = RANK_WEIGHTS, topk: int | None = None) -> List[Dict[str, Any]]:
+        scores = self.scores(weights)
+        # Estable: a igual score se conserva el orden de recuperación
+        order = np.argsort(-scores, kind="stable")
+        if topk is not None:
+            order = order[:topk]
+        return self.take(order, scores)
+
+    def take(self, order, scores: np.ndarray) -> List[Dict[str, Any]]:
+        """Candidatos en `order` con feats y score (p. ej. la ruta de path_builder)."""
+        # Copias: la matriz puede quedar en caché y re-puntuarse con otros pesos
+        return [_scored(self.candidates[i], dict(zip(FEATURES, self.F[i].tolist())),
+                        float(scores[i])) for i in order]
+
+
+@traced("rerank.features")
+def featurize_candidates(candidates: List[Dict[str, Any]], profile: Dict[str, Any],
+                         user_tokens: List[str], table: FeatureTable) -> CandidateMatrix:
+    n = len(candidates)
+    idx = np.fromiter((c["idx"] for c in candidates), dtype=np.int64, count=n)
+    sim_t = np.fromiter((c.get("tfidf_norm", 0.0) for c in candidates), dtype=np.float64, count=n)
+    sim_b = np.fromiter((c.get("bm25_norm", 0.0) for c in candidates), dtype=np.float64, count=n)
+    sim_d = np.fromiter((c.get("dense_norm", 0.0) for c in candidates), dtype=np.float64, count=n)
+    return CandidateMatrix(candidates, table.matrix(idx, profile, user_tokens, sim_t, sim_b, sim_d))
+
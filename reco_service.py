@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Nov 27 09:05:31 2025
+
+@author: geam9
+"""
+
+from __future__ import annotations
+import json
+import math
+import logging
+import queue
+import time
+import threading
+import argparse
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Any, Dict, List, Tuple
+from config import (TOPK_CANDIDATES, TOPK_FINAL, RANK_WEIGHTS, RECO_CACHE_SIZE, RECO_CACHE_TTL_S,
+                    SERVICE_WORKERS, SERVICE_MAX_BATCH, SERVICE_MAX_WAIT_MS)
+from rag_build import RAGIndex, SharedIndex, SessionScorer
+from ranker import FeatureTable, featurize_candidates
+from path_builder import plan_path, group_cap
+from caching import LRUTTLCache, normalize_query
+from chat_orchestrator import (ProfileState, build_query_from_state, profile_tokens,
+                               explain_track_messages, explain_track_key)
+from tracing import TRACER, span
+
+log = logging.getLogger(__name__)
+
+# Campos del perfil que se aplican como filtros dentro del índice
+FILTER_FIELDS = ["area", "level", "access", "population", "max_hours"]
+
+
+def _as_state(profile: ProfileState | Dict[str, Any]) -> ProfileState:
+    return profile if isinstance(profile, ProfileState) else ProfileState(**profile)
+
+
+class RecommendationService:
+    """
+    Pipeline de recomendación sin UI: consulta desde el perfil, recuperación
+    filtrada, rerank y explicación. Seguro entre hilos: el índice solo se lee
+    y `swap_index` cambia (índice, features) de forma atómica; cada pedido
+    toma la pareja vigente una sola vez.
+    """
+
+    def __init__(self, index: RAGIndex, table: FeatureTable | None = None,
+                 reco_cache: LRUTTLCache | None = None):
+        self._current: Tuple[RAGIndex, FeatureTable] = (index, table or FeatureTable(index.df))
+        self._lock = threading.Lock()
+        self.reco_cache = reco_cache or LRUTTLCache(maxsize=RECO_CACHE_SIZE, ttl=RECO_CACHE_TTL_S)
+
+    @property
+    def index(self) -> RAGIndex:
+        return self._current[0]
+
+    def swap_index(self, index: RAGIndex, table: FeatureTable | None = None) -> None:
+        pair = (index, table or FeatureTable(index.df))
+        with self._lock:
+            self._current = pair
+
+    # -----------------------------
+    # API Python
+    # -----------------------------
+    def _keys(self, index: RAGIndex, state: ProfileState, weights: Dict[str, float]):
+        query = build_query_from_state(state)
+        tokens = profile_tokens(state)
+        filters = {k: getattr(state, k) for k in FILTER_FIELDS}
+        # Misma consulta normalizada, filtros, tokens, pesos e índice -> mismo ranking
+        reco_key = (index.fingerprint, normalize_query(query),
+                    tuple(sorted(filters.items())), tuple(tokens),
+                    tuple(sorted(weights.items())))
+        return query, tokens, filters, reco_key
+
+    def recommend(self, profile: ProfileState | Dict[str, Any],
+                  weights: Dict[str, float] | None = None, topk: int = TOPK_FINAL,
+                  feature_cache: LRUTTLCache | None = None,
+                  scorer: SessionScorer | None = None) -> List[Dict[str, Any]]:
+        """
+        Ruta de hasta `topk` cursos para un perfil: los de mayor score que
+        caben en `max_hours`, ordenados por nivel (path_builder).
+        `feature_cache` (opcional, p. ej. por sesión) guarda la matriz de
+        candidatos: si solo cambian los pesos, el ranking es un producto
+        matriz-vector más el knapsack. `scorer` (uno por sesión) re-puntúa
+        BM25/tf-idf solo con los términos que cambiaron desde el turno anterior.
+        """
+        return self.recommend_many([profile], weights, topk, feature_cache, scorer)[0]
+
+    def recommend_many(self, profiles: List[ProfileState | Dict[str, Any]],
+                       weights: Dict[str, float] | None = None, topk: int = TOPK_FINAL,
+                       feature_cache: LRUTTLCache | None = None,
+                       scorer: SessionScorer | None = None) -> List[List[Dict[str, Any]]]:
+        """
+        Lote de perfiles: los que no están en caché se agrupan por filtros y
+        cada grupo se recupera con una sola llamada a hybrid_search_many. Con
+        `scorer` (un solo perfil, la misma sesión) se usa hybrid_search_session.
+        """
+        index, table = self._current
+        weights = weights or RANK_WEIGHTS
+        out: List[List[Dict[str, Any]] | None] = [None] * len(profiles)
+        pending: Dict[tuple, List[tuple]] = {}
+        for i, p in enumerate(profiles):
+            state = _as_state(p)
+            query, tokens, filters, reco_key = self._keys(index, state, weights)
+            if topk == TOPK_FINAL:
+                out[i] = self.reco_cache.get(reco_key)
+            if out[i] is not None:
+                continue
+            feat_key = reco_key[:4]
+            cm = feature_cache.get(feat_key) if feature_cache is not None else None
+            if cm is not None:
+                out[i] = self._finish(cm, table, state, weights, topk, reco_key)
+                continue
+            pending.setdefault(reco_key[2], []).append((i, state, query, tokens, filters, reco_key))
+
+        for items in pending.values():
+            with span("service.retrieve"):
+                if scorer is not None and len(profiles) == 1:
+                    cands = [index.hybrid_search_session(scorer, items[0][2], topk=TOPK_CANDIDATES,
+                                                         filters=items[0][4])]
+                else:
+                    cands = index.hybrid_search_many([it[2] for it in items],
+                                                     topk=TOPK_CANDIDATES, filters=items[0][4])
+            for (i, state, _, tokens, _, reco_key), c in zip(items, cands):
+                cm = featurize_candidates(c, state.model_dump(), tokens, table)
+                if feature_cache is not None:
+                    feature_cache.put(reco_key[:4], cm)
+                out[i] = self._finish(cm, table, state, weights, topk, reco_key)
+        return out
+
+    def _finish(self, cm, table, state, weights, topk, reco_key):
+        # Ruta: knapsack dentro de max_hours, diversidad por grupo (sin filtro de área) y orden por nivel
+        ranked = plan_path(cm, table, weights, state.max_hours, max_courses=topk,
+                           max_per_group=group_cap(state.area))
+        return self.reco_cache.put(reco_key, ranked) if topk == TOPK_FINAL else ranked
+
+    def explain(self, profile: ProfileState | Dict[str, Any], ranked: List[Dict[str, Any]],
+                llm, semantic: bool = True):
+        """Explicación de la ruta como stream (ver ChatOpenAI.stream)."""
+        state = _as_state(profile)
+        key = explain_track_key(llm, state, ranked) if semantic else None
+        return llm.stream(explain_track_messages(state, ranked), cache_key=key)
+
+
+def follow(service: RecommendationService, shared: SharedIndex,
+           every: float = 2.0) -> threading.Thread:
+    """
+    Hilo que adopta en `service` cada versión que se publique en `shared`. Un
+    error al cargar o cambiar de índice se registra y el hilo sigue revisando
+    con el índice que ya tenía.
+    """
+    def loop():
+        while True:
+            try:
+                index = shared.get()
+                if index is not None and index is not service.index:
+                    service.swap_index(index)
+            except Exception:
+                log.exception("No se pudo adoptar el índice publicado en %s", shared.cache_dir)
+            time.sleep(every)
+    t = threading.Thread(target=loop, name="reco-follow", daemon=True)
+    t.start()
+    return t
+
+
+# -----------------------------
+# Micro-lotes + pool de workers
+# -----------------------------
+class BatchingExecutor:
+    """
+    Cola de pedidos atendida por `workers` hilos. Cada hilo junta hasta
+    `max_batch` pedidos (esperando a lo sumo `max_wait_ms` desde el primero)
+    con los mismos pesos y los resuelve con un solo recommend_many.
+    """
+
+    def __init__(self, service: RecommendationService, workers: int = SERVICE_WORKERS,
+                 max_batch: int = SERVICE_MAX_BATCH, max_wait_ms: float = SERVICE_MAX_WAIT_MS):
+        self.service = service
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._q: queue.Queue = queue.Queue()
+        self._threads = [threading.Thread(target=self._loop, name=f"reco-{i}", daemon=True)
+                         for i in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, profile: ProfileState | Dict[str, Any],
+               weights: Dict[str, float] | None = None) -> Future:
+        fut: Future = Future()
+        self._q.put((_as_state(profile), weights or RANK_WEIGHTS, fut))
+        return fut
+
+    def shutdown(self) -> None:
+        for _ in self._threads:
+            self._q.put(None)
+        for t in self._threads:
+            t.join()
+
+    def _loop(self) -> None:
+        while True:
+            first = self._q.get()
+            if first is None:
+                return
+            batch = [first]
+            end = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._q.get(timeout=max(0.0, end - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._q.put(None)
+                    break
+                batch.append(item)
+            self._run(batch)
+
+    def _run(self, batch: List[tuple]) -> None:
+        groups: Dict[tuple, List[tuple]] = {}
+        for item in batch:
+            groups.setdefault(tuple(sorted(item[1].items())), []).append(item)
+        for items in groups.values():
+            try:
+                res = self.service.recommend_many([it[0] for it in items], items[0][1])
+            except Exception as e:
+                for it in items:
+                    it[2].set_exception(e)
+                continue
+            for it, r in zip(items, res):
+                it[2].set_result(r)
+
+
+# -----------------------------
+# Endpoint HTTP local
+# -----------------------------
+def course_json(c: Dict[str, Any]) -> Dict[str, Any]:
+    """Candidato -> dict serializable (NaN -> None)."""
+    row = {k: (None if isinstance(v, float) and math.isnan(v) else v)
+           for k, v in c["row"].items()}
+    return {"idx": c["idx"], "score": c.get("score"), "feats": c.get("feats"),
+            "bm25_norm": c.get("bm25_norm"), "tfidf_norm": c.get("tfidf_norm"), "row": row}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    executor: BatchingExecutor = None
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, code: int, body: str, ctype: str = "application/json") -> None:
+        data = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            idx = self.executor.service.index
+            return self._send(200, json.dumps({"status": "ok", "n_docs": int(len(idx.df)),
+                                               "fingerprint": idx.fingerprint}))
+        if self.path == "/metrics":
+            return self._send(200, TRACER.to_prometheus(), "text/plain; version=0.0.4")
+        self._send(404, json.dumps({"error": "not found"}))
+
+    def do_POST(self):
+        try:
+            req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            weights = req.get("weights")
+            if self.path == "/recommend":
+                res = self.executor.submit(req.get("profile", {}), weights).result()
+                return self._send(200, json.dumps(
+                    {"results": [course_json(c) for c in res]}, default=str))
+            if self.path == "/recommend_many":
+                futs = [self.executor.submit(p, weights) for p in req.get("profiles", [])]
+                return self._send(200, json.dumps(
+                    {"results": [[course_json(c) for c in f.result()] for f in futs]}, default=str))
+            self._send(404, json.dumps({"error": "not found"}))
+        except (ValueError, TypeError) as e:
+            self._send(400, json.dumps({"error": str(e)}))
+        except Exception as e:
+            self._send(500, json.dumps({"error": str(e)}))
+
+
+class _Server(ThreadingHTTPServer):
+    # El backlog por defecto (5) resetea conexiones en ráfagas de clientes
+    request_queue_size = 256
+
+
+def serve(executor: BatchingExecutor, host: str = "127.0.0.1", port: int = 8770,
+          in_thread: bool = False) -> ThreadingHTTPServer:
+    """
+    POST /recommend {"profile": {...}, "weights": {...}?}
+    POST /recommend_many {"profiles": [...], "weights": {...}?}
+    GET /health · GET /metrics (Prometheus)
+    """
+    handler = type("RecoHandler", (_Handler,), {"executor": executor})
+    server = _Server((host, port), handler)
+    server.daemon_threads = True
+    if in_thread:
+        threading.Thread(target=server.serve_forever, name="reco-http", daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
+
+
+if __name__ == "__main__":
+    from config import INDEX_CACHE_DIR
+    from rag_build import load_or_build_index
+
+    ap = argparse.ArgumentParser(description="Servicio de recomendación (HTTP local)")
+    ap.add_argument("xlsx")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8770)
+    ap.add_argument("--workers", type=int, default=SERVICE_WORKERS)
+    ap.add_argument("--max-batch", type=int, default=SERVICE_MAX_BATCH)
+    ap.add_argument("--max-wait-ms", type=float, default=SERVICE_MAX_WAIT_MS)
+    ap.add_argument("--follow", action="store_true",
+                    help="adopta cada índice publicado en la caché (python rag_build.py)")
+    args = ap.parse_args()
+
+    rag_index = load_or_build_index(args.xlsx, INDEX_CACHE_DIR)
+    if rag_index is None:
+        raise SystemExit("El catálogo no tiene filas.")
+    service = RecommendationService(rag_index)
+    if args.follow:
+        follow(service, SharedIndex(INDEX_CACHE_DIR))
+    ex = BatchingExecutor(service, args.workers, args.max_batch, args.max_wait_ms)
+    print(f"Servicio en http://{args.host}:{args.port} ({len(rag_index.df)} cursos)")
+    serve(ex, args.host, args.port)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Dec  8 10:22:05 2025
+
+@author: geam9
+"""
+
+# Uso: python -m unittest tests.test_path_builder
+
+from __future__ import annotations
+import itertools
+import unittest
+import numpy as np
+from config import TOPK_FINAL
+from rag_build import RAGIndex
+from reco_service import RecommendationService
+from chat_orchestrator import ProfileState
+from path_builder import select
+from bench.synthetic import make_catalog, normalize_catalog, GRUPOS
+
+
+def _brute(scores, cost, groups, capacity, k, g, penalty=0.5):
+    # Mejor total por enumeración, con la misma penalización por grupo que `select`
+    def value(sub):
+        by = {}
+        for i in sub:
+            key = groups[i] if groups[i] >= 0 and 0 < g < k else ("solo", i)
+            by.setdefault(key, []).append(scores[i])
+        return sum(x * (1.0 if j < g or not 0 < g < k else penalty)
+                   for v in by.values() for j, x in enumerate(sorted(v, reverse=True)))
+    subs = (s for r in range(k + 1) for s in itertools.combinations(range(len(scores)), r)
+            if cost[list(s)].sum() <= capacity)
+    return max(value(s) for s in subs), value
+
+
+class SelectTest(unittest.TestCase):
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            n = int(rng.integers(1, 9))
+            scores = np.round(rng.random(n) * 5, 2)
+            cost = rng.integers(0, 8, n)
+            groups = rng.integers(-1, 3, n)
+            cap, k, g = int(rng.integers(0, 20)), int(rng.integers(1, 6)), int(rng.integers(0, 3))
+            sel = select(scores, cost, groups, cap, k, g)
+            best, value = _brute(scores, cost, groups, cap, k, g)
+            self.assertLessEqual(len(sel), k)
+            self.assertLessEqual(cost[sel].sum(), cap)
+            self.assertAlmostEqual(value(sel), best)
+
+
+class PathTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.service = RecommendationService(RAGIndex(normalize_catalog(make_catalog(600, 0))))
+
+    def test_area_filter_with_large_budget_fills_path(self):
+        # Con filtro de área todos los candidatos comparten grupo: no puede limitar la ruta
+        ranked = self.service.recommend(ProfileState(area=GRUPOS[0], max_hours=200.0,
+                                                     keywords_text="datos"))
+        self.assertEqual(len(ranked), TOPK_FINAL)
+        hours = [c["row"].get("_horas") for c in ranked]
+        self.assertLessEqual(np.nansum(np.asarray(hours, dtype=float)), 200.0)
+
+    def test_budget_is_respected(self):
+        ranked = self.service.recommend(ProfileState(max_hours=10.0, keywords_text="datos"))
+        hours = np.asarray([c["row"].get("_horas") for c in ranked], dtype=float)
+        self.assertTrue(ranked)
+        self.assertLessEqual(np.nansum(hours), 10.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Dec  1 09:27:44 2025
+
+@author: geam9
+"""
+
+from __future__ import annotations
+import re
+import sys
+import zlib
+import threading
+import numpy as np
+from itertools import repeat
+from collections import OrderedDict
+from typing import List, Dict, Tuple, Any
+from config import ANALYZER_CACHE_SIZE
+
+# Minúsculas sin tildes ni diéresis (la ñ se conserva: "año" != "ano")
+_FOLD = str.maketrans("áàäâãéèëêíìïîóòöôõúùüûç", "aaaaaeeeeiiiiooooouuuuc")
+_TOKEN = re.compile(r"[0-9a-zñáàäâãéèëêíìïîóòöôõúùüûç]+")
+
+
+def fold(text: str) -> str:
+    return (text or "").lower().translate(_FOLD)
+
+
+def tokens(text: str) -> List[str]:
+    """Tokens del analizador (español/inglés, sin tildes, minúsculas)."""
+    return [t.translate(_FOLD) for t in _TOKEN.findall((text or "").lower())]
+
+
+class HashedVocab:
+    """
+    Vocabulario por hashing (crc32 mod 2**bits): no guarda los términos, así
+    que ocupa lo mismo con 1k o 1M términos; términos distintos pueden caer en
+    el mismo id. Implementa la parte de la interfaz de dict que usa el
+    analizador (get / [] / setdefault / in / len).
+    """
+    __slots__ = ("bits", "mask")
+
+    def __init__(self, bits: int):
+        self.bits = bits
+        self.mask = (1 << bits) - 1
+
+    def get(self, term: str, default: Any = None) -> int:
+        return zlib.crc32(term.encode("utf-8")) & self.mask
+
+    def __getitem__(self, term: str) -> int:
+        return self.get(term)
+
+    def setdefault(self, term: str, default: Any = None) -> int:
+        return self.get(term)
+
+    def __contains__(self, term: str) -> bool:
+        return True
+
+    def __len__(self) -> int:
+        return self.mask + 1
+
+
+def make_vocab(hash_bits: int) -> Dict[str, int] | HashedVocab:
+    return HashedVocab(hash_bits) if hash_bits else {}
+
+
+def vocab_bytes(vocab: Dict[str, int] | HashedVocab) -> int:
+    """Memoria aproximada del vocabulario (dict + claves + ids)."""
+    if isinstance(vocab, HashedVocab):
+        return sys.getsizeof(vocab)
+    return sys.getsizeof(vocab) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in vocab.items())
+
+
+class Analyzer:
+    """
+    Analizador único de BM25 y TF-IDF: un solo paso (regex compilada + plegado
+    de tildes) por documento o consulta produce ids enteros de término que
+    consumen ambos motores (BM25 usa el id como columna; TF-IDF arma uni y
+    bigramas sobre los ids). Términos de consulta fuera del vocabulario -> -1.
+
+    Plegar tildes carácter por carácter es lo caro: con vocabulario exacto
+    cada forma distinta del texto se pliega una sola vez y queda asociada a su
+    id. `query` guarda en un LRU las consultas ya analizadas (se invalida solo
+    si el vocabulario crece). Con `hash_bits` > 0 el vocabulario es un
+    HashedVocab.
+    """
+
+    def __init__(self, hash_bits: int = 0, cache_size: int = ANALYZER_CACHE_SIZE):
+        self.hash_bits = hash_bits
+        self.terms = make_vocab(hash_bits)
+        self._surface: Dict[str, int] = {}      # forma en el texto -> id (vocabulario exacto)
+        self.cache_size = cache_size
+        self._queries: OrderedDict[str, Tuple[int, np.ndarray]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def n_terms(self) -> int:
+        return len(self.terms)
+
+    def encode(self, text: str, grow: bool = False) -> np.ndarray:
+        toks = _TOKEN.findall((text or "").lower())
+        terms = self.terms
+        if self.hash_bits:
+            return np.fromiter((terms.get(t.translate(_FOLD)) for t in toks),
+                               dtype=np.int64, count=len(toks))
+        surface = self._surface
+        # Formas nuevas en orden de aparición: ids deterministas entre procesos
+        for t in [t for t in dict.fromkeys(toks) if t not in surface]:
+            folded = t.translate(_FOLD)
+            j = terms.setdefault(folded, len(terms)) if grow else terms.get(folded, -1)
+            if j >= 0:
+                surface[t] = j
+        return np.fromiter(map(surface.get, toks, repeat(-1)), dtype=np.int64, count=len(toks))
+
+    def encode_many(self, texts: List[str], grow: bool = False) -> List[np.ndarray]:
+        return [self.encode(t, grow) for t in texts]
+
+    def query(self, text: str) -> np.ndarray:
+        """`encode` de una consulta, con caché LRU (no agrega términos)."""
+        n = len(self.terms)
+        with self._lock:
+            hit = self._queries.get(text)
+            if hit is not None and hit[0] == n:
+                self._queries.move_to_end(text)
+                return hit[1]
+        ids = self.encode(text)
+        with self._lock:
+            self._queries[text] = (n, ids)
+            self._queries.move_to_end(text)
+            while len(self._queries) > self.cache_size:
+                self._queries.popitem(last=False)
+        return ids
+
+    # -----------------------------
+    # Persistencia
+    # -----------------------------
+    def memory_bytes(self) -> int:
+        return vocab_bytes(self.terms) + vocab_bytes(self._surface)
+
+    def to_arrays(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray], List[str]]:
+        return {"hash_bits": self.hash_bits}, {}, [] if self.hash_bits else list(self.terms)
+
+    @classmethod
+    def from_arrays(cls, meta: Dict[str, Any], arrays: Dict[str, np.ndarray],
+                    terms: List[str]) -> "Analyzer":
+        self = cls(hash_bits=meta.get("hash_bits", 0))
+        if not self.hash_bits:
+            self.terms = dict(zip(terms, range(len(terms))))
+        return self
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Thu Nov 20 09:48:31 2025
+
+@author: geam9
+"""
+
+from __future__ import annotations
+import numpy as np
+from scipy import sparse
+from typing import List, Dict, Tuple, Any
+from bm25_sparse import rows_to_csr
+
+
+def ngram_keys(ids: np.ndarray, ngram_range: Tuple[int, int] = (1, 2)) -> np.ndarray:
+    """
+    Claves enteras de los n-gramas de un documento (ids del analizador):
+    unigrama = id, bigrama = (a + 1) << 32 | b. Los ids -1 (fuera del
+    vocabulario) se saltan y cortan los bigramas que los cruzan.
+    """
+    parts = []
+    if ngram_range[0] <= 1:
+        parts.append(ids[ids >= 0])
+    if ngram_range[1] >= 2 and len(ids) > 1:
+        a, b = ids[:-1], ids[1:]
+        ok = (a >= 0) & (b >= 0)
+        parts.append(((a[ok] + 1) << 32) | b[ok])
+    return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+
+def corpus_keys(docs: List[np.ndarray],
+                ngram_range: Tuple[int, int] = (1, 2)) -> Tuple[np.ndarray, np.ndarray]:
+    """`ngram_keys` de todo el corpus de una vez: (fila del documento, clave) aplanados."""
+    lens = np.fromiter((len(d) for d in docs), dtype=np.int64, count=len(docs))
+    ids = np.concatenate(docs) if docs else np.zeros(0, dtype=np.int64)
+    doc = np.repeat(np.arange(len(docs)), lens)
+    rows, keys = [], []
+    if ngram_range[0] <= 1:
+        rows.append(doc)
+        keys.append(ids)
+    if ngram_range[1] >= 2 and len(ids) > 1:
+        # Bigramas: pares consecutivos que no cruzan el borde entre documentos
+        same = doc[:-1] == doc[1:]
+        rows.append(doc[:-1][same])
+        keys.append(((ids[:-1][same] + 1) << 32) | ids[1:][same])
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(rows), np.concatenate(keys)
+
+
+def remap_keys(keys: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """Claves armadas con ids locales -> claves con ids globales (lut[id_local])."""
+    out = np.empty_like(keys)
+    uni = keys < (1 << 32)
+    out[uni] = lut[keys[uni]]
+    bi = keys[~uni]
+    out[~uni] = ((lut[(bi >> 32) - 1] + 1) << 32) | lut[bi & 0xFFFFFFFF]
+    return out
+
+
+def _hash_cols(keys: np.ndarray, mask: int) -> np.ndarray:
+    # Hash multiplicativo (Fibonacci) de la clave: 32 bits altos & mask
+    h = keys.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    return ((h >> np.uint64(32)) & np.uint64(mask)).astype(np.int64)
+
+
+class SparseTfidf:
+    """
+    TF-IDF con el esquema de TfidfVectorizer (idf suavizado
+    ln((1+n)/(1+df)) + 1 y norma l2) sobre uni y bigramas, guardando los
+    conteos junto a los pesos para poder crecer sin re-ajustar.
+
+    Documentos y consultas llegan como ids de término del Analyzer compartido
+    (text_analyzer); cada n-grama es una clave entera (ver `ngram_keys`) y
+    `keys` guarda la clave de cada columna, sin strings. `add_docs` agrega
+    columnas y filas a un segmento delta ponderadas con el idf vigente;
+    `remove_docs` descuenta frecuencias. El idf de las consultas siempre está
+    al día; las filas base se re-ponderan en `compact`.
+
+    `dtype` es el de los pesos (float32 en modo compacto); con `hash_bits` > 0
+    la columna es un hash de la clave en 2**hash_bits columnas (sin min_df).
+    """
+
+    def __init__(self, ngram_range: Tuple[int, int] = (1, 2), min_df: int = 1,
+                 dtype=np.float64, hash_bits: int = 0):
+        self.ngram_range = tuple(ngram_range)
+        self.min_df = min_df
+        self.dtype = np.dtype(dtype)
+        self.hash_bits = hash_bits
+        self.keys = np.zeros(0, dtype=np.int64)        # clave de n-grama por columna
+        self._lookup: Tuple[np.ndarray, np.ndarray] | None = None
+        self.doc_freq = np.zeros(0, dtype=np.int64)
+        self.idf = np.zeros(0)
+        self.n_docs = 0          # documentos vivos (para idf)
+        self.mat = sparse.csc_matrix((0, 0))
+        self.counts = np.zeros(0, dtype=np.int32)      # alineado con mat.data
+        # Segmento delta: por documento (ids de término, conteos, pesos l2)
+        self._delta: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self._delta_mat: sparse.csr_matrix | None = None
+
+    @property
+    def n_cols(self) -> int:
+        return (1 << self.hash_bits) if self.hash_bits else len(self.keys)
+
+    def fit(self, docs: List[np.ndarray]) -> "SparseTfidf":
+        return self.fit_counts(*self.count_keys(docs))
+
+    def count_keys(self, docs: List[np.ndarray]) -> Tuple[sparse.csr_matrix, np.ndarray]:
+        """
+        Conteos (doc x columna) de un bloque de documentos y la clave de cada
+        columna (ordenadas; vacío con hashing, donde la columna es el hash).
+        No modifica el motor: sirve para contar por partes en otros procesos.
+        """
+        rows, keys = corpus_keys(docs, self.ngram_range)
+        if self.hash_bits:
+            uniq, cols = np.zeros(0, dtype=np.int64), _hash_cols(keys, self.n_cols - 1)
+        else:
+            # Vocabulario = claves distintas del bloque (ordenadas), sin strings
+            uniq, cols = np.unique(keys, return_inverse=True)
+        # COO -> CSR suma duplicados: data = frecuencia del n-grama en el doc
+        counts = sparse.csr_matrix((np.ones(len(cols), dtype=np.int32), (rows, cols)),
+                                   shape=(len(docs), self.n_cols if self.hash_bits else len(uniq)))
+        counts.sum_duplicates()
+        return counts, uniq
+
+    def fit_counts(self, counts: sparse.csr_matrix, keys: np.ndarray) -> "SparseTfidf":
+        """Ajuste desde conteos ya armados (p. ej. fusionados de varios bloques)."""
+        self.keys = keys
+        self._lookup = None
+        if self.min_df > 1 and not self.hash_bits:
+            counts = self._drop_columns(counts, np.bincount(counts.indices, minlength=counts.shape[1])
+                                        >= self.min_df)
+        self._set_base(counts)
+        return self
+
+    def _drop_columns(self, counts: sparse.csr_matrix, used: np.ndarray) -> sparse.csr_matrix:
+        # Quita columnas (y sus claves) y renumera
+        self.keys = self.keys[used]
+        self._lookup = None
+        return counts[:, np.flatnonzero(used)].tocsr()
+
+    def _set_base(self, counts: sparse.csr_matrix) -> None:
+        counts.sort_indices()
+        self.doc_freq = np.bincount(counts.indices, minlength=counts.shape[1]).astype(np.int64)
+        self.n_docs = counts.shape[0]
+        self._refresh_idf()
+        # Base en CSC (término x docs contiguo, como BM25): una consulta solo
+        # recorre las listas de sus términos. Norma l2 por documento
+        csc = counts.tocsc()
+        csc.sort_indices()
+        self.counts = csc.data.astype(np.int32)
+        w = self.counts * self.idf[np.repeat(np.arange(csc.shape[1]), np.diff(csc.indptr))]
+        norm = np.sqrt(np.bincount(csc.indices, weights=w * w, minlength=csc.shape[0]))
+        w = w / np.maximum(norm, 1e-12)[csc.indices]
+        self.mat = sparse.csc_matrix((w.astype(self.dtype), csc.indices, csc.indptr),
+                                     shape=csc.shape)
+        self._delta, self._delta_mat = [], None
+
+    def _refresh_idf(self) -> None:
+        self.idf = np.log((1 + self.n_docs) / (1 + self.doc_freq.astype(np.float64))) + 1
+
+    def _weigh(self, counts: sparse.csr_matrix) -> sparse.csr_matrix:
+        w = counts.data * self.idf[counts.indices]
+        # Norma l2 por fila, como en _set_base (sin sklearn en la ruta de consulta)
+        rows = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+        norm = np.sqrt(np.bincount(rows, weights=w * w, minlength=counts.shape[0]))
+        w = w / np.maximum(norm, 1e-12)[rows]
+        return sparse.csr_matrix((w.astype(self.dtype), counts.indices, counts.indptr),
+                                 shape=counts.shape)
+
+    def _columns(self, keys: np.ndarray, grow: bool) -> np.ndarray:
+        """Claves -> columnas; desconocidas: nuevas columnas si `grow`, si no -1."""
+        if self.hash_bits:
+            return _hash_cols(keys, self.n_cols - 1)
+        if self._lookup is None:
+            order = np.argsort(self.keys, kind="stable")
+            self._lookup = (self.keys[order], order)
+        sk, sc = self._lookup
+        pos = np.minimum(np.searchsorted(sk, keys), max(len(sk) - 1, 0))
+        hit = sk[pos] == keys if len(sk) else np.zeros(len(keys), dtype=bool)
+        cols = np.where(hit, sc[pos] if len(sk) else -1, -1)
+        if grow and not hit.all():
+            new = np.unique(keys[~hit])
+            new_cols = len(self.keys) + np.arange(len(new))
+            cols[~hit] = new_cols[np.searchsorted(new, keys[~hit])]
+            self.keys = np.concatenate([self.keys, new])
+            # Se insertan en el orden existente (sin re-ordenar todo el vocabulario)
+            at = np.searchsorted(sk, new)
+            self._lookup = (np.insert(sk, at, new), np.insert(sc, at, new_cols))
+        return cols
+
+    def _count_rows(self, docs: List[np.ndarray], grow: bool) -> List[Tuple[np.ndarray, np.ndarray]]:
+        if not docs:
+            return []
+        # Una sola búsqueda de columnas para todo el lote
+        keys = [ngram_keys(d, self.ngram_range) for d in docs]
+        cols = self._columns(np.concatenate(keys), grow)
+        rows = []
+        for c in np.split(cols, np.cumsum([len(k) for k in keys[:-1]])):
+            rows.append(np.unique(c[c >= 0], return_counts=True))
+        return rows
+
+    # -----------------------------
+    # Actualizaciones incrementales
+    # -----------------------------
+    def add_docs(self, docs: List[np.ndarray]) -> None:
+        rows = self._count_rows(docs, grow=True)
+        if self.n_cols > len(self.doc_freq):
+            self.doc_freq = np.concatenate(
+                [self.doc_freq, np.zeros(self.n_cols - len(self.doc_freq), dtype=np.int64)])
+        for ids, _ in rows:
+            self.doc_freq[ids] += 1
+        self.n_docs += len(docs)
+        self._refresh_idf()
+        w = self._weigh(rows_to_csr(rows, self.n_cols, np.float64))
+        for k, (ids, cnt) in enumerate(rows):
+            self._delta.append((ids, cnt.astype(np.int32), w.data[w.indptr[k]:w.indptr[k + 1]]))
+        self._delta_mat = None
+
+    def remove_docs(self, docs: List[np.ndarray]) -> None:
+        """Descuenta documentos (por sus ids de término); las filas quedan hasta `compact`."""
+        for ids, _ in self._count_rows(docs, grow=False):
+            self.doc_freq[ids] -= 1
+        self.n_docs -= len(docs)
+        self._refresh_idf()
+
+    def _delta_matrix(self) -> sparse.csr_matrix:
+        if self._delta_mat is None:
+            self._delta_mat = rows_to_csr([(i, w) for i, _, w in self._delta],
+                                          self.n_cols, self.dtype)
+        return self._delta_mat
+
+    def compact(self, keep: np.ndarray) -> np.ndarray | None:
+        """
+        Re-pondera base + delta con el idf vigente y deja solo las filas `keep`.
+        Retorna la columna nueva de cada columna anterior (-1 = quitada), o
+        None si no se renumeró.
+        """
+        n_cols = self.n_cols
+        base = sparse.csc_matrix((self.counts, self.mat.indices, self.mat.indptr),
+                                 shape=self.mat.shape).tocsr()
+        base = sparse.csr_matrix((base.data, base.indices, base.indptr),
+                                 shape=(base.shape[0], n_cols))
+        delta = rows_to_csr([(i, c) for i, c, _ in self._delta], n_cols, np.int32)
+        counts = sparse.vstack([base, delta], format="csr")[keep]
+        new_col = None
+        if not self.hash_bits:
+            used = np.bincount(counts.indices, minlength=n_cols) > 0
+            new_col = np.where(used, np.cumsum(used) - 1, -1)
+            counts = self._drop_columns(counts, used)
+        self._set_base(counts)
+        return new_col
+
+    # -----------------------------
+    # Consultas
+    # -----------------------------
+    def transform(self, queries: List[np.ndarray]) -> sparse.csr_matrix:
+        """Vectores tf-idf l2 de las consultas (n-gramas fuera del vocabulario se ignoran)."""
+        counts = rows_to_csr(self._count_rows(queries, grow=False), self.n_cols, np.float64)
+        counts.sort_indices()
+        return self._weigh(counts)
+
+    def scores_many(self, queries: List[np.ndarray], docs: np.ndarray | None = None) -> np.ndarray:
+        """
+        Coseno (n_consultas x n_docs). Las filas ya están normalizadas (l2), así
+        que es un producto punto: Q @ M.T recorre solo las columnas de los
+        términos de la consulta (M.T de una CSC es CSR, sin copia).
+        """
+        return self.scores_vectors(self.transform(queries), docs)
+
+    def scores_vectors(self, qv: sparse.csr_matrix, docs: np.ndarray | None = None) -> np.ndarray:
+        """`scores_many` para vectores de consulta ya calculados con `transform`."""
+        res = qv[:, :self.mat.shape[1]] @ self.mat.T
+        if self._delta:
+            res = sparse.hstack([res, qv @ self._delta_matrix().T], format="csr")
+        return (res if docs is None else res[:, docs]).toarray()
+
+    # -----------------------------
+    # Re-puntuación incremental
+    # -----------------------------
+    def term_counts(self, query: np.ndarray) -> Dict[int, int]:
+        """Conteo por columna de los n-gramas de una consulta (ids del analizador)."""
+        ids, cnt = self._count_rows([query], grow=False)[0]
+        return dict(zip(ids.tolist(), cnt.tolist()))
+
+    def columns_dot(self, ids: np.ndarray, w: np.ndarray) -> np.ndarray:
+        """M[:, ids] @ w para todos los documentos (base + delta): sin normalizar la consulta."""
+        base = ids < self.mat.shape[1]
+        out = np.asarray(self.mat[:, ids[base]] @ w[base], dtype=np.float64).ravel()
+        if self._delta:
+            out = np.concatenate([out, np.asarray(self._delta_matrix()[:, ids] @ w,
+                                                  dtype=np.float64).ravel()])
+        return out
+
+    # -----------------------------
+    # Persistencia
+    # -----------------------------
+    def memory_bytes(self) -> Dict[str, int]:
+        arrays = (self.mat.data.nbytes + self.mat.indices.nbytes + self.mat.indptr.nbytes
+                  + self.counts.nbytes + self.idf.nbytes + self.doc_freq.nbytes + self.keys.nbytes
+                  + sum(i.nbytes + c.nbytes + w.nbytes for i, c, w in self._delta))
+        return {"arrays": int(arrays)}
+
+    def to_arrays(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray], List[str]]:
+        """(meta, arreglos, términos: vacío, las claves van en `keys`) sin segmento delta."""
+        assert not self._delta, "compactar antes de persistir"
+        meta = {"ngram_range": list(self.ngram_range), "min_df": self.min_df,
+                "dtype": self.dtype.name, "hash_bits": self.hash_bits,
+                "n_docs": self.n_docs, "shape": list(self.mat.shape)}
+        arrays = {"data": self.mat.data, "indices": self.mat.indices,
+                  "indptr": self.mat.indptr, "counts": self.counts,
+                  "idf": self.idf, "doc_freq": self.doc_freq, "keys": self.keys}
+        return meta, arrays, []
+
+    @classmethod
+    def from_arrays(cls, meta: Dict[str, Any], arrays: Dict[str, np.ndarray],
+                    terms: List[str]) -> "SparseTfidf":
+        self = cls(ngram_range=tuple(meta["ngram_range"]), min_df=meta["min_df"],
+                   dtype=meta.get("dtype", "float64"), hash_bits=meta.get("hash_bits", 0))
+        self.keys = np.array(arrays["keys"])
+        self.mat = sparse.csc_matrix((arrays["data"], arrays["indices"], arrays["indptr"]),
+                                     shape=tuple(meta["shape"]), copy=False)
+        self.counts = arrays["counts"]
+        # Estadísticas pequeñas en memoria propia: cambian con add/remove_docs
+        self.idf = np.array(arrays["idf"])
+        self.doc_freq = np.array(arrays["doc_freq"])
+        self.n_docs = meta["n_docs"]
+        return self
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Nov 26 09:20:44 2025
+
+@author: geam9
+"""
+
+from __future__ import annotations
+import io
+import json
+import time
+import pstats
+import cProfile
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import nullcontext
+from functools import wraps
+from typing import Any, Callable, Dict, List
+from config import TRACING_ENABLED, TRACE_WINDOW
+
+# Límites (segundos) de los buckets acumulados para Prometheus
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+_NOOP = nullcontext()
+
+
+class RollingHistogram:
+    """
+    Duraciones de una etapa: ventana de las últimas `window` muestras (para
+    percentiles) + buckets y totales acumulados desde el inicio (Prometheus).
+    """
+
+    def __init__(self, window: int = TRACE_WINDOW):
+        self.samples: deque = deque(maxlen=window)
+        self.buckets = [0] * (len(BUCKETS) + 1)     # último = +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def summary(self) -> Dict[str, float]:
+        s = sorted(self.samples)
+        n = len(s)
+
+        def pct(p: float) -> float:
+            return s[min(n - 1, int(p * n))] * 1000.0 if n else 0.0
+        return {"count": self.count, "total_s": self.total,
+                "mean_ms": (sum(s) / n * 1000.0) if n else 0.0,
+                "p50_ms": pct(0.50), "p95_ms": pct(0.95), "p99_ms": pct(0.99),
+                "max_ms": s[-1] * 1000.0 if n else 0.0}
+
+
+class Tracer:
+    """
+    Registro de spans por nombre de etapa. Desactivado, `span` devuelve un
+    contexto vacío compartido y `traced` solo revisa un booleano: el costo es
+    una llamada de función por etapa.
+    """
+
+    def __init__(self, enabled: bool = TRACING_ENABLED):
+        self.enabled = enabled
+        self._hists: Dict[str, RollingHistogram] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            h = self._hists.get(name)
+            if h is None:
+                h = self._hists[name] = RollingHistogram()
+            h.add(seconds)
+
+    def span(self, name: str):
+        return _Span(self, name) if self.enabled else _NOOP
+
+    def traced(self, name: str) -> Callable:
+        def deco(fn: Callable) -> Callable:
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                t = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - t)
+            return wrapper
+        return deco
+
+    def reset(self) -> None:
+        with self._lock:
+            self._hists.clear()
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {k: h.summary() for k, h in sorted(self._hists.items())}
+
+    # -----------------------------
+    # Exportación
+    # -----------------------------
+    def to_json(self) -> str:
+        return json.dumps({"timestamp": time.time(), "stages": self.snapshot()}, indent=2)
+
+    def to_prometheus(self, metric: str = "rag_stage_duration_seconds") -> str:
+        lines = [f"# HELP {metric} Duración de cada etapa del pipeline.",
+                 f"# TYPE {metric} histogram"]
+        with self._lock:
+            items = sorted(self._hists.items())
+            for name, h in items:
+                acc = 0
+                for le, c in zip(BUCKETS + ["+Inf"], h.buckets):
+                    acc += c
+                    lines.append(f'{metric}_bucket{{stage="{name}",le="{le}"}} {acc}')
+                lines.append(f'{metric}_sum{{stage="{name}"}} {h.total:.6f}')
+                lines.append(f'{metric}_count{{stage="{name}"}} {h.count}')
+        return "\n".join(lines) + "\n"
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "t0")
+
+    def __init__(self, tracer: Tracer, name: str):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, time.perf_counter() - self.t0)
+        return False
+
+
+# Instancia del proceso (la comparten todas las sesiones de Streamlit)
+TRACER = Tracer()
+span = TRACER.span
+traced = TRACER.traced
+record = TRACER.record
+
+
+# -----------------------------
+# cProfile de un rerun
+# -----------------------------
+class RerunProfile:
+    """cProfile del hilo actual entre start() y stop(); stop() retorna el top por tiempo acumulado."""
+
+    def __init__(self):
+        self._prof = cProfile.Profile()
+        self._prof.enable()
+
+    def stop(self, limit: int = 40) -> str:
+        self._prof.disable()
+        out = io.StringIO()
+        pstats.Stats(self._prof, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+
+def stage_rows(snapshot: Dict[str, Dict[str, float]]) -> List[Dict[str, Any]]:
+    """Filas para mostrar en tabla (una por etapa)."""
+    return [{"etapa": k, **{m: round(v, 2) if isinstance(v, float) else v for m, v in s.items()}}
+            for k, s in snapshot.items()]
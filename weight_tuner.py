@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Nov 17 11:05:22 2025
+
+@author: geam9
+"""
+
+from __future__ import annotations
+import json
+import argparse
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List
+from config import RANK_WEIGHTS, TOPK_CANDIDATES, TOPK_FINAL
+from ranker import FEATURES, FeatureTable, featurize_candidates
+from path_builder import plan_path, group_cap
+
+# Tope de valores (pesos x consultas x aceptados x candidatos) por bloque
+_MAX_BLOCK = 20_000_000
+# Mejores vectores (por NDCG) que se re-evalúan sobre la ruta de plan_path
+_PATH_REFINE = 50
+
+
+# -----------------------------
+# Log de consultas aceptadas
+# -----------------------------
+def load_log(path: str) -> List[Dict[str, Any]]:
+    """
+    JSONL, un registro por consulta:
+    {"query": str, "profile": {...}, "user_tokens": [...],
+     "filters": {...} (opcional), "accepted": [idx de fila del catálogo]}
+    """
+    with open(path, "r", encoding="utf-8") as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+class EvalSet:
+    """
+    Matrices de features de todas las consultas del log, rellenadas a n_max
+    candidatos: F (Q x n_max x n_features), rel y valid (Q x n_max) y el número
+    de cursos aceptados por consulta (para el DCG ideal). `queries` guarda por
+    consulta (CandidateMatrix, aceptados, max_hours, tope por grupo) para
+    re-evaluar sobre la ruta (evaluate_path).
+    """
+
+    def __init__(self, F: np.ndarray, rel: np.ndarray, valid: np.ndarray, n_rel: np.ndarray,
+                 queries: List[tuple] | None = None):
+        self.F = F
+        self.rel = rel
+        self.valid = valid
+        self.n_rel = n_rel
+        self.queries = queries or []
+
+
+def build_eval_set(index, table: FeatureTable, records: List[Dict[str, Any]],
+                   topk: int = TOPK_CANDIDATES) -> EvalSet:
+    mats, rels, n_rel, queries = [], [], [], []
+    for r in records:
+        cands = index.hybrid_search(r["query"], topk=topk, filters=r.get("filters"))
+        profile = r.get("profile", {})
+        m = featurize_candidates(cands, profile, r.get("user_tokens", []), table)
+        accepted = set(int(a) for a in r.get("accepted", []))
+        # Presupuesto y área como en el servicio (el filtro manda sobre el perfil)
+        filters = r.get("filters") or {}
+        budget = filters.get("max_hours", profile.get("max_hours"))
+        area = filters.get("area", profile.get("area"))
+        queries.append((m, accepted, budget, group_cap(area)))
+        mats.append(m.F)
+        rels.append(np.array([c["idx"] in accepted for c in cands], dtype=bool))
+        n_rel.append(len(accepted))
+    n_max = max((len(x) for x in rels), default=0)
+    Q = len(records)
+    F = np.zeros((Q, n_max, len(FEATURES)))
+    rel = np.zeros((Q, n_max), dtype=bool)
+    valid = np.zeros((Q, n_max), dtype=bool)
+    for q, (f, r) in enumerate(zip(mats, rels)):
+        F[q, :len(r)] = f
+        rel[q, :len(r)] = r
+        valid[q, :len(r)] = True
+    return EvalSet(F, rel, valid, np.array(n_rel), queries)
+
+
+def sample_weights(n: int, base: Dict[str, float] = RANK_WEIGHTS, seed: int = 0) -> np.ndarray:
+    """n vectores de pesos uniformes en [0, 2*base]; la fila 0 es `base`."""
+    rng = np.random.default_rng(seed)
+    w0 = np.array([base.get(k, 0.0) for k in FEATURES])
+    W = rng.uniform(0.0, 2.0, size=(n, len(FEATURES))) * w0
+    W[0] = w0
+    return W
+
+
+# -----------------------------
+# Métricas (vectorizadas sobre pesos x consultas)
+# -----------------------------
+def evaluate(es: EvalSet, W: np.ndarray, k: int = TOPK_FINAL) -> Dict[str, np.ndarray]:
+    """
+    NDCG@k y MRR medios por vector de pesos (filas de W). No ordena listas:
+    el rank de cada curso aceptado es cuántos candidatos lo superan (empates:
+    gana el de menor posición, igual que el orden estable de `rank`). Se
+    procesa en bloques de pesos para acotar la memoria a ~_MAX_BLOCK valores.
+    """
+    Q, n, _ = es.F.shape
+    m = W.shape[0]
+    ndcg, mrr = np.zeros(m), np.zeros(m)
+    if Q == 0 or n == 0:
+        return {"ndcg": ndcg, "mrr": mrr}
+    kk = min(k, n)
+    disc = np.append(1.0 / np.log2(np.arange(2, kk + 2)), 0.0)
+    idcg = np.concatenate([[0.0], np.cumsum(disc[:kk])])[np.minimum(es.n_rel, kk)]
+
+    # Posiciones de los aceptados por consulta, rellenadas a R
+    R = max(int(es.rel.sum(axis=1).max()), 1)
+    rel_ok = np.arange(R) < es.rel.sum(axis=1)[:, None]
+    rel_pos = np.zeros((Q, R), dtype=np.int64)
+    rel_pos[rel_ok] = np.nonzero(es.rel)[1]
+    pos = np.arange(n)
+    earlier = pos[None, None, :] < rel_pos[:, :, None]          # Q x R x n
+
+    block = max(1, _MAX_BLOCK // (Q * n * R))
+    for a in range(0, m, block):
+        S = np.einsum("qnf,mf->mqn", es.F, W[a:a + block])
+        S[:, ~es.valid] = -np.inf
+        s_rel = np.take_along_axis(S, np.broadcast_to(rel_pos, S.shape[:1] + rel_pos.shape), axis=-1)
+        Sx, sr = S[:, :, None, :], s_rel[..., None]
+        rank = (Sx > sr).sum(axis=-1) + ((Sx == sr) & earlier).sum(axis=-1)
+        rank = np.where(rel_ok, rank, n)
+        dcg = disc[np.minimum(rank, kk)].sum(axis=-1)
+        nd = np.divide(dcg, idcg, out=np.zeros_like(dcg), where=idcg > 0)
+        rr = np.where(rel_ok.any(axis=1), 1.0 / (rank.min(axis=-1) + 1), 0.0)
+        ndcg[a:a + block] = nd.mean(axis=1)
+        mrr[a:a + block] = rr.mean(axis=1)
+    return {"ndcg": ndcg, "mrr": mrr}
+
+
+def evaluate_path(es: EvalSet, table: FeatureTable, W: np.ndarray,
+                  k: int = TOPK_FINAL) -> np.ndarray:
+    """
+    Recall de la ruta por vector de pesos: fracción media de los aceptados
+    (hasta k) que entran en la ruta de plan_path, que es lo que ve el
+    usuario (presupuesto de horas, diversidad por grupo). No es vectorizable:
+    un knapsack por consulta y vector, por eso solo se usa en la lista corta.
+    """
+    out = np.zeros(W.shape[0])
+    if not es.queries:
+        return out
+    for j, w in enumerate(W):
+        weights = dict(zip(FEATURES, w.tolist()))
+        rec = []
+        for cm, accepted, budget, cap in es.queries:
+            if not accepted:
+                rec.append(0.0)
+                continue
+            path = plan_path(cm, table, weights, budget, max_courses=k, max_per_group=cap)
+            hits = sum(c["idx"] in accepted for c in path)
+            rec.append(hits / min(len(accepted), k))
+        out[j] = float(np.mean(rec))
+    return out
+
+
+def tune(index, table: FeatureTable, records: List[Dict[str, Any]], n: int = 5000,
+         k: int = TOPK_FINAL, seed: int = 0, refine: int = _PATH_REFINE) -> pd.DataFrame:
+    """
+    Evalúa n vectores de pesos. NDCG@k y MRR miden el orden por score (rank),
+    no la ruta que muestra la app: plan_path además recorta por horas y
+    penaliza repetir grupo. Por eso los `refine` mejores por NDCG (y la base)
+    se re-evalúan con evaluate_path (`path_recall@k`; NaN en el resto) y la
+    tabla queda ordenada primero por esa métrica.
+    """
+    es = build_eval_set(index, table, records)
+    W = sample_weights(n, seed=seed)
+    res = evaluate(es, W, k=k)
+    out = pd.DataFrame(W, columns=FEATURES)
+    out[f"ndcg@{k}"] = res["ndcg"]
+    out["mrr"] = res["mrr"]
+    out["is_base"] = np.arange(n) == 0
+    short = np.union1d(np.lexsort((-res["mrr"], -res["ndcg"]))[:refine], [0])
+    out[f"path_recall@{k}"] = np.nan
+    out.loc[short, f"path_recall@{k}"] = evaluate_path(es, table, W[short], k=k)
+    return out.sort_values([f"path_recall@{k}", f"ndcg@{k}", "mrr"], ascending=False,
+                           kind="stable", na_position="last")
+
+
+if __name__ == "__main__":
+    from config import INDEX_CACHE_DIR
+    from rag_build import load_or_build_index
+
+    ap = argparse.ArgumentParser(description="Búsqueda offline de RANK_WEIGHTS")
+    ap.add_argument("xlsx")
+    ap.add_argument("log", help="JSONL con consultas y cursos aceptados")
+    ap.add_argument("-n", type=int, default=5000)
+    ap.add_argument("-k", type=int, default=TOPK_FINAL)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--refine", type=int, default=_PATH_REFINE,
+                    help="mejores por NDCG que se re-evalúan sobre la ruta (plan_path)")
+    args = ap.parse_args()
+
+    rag_index = load_or_build_index(args.xlsx, INDEX_CACHE_DIR)
+    report = tune(rag_index, FeatureTable(rag_index.df), load_log(args.log),
+                  n=args.n, k=args.k, seed=args.seed, refine=args.refine)
+    print(report.head(10).to_string(index=False))
+    print("\nBase:\n" + report[report["is_base"]].to_string(index=False))